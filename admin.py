@@ -4,7 +4,7 @@ from __future__ import unicode_literals
 
 from django.contrib.gis import admin
 
-from .models import ExternalDataSource, ExternalDataRequest, ExternalDataRequestFile
+from .models import ExternalDataSource, ExternalDataRequest, ExternalDataRequestFile, ExternalDataImportCheckpoint, ExternalDataEncryptionKey
 
 @admin.register(ExternalDataSource)
 class ExternalDataSourceAdmin(admin.OSMGeoAdmin):
@@ -19,5 +19,18 @@ class ExternalDataRequestAdmin(admin.OSMGeoAdmin):
 
 @admin.register(ExternalDataRequestFile)
 class ExternalDataRequestFileAdmin(admin.OSMGeoAdmin):
-    list_display = ('request', 'id', 'source', 'uploaded', 'processed', 'skipped', 'encrypted',)
+    list_display = ('request', 'id', 'source', 'uploaded', 'processed', 'skipped', 'encrypted', 'claimed_by', 'duplicate_of',)
     list_filter = ('processed', 'skipped', 'uploaded', 'source', 'request')
+    search_fields = ('content_digest',)
+
+@admin.register(ExternalDataImportCheckpoint)
+class ExternalDataImportCheckpointAdmin(admin.OSMGeoAdmin):
+    list_display = ('data_file', 'member', 'records', 'started', 'completed',)
+    list_filter = ('started', 'completed',)
+    search_fields = ('member',)
+
+@admin.register(ExternalDataEncryptionKey)
+class ExternalDataEncryptionKeyAdmin(admin.OSMGeoAdmin):
+    list_display = ('key_id', 'data_file', 'created',)
+    list_filter = ('created',)
+    search_fields = ('key_id',)
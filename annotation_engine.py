@@ -0,0 +1,61 @@
+# pylint: disable=line-too-long
+
+import re
+import string
+
+from .hooks import preferred_hooks
+
+PUNCTUATION_PATTERN = re.compile('[' + re.escape(string.punctuation) + ']+')
+
+class AnnotatedText(object): # pylint: disable=too-few-public-methods, useless-object-inheritance
+    '''
+    Content passed to annotate_text annotator hooks. Tokenizations shared between
+    annotators (such as words) are computed on first use and reused by the others.
+    '''
+
+    def __init__(self, content):
+        self.content = content
+
+        self._words = None
+
+    @property
+    def words(self):
+        '''
+        Space-separated tokens of the content with ASCII punctuation removed and the
+        surrounding whitespace stripped.
+        '''
+
+        if self._words is None:
+            self._words = [word for word in PUNCTUATION_PATTERN.sub('', self.content).strip().split(' ') if word]
+
+        return self._words
+
+def annotate_texts(texts, field_name=None):
+    '''
+    Runs every installed annotator over each of texts (such as all the message bodies of a
+    bundle member) and returns one annotations dict per text, in order. Each text is
+    tokenized once for all annotators that define annotate_text. Annotators that only
+    define annotate are called with the raw content.
+    '''
+
+    hooks = preferred_hooks('annotators', ('annotate_text', 'annotate'))
+
+    results = []
+
+    for content in texts:
+        text = AnnotatedText(content)
+
+        annotations = {}
+
+        for app, name, annotate in hooks: # pylint: disable=unused-variable
+            if name == 'annotate_text':
+                new_annotations = annotate(text, field_name)
+            else:
+                new_annotations = annotate(content, field_name)
+
+            if new_annotations is not None:
+                annotations.update(new_annotations)
+
+        results.append(annotations)
+
+    return results
@@ -1,6 +1,11 @@
 # pylint: disable=line-too-long
 
+from ..annotation_engine import AnnotatedText
+
 def annotate(content, field_name=None):
+    return annotate_text(AnnotatedText(content), field_name)
+
+def annotate_text(text, field_name=None):
     annotations = {}
 
     annotation_field = 'pdk_length'
@@ -8,7 +13,7 @@ def annotate(content, field_name=None):
     if field_name is not None:
         annotation_field = 'pdk_length_' + field_name
 
-    annotations[annotation_field] = len(content)
+    annotations[annotation_field] = len(text.content)
 
     return annotations
 
@@ -56,3 +61,6 @@ def update_data_type_definition(definition):
         if 'pdk_length_' in key:
             definition[key]['pdk_variable_name'] = 'Content length'
             definition[key]['pdk_variable_description'] = 'Counts the number of characters in the provided content.'
+        elif key == 'pdk_length':
+            definition[key]['pdk_variable_name'] = 'Content length (longest field)'
+            definition[key]['pdk_variable_description'] = 'Number of characters in the longest annotated field of the data point.'
@@ -1,12 +1,15 @@
 # pylint: disable=line-too-long
 
-import string
+from ..annotation_engine import AnnotatedText
 
 SKIP_FIELD_NAMES = (
     'url',
 )
 
 def annotate(content, field_name=None):
+    return annotate_text(AnnotatedText(content), field_name)
+
+def annotate_text(text, field_name=None):
     if field_name in SKIP_FIELD_NAMES:
         return {}
 
@@ -17,18 +20,7 @@ def annotate(content, field_name=None):
     if field_name is not None:
         annotation_field = 'pdk_word_count_' + field_name
 
-    non_punc = set(string.punctuation)
-
-    content_nopunc = ''.join(ch for ch in content if ch not in non_punc)
-
-    while '  ' in content_nopunc:
-        content_nopunc = content_nopunc.replace('  ', ' ')
-
-    content_nopunc = content_nopunc.strip()
-
-    words = content_nopunc.split(' ')
-
-    annotations[annotation_field] = len(words)
+    annotations[annotation_field] = max(len(text.words), 1) # Empty content counted as one word, as before
 
     return annotations
 
@@ -76,3 +68,6 @@ def update_data_type_definition(definition):
         if 'pdk_word_count_' in key:
             definition[key]['pdk_variable_name'] = 'Word count'
             definition[key]['pdk_variable_description'] = 'Counts the words in the provided content.'
+        elif key == 'pdk_word_count':
+            definition[key]['pdk_variable_name'] = 'Word count (longest field)'
+            definition[key]['pdk_variable_description'] = 'Largest word count among the annotated fields of the data point.'
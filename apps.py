@@ -4,3 +4,8 @@ class PassiveDataKitExternalDataConfig(AppConfig):
     name = 'passive_data_kit_external_data'
     verbose_name = 'Passive Data Kit: External Data'
     default_auto_field = 'django.db.models.AutoField'
+
+    def ready(self):
+        from .hooks import build_hook_registry # pylint: disable=import-outside-toplevel
+
+        build_hook_registry()
@@ -0,0 +1,499 @@
+#pylint: disable=line-too-long
+
+from __future__ import print_function
+
+import binascii
+import collections
+import contextlib
+import datetime
+import io
+import json
+import sys
+import threading
+import time
+import traceback
+
+import six
+
+from six.moves import queue as task_queue
+
+from django.conf import settings
+from django.db import connections, router, transaction
+
+from passive_data_kit.models import DataPoint
+
+from .crypto import ENCRYPTION_EXECUTORS
+from .hooks import external_api_hooks
+
+PENDING_POINTS_LIMIT = 1000
+
+BATCH_WRITERS = threading.local()
+
+def batch_insert_method():
+    try:
+        return settings.PDK_EXTERNAL_BATCH_INSERT_METHOD
+    except AttributeError:
+        pass
+
+    return 'bulk_create'
+
+COPY_ESCAPES = (
+    ('\\', '\\\\'), # Backslashes first, so the escapes below are not escaped again.
+    ('\n', '\\n'),
+    ('\r', '\\r'),
+    ('\t', '\\t'),
+)
+
+def copy_escape(value):
+    for character, escaped in COPY_ESCAPES:
+        value = value.replace(character, escaped)
+
+    return value
+
+def copy_value(field, data_point, connection):
+    value = field.pre_save(data_point, True)
+
+    if value is None:
+        return '\\N'
+
+    if hasattr(value, 'hexewkb'): # GEOS geometry
+        value = value.hexewkb
+
+        if isinstance(value, bytes):
+            value = value.decode('ascii')
+    elif field.get_internal_type() == 'JSONField':
+        value = json.dumps(value, cls=field.encoder)
+    elif isinstance(value, bool):
+        value = 't' if value else 'f'
+    elif isinstance(value, (datetime.date, datetime.datetime)):
+        value = value.isoformat()
+    else:
+        value = field.get_db_prep_save(value, connection)
+
+        if six.PY2 and isinstance(value, str): # Native strings, not binary values, on Python 2.
+            value = value.decode('utf-8')
+
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            value = '\\x' + binascii.hexlify(bytes(value)).decode('ascii')
+        else:
+            value = six.text_type(value)
+
+    return copy_escape(six.text_type(value))
+
+def copy_data_points(data_points):
+    '''
+    Writes data_points with PostgreSQL's COPY ... FROM STDIN (text format). Returns
+    False without writing anything if the database or driver does not support it.
+    '''
+
+    connection = connections[router.db_for_write(DataPoint)]
+
+    if connection.vendor != 'postgresql':
+        return False
+
+    fields = [field for field in DataPoint._meta.concrete_fields if field.primary_key is False] # pylint: disable=protected-access
+
+    buffer = io.StringIO()
+
+    for data_point in data_points:
+        buffer.write(six.text_type('\t'.join(copy_value(field, data_point, connection) for field in fields) + '\n')) # io.StringIO only accepts unicode on Python 2.
+
+    quote_name = connection.ops.quote_name
+
+    statement = 'COPY %s (%s) FROM STDIN' % (quote_name(DataPoint._meta.db_table), ', '.join(quote_name(field.column) for field in fields)) # pylint: disable=protected-access
+
+    with connection.cursor() as cursor:
+        driver_cursor = cursor.cursor
+
+        if hasattr(driver_cursor, 'copy_expert'): # psycopg2
+            buffer.seek(0)
+
+            driver_cursor.copy_expert(statement, buffer)
+        elif hasattr(driver_cursor, 'copy'): # psycopg 3
+            with driver_cursor.copy(statement) as copy:
+                copy.write(buffer.getvalue())
+        else:
+            return False
+
+    return True
+
+def insert_data_points(data_points, method=None):
+    if len(data_points) == 0: # pylint: disable=len-as-condition
+        return
+
+    if method is None:
+        method = batch_insert_method()
+
+    if method == 'copy' and copy_data_points(data_points):
+        return
+
+    DataPoint.objects.bulk_create(data_points)
+
+def data_point_size(data_point):
+    properties = getattr(data_point, 'properties', None)
+
+    if isinstance(properties, str):
+        return len(properties)
+
+    return len(json.dumps(properties, default=str))
+
+def store_annotation_summaries(data_point):
+    '''
+    Stores the fetch_annotations summaries of the data point's properties (such as its
+    longest pdk_length_* field as pdk_length) as top-level properties, so exports read
+    them without walking the properties again. Engagement events are not annotated.
+    '''
+
+    properties = getattr(data_point, 'properties', None)
+
+    if isinstance(properties, dict) is False or data_point.generator_identifier.startswith('pdk-external-engagement-'):
+        return
+
+    summaries = {}
+
+    for app, fetch_annotations in external_api_hooks('fetch_annotations'): # pylint: disable=unused-variable
+        summaries.update(fetch_annotations(properties))
+
+    for key, value in summaries.items():
+        if (key in properties) is False:
+            properties[key] = value
+
+class BatchWriter(object): # pylint: disable=useless-object-inheritance, too-many-instance-attributes
+    '''
+    Collects the DataPoints emitted by one import and writes them in batches of at most
+    max_rows points (PDK_EXTERNAL_BATCH_MAX_ROWS) or, if set, max_bytes of serialized
+    properties (PDK_EXTERNAL_BATCH_MAX_BYTES, 0 by default, since measuring serializes
+    every point).
+
+    Used as a context manager, the writer becomes the active writer for the current
+    thread, so queue_batch_insert and create_engagement_event feed it. Pending points
+    are flushed when the block exits normally and discarded when it raises.
+
+    When asynchronous (PDK_EXTERNAL_BATCH_ASYNC), full batches are handed to a writer
+    thread with its own database connection through a queue of at most queue_size
+    batches (PDK_EXTERNAL_BATCH_QUEUE_SIZE), so parsing continues while the previous
+    batch is inserted. A failed write is re-raised in the importing thread by the next
+    flush, at the end of the current unit, or when the block exits.
+
+    When PDK_EXTERNAL_BATCH_TARGET_SECONDS is set, max_rows is adjusted after every
+    write toward the batch size that would take that long to insert, within
+    PDK_EXTERNAL_BATCH_ROWS_BOUNDS. See stats and summary for the sizes chosen. The
+    writer thread only records its timings; stats and max_rows are updated in the
+    importing thread.
+    '''
+
+    def __init__(self, max_rows=None, max_bytes=None, method=None, collect=False, asynchronous=None, queue_size=None): # pylint: disable=too-many-arguments, too-many-positional-arguments
+        if max_rows is None:
+            try:
+                max_rows = settings.PDK_EXTERNAL_BATCH_MAX_ROWS
+            except AttributeError:
+                max_rows = PENDING_POINTS_LIMIT
+
+        if max_bytes is None:
+            try:
+                max_bytes = settings.PDK_EXTERNAL_BATCH_MAX_BYTES
+            except AttributeError:
+                max_bytes = 0
+
+        if asynchronous is None:
+            try:
+                asynchronous = settings.PDK_EXTERNAL_BATCH_ASYNC
+            except AttributeError:
+                asynchronous = False
+
+        if queue_size is None:
+            try:
+                queue_size = settings.PDK_EXTERNAL_BATCH_QUEUE_SIZE
+            except AttributeError:
+                queue_size = 4
+
+        try:
+            self.target_seconds = settings.PDK_EXTERNAL_BATCH_TARGET_SECONDS
+        except AttributeError:
+            self.target_seconds = 0
+
+        try:
+            self.min_rows, self.limit_rows = settings.PDK_EXTERNAL_BATCH_ROWS_BOUNDS
+        except AttributeError:
+            self.min_rows, self.limit_rows = (100, 20000)
+
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.method = method
+        self.collect = collect # Hold points for the caller (see take) instead of writing them.
+
+        self.asynchronous = (asynchronous and collect is False)
+        self.queue_size = queue_size
+
+        self.pending = []
+        self.pending_bytes = 0
+        self.records = 0
+
+        self.stats = {
+            'batches': 0,
+            'rows': 0,
+            'bytes': 0,
+            'seconds': 0.0,
+            'smallest_batch': None,
+            'largest_batch': None,
+            'initial_max_rows': max_rows,
+            'final_max_rows': max_rows,
+        }
+
+        self.previous = None
+
+        self.tasks = None
+        self.timings = collections.deque() # Appended by the writer thread, read by the importing thread.
+        self.writer_thread = None
+        self.writer_error = None
+        self.writer_traceback = None
+
+    def queue(self, data_point, summarize=True):
+        self.records += 1
+
+        if summarize: # False for points already summarized by another writer (such as an import worker's).
+            store_annotation_summaries(data_point)
+
+        self.pending.append(data_point)
+
+        if self.max_bytes > 0 or self.target_seconds > 0:
+            self.pending_bytes += data_point_size(data_point)
+
+        if self.collect:
+            return
+
+        if len(self.pending) >= self.max_rows or 0 < self.max_bytes <= self.pending_bytes:
+            self.flush()
+
+    def flush(self):
+        if self.collect:
+            return
+
+        self.record_timings()
+
+        data_bytes = self.pending_bytes
+        data_points = self.take()
+
+        if len(data_points) == 0: # pylint: disable=len-as-condition
+            return
+
+        executor = getattr(ENCRYPTION_EXECUTORS, 'executor', None)
+
+        if executor is not None:
+            executor.resolve_data_points(data_points)
+
+        if self.writer_thread is None:
+            self.write_batch(data_points, data_bytes)
+        else:
+            self.submit(lambda: self.write_batch(data_points, data_bytes))
+
+    def write_batch(self, data_points, data_bytes):
+        start = time.time()
+
+        insert_data_points(data_points, method=self.method)
+
+        self.timings.append((len(data_points), data_bytes, time.time() - start))
+
+        if self.writer_thread is None:
+            self.record_timings()
+
+    def record_timings(self):
+        while self.timings:
+            rows, data_bytes, elapsed = self.timings.popleft()
+
+            self.stats['batches'] += 1
+            self.stats['rows'] += rows
+            self.stats['bytes'] += data_bytes
+            self.stats['seconds'] += elapsed
+
+            if self.stats['smallest_batch'] is None or rows < self.stats['smallest_batch']:
+                self.stats['smallest_batch'] = rows
+
+            if self.stats['largest_batch'] is None or rows > self.stats['largest_batch']:
+                self.stats['largest_batch'] = rows
+
+            if self.target_seconds > 0 and elapsed > 0:
+                ideal_rows = rows * (self.target_seconds / elapsed)
+
+                # Move halfway toward the ideal size to smooth out noisy measurements.
+
+                adjusted_rows = int(self.max_rows + ((ideal_rows - self.max_rows) / 2))
+
+                self.max_rows = max(self.min_rows, min(self.limit_rows, adjusted_rows))
+
+            self.stats['final_max_rows'] = self.max_rows
+
+    def summary(self):
+        stats = self.stats
+
+        return '%d rows (%.1f MB) in %d batches, %.2f s writing (%.0f rows/s); batch rows: %s-%s, limit %d -> %d' % (stats['rows'], stats['bytes'] / (1024.0 * 1024.0), stats['batches'], stats['seconds'], stats['rows'] / max(stats['seconds'], 0.001), stats['smallest_batch'], stats['largest_batch'], stats['initial_max_rows'], stats['final_max_rows'])
+
+    def submit(self, task, always=False):
+        if always is False:
+            self.raise_writer_error()
+
+        self.tasks.put((task, always)) # Blocks while the queue is full.
+
+    def drain(self):
+        self.tasks.join()
+
+        self.record_timings()
+
+        self.raise_writer_error()
+
+    def raise_writer_error(self):
+        if self.writer_error is not None:
+            print(self.writer_traceback, end='')
+            sys.stdout.flush()
+
+            raise self.writer_error
+
+    def run_writer(self):
+        try:
+            while True:
+                task, always = self.tasks.get()
+
+                try:
+                    if task is None:
+                        return
+
+                    if always or self.writer_error is None:
+                        task()
+                except Exception as exception: # pylint: disable=broad-except
+                    if self.writer_error is None:
+                        self.writer_error = exception
+                        self.writer_traceback = traceback.format_exc()
+                finally:
+                    self.tasks.task_done()
+        finally:
+            connections.close_all()
+
+    def stop_writer(self):
+        self.tasks.put((None, True))
+
+        self.writer_thread.join()
+        self.writer_thread = None
+
+        self.record_timings()
+
+    def take(self):
+        data_points = self.pending
+
+        self.pending = []
+        self.pending_bytes = 0
+
+        return data_points
+
+    def discard(self):
+        data_points = self.take()
+
+        executor = getattr(ENCRYPTION_EXECUTORS, 'executor', None)
+
+        if executor is not None:
+            executor.discard_data_points(data_points)
+
+    @contextlib.contextmanager
+    def unit(self, on_commit=None):
+        '''
+        Writes the points queued inside the block in one transaction, calling on_commit
+        in the same transaction. If the block raises, those points are discarded.
+        '''
+
+        if self.writer_thread is None:
+            try:
+                with transaction.atomic():
+                    yield
+
+                    self.flush()
+
+                    if on_commit is not None:
+                        on_commit()
+            except: # pylint: disable=bare-except
+                self.discard()
+
+                raise
+
+            return
+
+        # The writer thread owns the transaction, so the unit is opened, committed, or
+        # rolled back there.
+
+        self.submit(lambda: transaction.set_autocommit(False))
+
+        try:
+            yield
+
+            self.flush()
+
+            if on_commit is not None:
+                self.submit(on_commit)
+
+            self.submit(transaction.commit)
+            self.submit(lambda: transaction.set_autocommit(True))
+
+            self.drain()
+        except: # pylint: disable=bare-except
+            self.discard()
+
+            self.submit(transaction.rollback, always=True)
+            self.submit(lambda: transaction.set_autocommit(True), always=True)
+
+            self.tasks.join()
+
+            raise
+
+    def __enter__(self):
+        self.previous = getattr(BATCH_WRITERS, 'writer', None)
+
+        BATCH_WRITERS.writer = self
+
+        if self.asynchronous:
+            self.tasks = task_queue.Queue(maxsize=self.queue_size)
+            self.writer_error = None
+
+            self.writer_thread = threading.Thread(target=self.run_writer, name='pdk-external-batch-writer')
+            self.writer_thread.daemon = True
+            self.writer_thread.start()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        BATCH_WRITERS.writer = self.previous
+
+        if exc_type is None:
+            self.flush()
+        else:
+            self.discard()
+
+        if self.writer_thread is not None:
+            self.stop_writer()
+
+            if exc_type is None:
+                self.raise_writer_error()
+
+        return False
+
+def active_batch_writer():
+    batch_writer = getattr(BATCH_WRITERS, 'writer', None)
+
+    if batch_writer is None:
+        batch_writer = getattr(BATCH_WRITERS, 'default', None)
+
+        if batch_writer is None:
+            batch_writer = BatchWriter()
+
+            BATCH_WRITERS.default = batch_writer
+
+    return batch_writer
+
+def queue_batch_insert(data_point, force_insert=False):
+    batch_writer = active_batch_writer()
+
+    if data_point is not None:
+        batch_writer.queue(data_point)
+
+    if force_insert is True:
+        batch_writer.flush()
+
+def finish_batch_inserts():
+    active_batch_writer().flush()
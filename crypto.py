@@ -0,0 +1,377 @@
+#pylint: disable=line-too-long
+
+import base64
+import binascii
+import collections
+import contextlib
+import hashlib
+import struct
+import threading
+
+from nacl.bindings import crypto_box_SEALBYTES, crypto_secretstream_xchacha20poly1305_ABYTES, crypto_secretstream_xchacha20poly1305_HEADERBYTES, \
+                         crypto_secretstream_xchacha20poly1305_KEYBYTES, crypto_secretstream_xchacha20poly1305_init_pull, \
+                         crypto_secretstream_xchacha20poly1305_init_push, crypto_secretstream_xchacha20poly1305_keygen, \
+                         crypto_secretstream_xchacha20poly1305_pull, crypto_secretstream_xchacha20poly1305_push, \
+                         crypto_secretstream_xchacha20poly1305_state, crypto_secretstream_xchacha20poly1305_TAG_FINAL, \
+                         crypto_secretstream_xchacha20poly1305_TAG_MESSAGE
+from nacl.exceptions import CryptoError
+from nacl.public import SealedBox, PublicKey
+from nacl.secret import SecretBox
+from nacl.utils import random as random_bytes
+
+from django.apps import apps
+from django.conf import settings
+from django.core.signals import setting_changed
+
+ENVELOPE_KEYS = threading.local()
+
+ENVELOPE_PREFIX = 'envelope:'
+
+CONTENT_CIPHER = {}
+
+HASH_MEMOS = threading.local()
+
+ENCRYPTION_EXECUTORS = threading.local()
+
+# Chunked file encryption: STREAM_MAGIC, chunk size (big-endian uint32), stream key sealed to
+# PDK_EXTERNAL_CONTENT_PUBLIC_KEY, secretstream header, then one secretstream message per chunk.
+
+STREAM_MAGIC = b'PDKSTRM1'
+STREAM_CHUNK_SIZE = 1024 * 1024
+STREAM_EXTENSION = '.secretstream'
+
+def content_cipher():
+    '''
+    Returns the SealedBox and the SHA-512 state (already fed the public key) for
+    PDK_EXTERNAL_CONTENT_PUBLIC_KEY, building them once per process. The cache is
+    rebuilt when the key changes or settings are overridden.
+    '''
+
+    public_key = settings.PDK_EXTERNAL_CONTENT_PUBLIC_KEY
+
+    if CONTENT_CIPHER.get('public_key', None) != public_key:
+        hasher = hashlib.sha512()
+        hasher.update(public_key.encode('utf-8'))
+
+        CONTENT_CIPHER['box'] = SealedBox(PublicKey(base64.b64decode(public_key)))
+        CONTENT_CIPHER['hasher'] = hasher
+        CONTENT_CIPHER['public_key'] = public_key
+
+    return CONTENT_CIPHER
+
+def reset_content_cipher(**kwargs): # pylint: disable=unused-argument
+    CONTENT_CIPHER.clear()
+
+setting_changed.connect(reset_content_cipher)
+
+class HashMemo(object): # pylint: disable=useless-object-inheritance
+    '''
+    Bounded LRU cache of hash_content results for the values hashed during one import
+    (see hash_memo), with hit and miss counters for the import stats.
+    '''
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def hash(self, hasher, cleartext):
+        digest = self.entries.get(cleartext, None)
+
+        if digest is not None:
+            self.hits += 1
+
+            self.entries[cleartext] = self.entries.pop(cleartext) # OrderedDict.move_to_end is Python 3 only.
+
+            return digest
+
+        self.misses += 1
+
+        sha512 = hasher.copy()
+        sha512.update(cleartext.encode('utf-8'))
+
+        digest = sha512.hexdigest()
+
+        self.entries[cleartext] = digest
+
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+        return digest
+
+    def summary(self):
+        lookups = self.hits + self.misses
+
+        return 'hash memo: %d lookups, %d hits (%.1f%%)' % (lookups, self.hits, (100.0 * self.hits) / max(lookups, 1))
+
+@contextlib.contextmanager
+def hash_memo(size=None):
+    '''
+    Memoizes hash_content and hash_many inside the block, keeping at most size values
+    (PDK_EXTERNAL_HASH_MEMO_SIZE, 0 to disable). The cleartext is dropped when the
+    block exits, so nothing is kept from one import to the next.
+    '''
+
+    if size is None:
+        try:
+            size = settings.PDK_EXTERNAL_HASH_MEMO_SIZE
+        except AttributeError:
+            size = 4096
+
+    memo = HashMemo(size)
+
+    previous = getattr(HASH_MEMOS, 'memo', None)
+
+    if size > 0:
+        HASH_MEMOS.memo = memo
+
+    try:
+        yield memo
+    finally:
+        HASH_MEMOS.memo = previous
+
+        memo.entries.clear()
+
+def hash_content(cleartext):
+    if settings.PDK_EXTERNAL_CONTENT_DISABLE_HASHING is not False:
+        return 'hashing-disabled:%s' % cleartext.decode('utf-8')
+
+    hasher = content_cipher()['hasher']
+
+    memo = getattr(HASH_MEMOS, 'memo', None)
+
+    if memo is not None:
+        return memo.hash(hasher, cleartext)
+
+    sha512 = hasher.copy()
+
+    sha512.update(cleartext.encode('utf-8'))
+
+    return sha512.hexdigest()
+
+def hash_many(cleartexts):
+    if settings.PDK_EXTERNAL_CONTENT_DISABLE_HASHING is not False:
+        return [hash_content(cleartext) for cleartext in cleartexts]
+
+    hasher = content_cipher()['hasher']
+
+    memo = getattr(HASH_MEMOS, 'memo', None)
+
+    if memo is not None:
+        return [memo.hash(hasher, cleartext) for cleartext in cleartexts]
+
+    hashes = []
+
+    for cleartext in cleartexts:
+        sha512 = hasher.copy()
+        sha512.update(cleartext.encode('utf-8'))
+
+        hashes.append(sha512.hexdigest())
+
+    return hashes
+
+def encrypt_content(cleartext):
+    if settings.PDK_EXTERNAL_CONTENT_DISABLE_ENCRYPTION is not False:
+        return 'encryption-disabled:%s' % cleartext.decode('utf-8')
+
+    executor = getattr(ENCRYPTION_EXECUTORS, 'executor', None)
+
+    if executor is not None:
+        return executor.defer(cleartext)
+
+    envelope = getattr(ENVELOPE_KEYS, 'envelope', None)
+
+    if envelope is not None:
+        key_id, box = envelope
+
+        return ENVELOPE_PREFIX + key_id + ':' + base64.b64encode(box.encrypt(cleartext)).decode('ascii')
+
+    box = content_cipher()['box']
+
+    return base64.b64encode(box.encrypt(cleartext)).decode('ascii')
+
+def encrypt_many(cleartexts):
+    if settings.PDK_EXTERNAL_CONTENT_DISABLE_ENCRYPTION is not False:
+        return [encrypt_content(cleartext) for cleartext in cleartexts]
+
+    executor = getattr(ENCRYPTION_EXECUTORS, 'executor', None)
+
+    if executor is not None:
+        return [executor.defer(cleartext) for cleartext in cleartexts]
+
+    envelope = getattr(ENVELOPE_KEYS, 'envelope', None)
+
+    if envelope is not None:
+        prefix = ENVELOPE_PREFIX + envelope[0] + ':'
+        box = envelope[1]
+    else:
+        prefix = ''
+        box = content_cipher()['box']
+
+    return [prefix + base64.b64encode(box.encrypt(cleartext)).decode('ascii') for cleartext in cleartexts]
+
+def envelope_encryption_enabled():
+    try:
+        return settings.PDK_EXTERNAL_CONTENT_ENVELOPE_ENCRYPTION
+    except AttributeError:
+        pass
+
+    return False
+
+@contextlib.contextmanager
+def envelope_key(key_id, key):
+    previous = getattr(ENVELOPE_KEYS, 'envelope', None)
+
+    ENVELOPE_KEYS.envelope = (key_id, SecretBox(key))
+
+    try:
+        yield
+    finally:
+        ENVELOPE_KEYS.envelope = previous
+
+@contextlib.contextmanager
+def envelope_encryption(data_file=None):
+    '''
+    When PDK_EXTERNAL_CONTENT_ENVELOPE_ENCRYPTION is enabled, generates a random data key
+    for the import, stores it sealed to PDK_EXTERNAL_CONTENT_PUBLIC_KEY as an
+    ExternalDataEncryptionKey, and has encrypt_content encrypt fields in the block with
+    that key (SecretBox) instead of sealing each one to the public key. Envelope fields
+    are stored as "envelope:<key_id>:<base64 ciphertext>".
+    '''
+
+    if envelope_encryption_enabled() is False or settings.PDK_EXTERNAL_CONTENT_DISABLE_ENCRYPTION is not False:
+        yield None
+
+        return
+
+    key = random_bytes(SecretBox.KEY_SIZE)
+
+    public_box = SealedBox(PublicKey(base64.b64decode(settings.PDK_EXTERNAL_CONTENT_PUBLIC_KEY)))
+
+    encryption_key = apps.get_model('passive_data_kit_external_data', 'ExternalDataEncryptionKey')(data_file=data_file)
+    encryption_key.key_id = binascii.hexlify(random_bytes(16)).decode('ascii')
+    encryption_key.sealed_key = base64.b64encode(public_box.encrypt(key)).decode('ascii')
+    encryption_key.save()
+
+    with envelope_key(encryption_key.key_id, key):
+        yield (encryption_key.key_id, key)
+
+def decrypt_content(ciphertext, private_box, sealed_keys=None):
+    '''
+    Decrypts a field produced by encrypt_content in either format. private_box is a
+    SealedBox for the server private key. Envelope keys are looked up by key_id in
+    sealed_keys (a dict of key_id to base64 sealed key) or in ExternalDataEncryptionKey.
+    '''
+
+    if ciphertext.startswith(ENVELOPE_PREFIX) is False:
+        return private_box.decrypt(base64.b64decode(ciphertext))
+
+    key_id, encrypted = ciphertext[len(ENVELOPE_PREFIX):].split(':', 1)
+
+    sealed_key = None
+
+    if sealed_keys is not None:
+        sealed_key = sealed_keys.get(key_id, None)
+
+    if sealed_key is None:
+        sealed_key = apps.get_model('passive_data_kit_external_data', 'ExternalDataEncryptionKey').objects.get(key_id=key_id).sealed_key
+
+        if sealed_keys is not None:
+            sealed_keys[key_id] = sealed_key
+
+    key = private_box.decrypt(base64.b64decode(sealed_key))
+
+    return SecretBox(key).decrypt(base64.b64decode(encrypted))
+
+def digest_chunks(chunks):
+    sha256 = hashlib.sha256()
+
+    for chunk in chunks:
+        sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+def read_chunk(source, size):
+    chunk = b''
+
+    while len(chunk) < size:
+        read = source.read(size - len(chunk))
+
+        if not read:
+            break
+
+        chunk += read
+
+    return chunk
+
+def encrypt_stream(source, destination, chunk_size=STREAM_CHUNK_SIZE):
+    stream_key = crypto_secretstream_xchacha20poly1305_keygen()
+
+    box = SealedBox(PublicKey(base64.b64decode(settings.PDK_EXTERNAL_CONTENT_PUBLIC_KEY)))
+
+    state = crypto_secretstream_xchacha20poly1305_state()
+
+    header = crypto_secretstream_xchacha20poly1305_init_push(state, stream_key)
+
+    destination.write(STREAM_MAGIC)
+    destination.write(struct.pack('>I', chunk_size))
+    destination.write(box.encrypt(stream_key))
+    destination.write(header)
+
+    chunk = read_chunk(source, chunk_size)
+
+    while True:
+        next_chunk = read_chunk(source, chunk_size)
+
+        if next_chunk:
+            destination.write(crypto_secretstream_xchacha20poly1305_push(state, chunk, tag=crypto_secretstream_xchacha20poly1305_TAG_MESSAGE))
+
+            chunk = next_chunk
+        else:
+            destination.write(crypto_secretstream_xchacha20poly1305_push(state, chunk, tag=crypto_secretstream_xchacha20poly1305_TAG_FINAL))
+
+            break
+
+def is_stream_encrypted(path):
+    with open(path, 'rb') as encrypted_file:
+        return encrypted_file.read(len(STREAM_MAGIC)) == STREAM_MAGIC
+
+def decrypt_stream(source, destination, box):
+    if source.read(len(STREAM_MAGIC)) != STREAM_MAGIC:
+        raise CryptoError('Not a chunked encrypted stream.')
+
+    chunk_size = struct.unpack('>I', source.read(4))[0]
+
+    stream_key = box.decrypt(source.read(crypto_box_SEALBYTES + crypto_secretstream_xchacha20poly1305_KEYBYTES))
+
+    state = crypto_secretstream_xchacha20poly1305_state()
+
+    crypto_secretstream_xchacha20poly1305_init_pull(state, source.read(crypto_secretstream_xchacha20poly1305_HEADERBYTES), stream_key)
+
+    while True:
+        chunk = read_chunk(source, chunk_size + crypto_secretstream_xchacha20poly1305_ABYTES)
+
+        if not chunk:
+            raise CryptoError('Encrypted stream ended before its final chunk.')
+
+        cleartext, tag = crypto_secretstream_xchacha20poly1305_pull(state, chunk)
+
+        destination.write(cleartext)
+
+        if tag == crypto_secretstream_xchacha20poly1305_TAG_FINAL:
+            break
+
+    if source.read(1):
+        raise CryptoError('Unexpected content after the final chunk of the encrypted stream.')
+
+def secret_encrypt_content(cleartext):
+    box = SecretBox(base64.b64decode(settings.PDK_EXTERNAL_CONTENT_SYMETRIC_KEY))
+
+    return base64.b64encode(box.encrypt(cleartext))
+
+def secret_decrypt_content(cleartext):
+    box = SecretBox(base64.b64decode(settings.PDK_EXTERNAL_CONTENT_SYMETRIC_KEY))
+
+    return box.decrypt(base64.b64decode(cleartext))
@@ -0,0 +1,198 @@
+#pylint: disable=line-too-long
+
+import collections
+import contextlib
+import multiprocessing
+import time
+
+import six
+
+from django.conf import settings
+
+from .crypto import ENCRYPTION_EXECUTORS, ENVELOPE_KEYS
+from .workers import encrypt_fields, initialize_encryption_worker
+
+PENDING_ENCRYPTION_PREFIX = 'pdk-pending-encryption:'
+
+class PendingEncryption(six.text_type):
+    '''
+    Placeholder ("pdk-pending-encryption:<index>") for a field an EncryptionExecutor has
+    not sealed yet. A subclass, so cleartext that happens to look like one is left alone.
+    '''
+
+    def __new__(cls, index):
+        placeholder = six.text_type.__new__(cls, PENDING_ENCRYPTION_PREFIX + str(index))
+        placeholder.index = index
+
+        return placeholder
+
+    def __getnewargs__(self):
+        return (self.index,)
+
+class EncryptionExecutor(object): # pylint: disable=useless-object-inheritance, too-many-instance-attributes
+    '''
+    Seals content fields to PDK_EXTERNAL_CONTENT_PUBLIC_KEY in a pool of worker
+    processes (see encryption_executor). While it is active, encrypt_content and
+    encrypt_many return placeholders ("pdk-pending-encryption:<index>") and queue the
+    cleartext, which is sent to the pool in chunks of chunk_size fields. BatchWriter
+    swaps the placeholders in each data point for their ciphertexts (resolve_data_points)
+    before the batch is written. Each placeholder can be resolved once, and the
+    ciphertexts of discarded points are dropped (discard_data_points).
+    '''
+
+    def __init__(self, processes, chunk_size):
+        self.pool = multiprocessing.get_context('spawn').Pool(processes, initializer=initialize_encryption_worker, initargs=(settings.PDK_EXTERNAL_CONTENT_PUBLIC_KEY,))
+
+        self.processes = processes
+        self.chunk_size = chunk_size
+
+        self.cleartexts = []
+        self.next_index = 0
+
+        self.chunks = collections.deque()
+        self.ciphertexts = {}
+        self.discarded = set()
+
+        self.stats = {
+            'fields': 0,
+            'chunks': 0,
+            'waiting_seconds': 0.0,
+        }
+
+    def defer(self, cleartext):
+        index = self.next_index + len(self.cleartexts)
+
+        self.cleartexts.append(cleartext)
+
+        if len(self.cleartexts) >= self.chunk_size:
+            self.submit()
+
+        return PendingEncryption(index)
+
+    def submit(self):
+        if len(self.cleartexts) == 0: # pylint: disable=len-as-condition
+            return
+
+        self.chunks.append((self.next_index, self.pool.apply_async(encrypt_fields, (self.cleartexts,))))
+
+        self.stats['fields'] += len(self.cleartexts)
+        self.stats['chunks'] += 1
+
+        self.next_index += len(self.cleartexts)
+        self.cleartexts = []
+
+    def ciphertext(self, placeholder):
+        index = placeholder.index
+
+        if index >= self.next_index:
+            self.submit()
+
+        # Chunks complete in the order they were submitted, so wait for them in order.
+
+        while (index in self.ciphertexts) is False and self.chunks:
+            start_index, result = self.chunks.popleft()
+
+            start = time.time()
+
+            for offset, ciphertext in enumerate(result.get()):
+                if (start_index + offset) in self.discarded:
+                    self.discarded.remove(start_index + offset)
+                else:
+                    self.ciphertexts[start_index + offset] = ciphertext
+
+            self.stats['waiting_seconds'] += time.time() - start
+
+        try:
+            return self.ciphertexts.pop(index)
+        except KeyError:
+            raise ValueError('Encrypted field ' + placeholder + ' was already resolved or does not exist.') # pylint: disable=raise-missing-from
+
+    def placeholders(self, value):
+        if isinstance(value, dict):
+            return [placeholder for item in value.values() for placeholder in self.placeholders(item)]
+
+        if isinstance(value, list):
+            return [placeholder for item in value for placeholder in self.placeholders(item)]
+
+        if isinstance(value, PendingEncryption):
+            return [value]
+
+        return []
+
+    def resolve(self, value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                value[key] = self.resolve(item)
+        elif isinstance(value, list):
+            for index, item in enumerate(value):
+                value[index] = self.resolve(item)
+        elif isinstance(value, PendingEncryption):
+            return self.ciphertext(value)
+
+        return value
+
+    def resolve_data_points(self, data_points):
+        for data_point in data_points:
+            data_point.properties = self.resolve(data_point.properties)
+
+    def discard_data_points(self, data_points):
+        for data_point in data_points:
+            for placeholder in self.placeholders(getattr(data_point, 'properties', None)):
+                if self.ciphertexts.pop(placeholder.index, None) is None:
+                    self.discarded.add(placeholder.index) # Dropped when its chunk completes.
+
+    def summary(self):
+        stats = self.stats
+
+        return 'encryption executor: %d fields in %d chunks over %d processes, %.2f s waiting' % (stats['fields'], stats['chunks'], self.processes, stats['waiting_seconds'])
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+        self.cleartexts = []
+        self.ciphertexts.clear()
+        self.discarded.clear()
+
+@contextlib.contextmanager
+def encryption_executor(processes=None, chunk_size=None):
+    '''
+    Starts an EncryptionExecutor with processes workers (PDK_EXTERNAL_ENCRYPTION_PROCESSES)
+    for the block and makes it the active executor for the current thread. Yields None
+    (and encrypts inline) when fewer than two processes are configured, when encryption
+    is disabled, or when envelope encryption is active, whose per-field cost is too low
+    to be worth sending to another process.
+    '''
+
+    if processes is None:
+        try:
+            processes = settings.PDK_EXTERNAL_ENCRYPTION_PROCESSES
+        except AttributeError:
+            processes = 1
+
+    if chunk_size is None:
+        try:
+            chunk_size = settings.PDK_EXTERNAL_ENCRYPTION_CHUNK_SIZE
+        except AttributeError:
+            chunk_size = 512
+
+    if hasattr(multiprocessing, 'get_context') is False: # Python 2 cannot spawn workers.
+        processes = 1
+
+    if processes <= 1 or settings.PDK_EXTERNAL_CONTENT_DISABLE_ENCRYPTION is not False or getattr(ENVELOPE_KEYS, 'envelope', None) is not None:
+        yield None
+
+        return
+
+    executor = EncryptionExecutor(processes, chunk_size)
+
+    previous = getattr(ENCRYPTION_EXECUTORS, 'executor', None)
+
+    ENCRYPTION_EXECUTORS.executor = executor
+
+    try:
+        yield executor
+    finally:
+        ENCRYPTION_EXECUTORS.executor = previous
+
+        executor.close()
@@ -0,0 +1,172 @@
+# pylint: disable=line-too-long
+
+from __future__ import print_function
+
+import contextlib
+import json
+import threading
+import time
+
+from .models import annotate_fields
+from .utils import encrypt_many, hash_many
+
+FIELD_POLICIES = {}
+
+FIELD_POLICY_TIMINGS = threading.local()
+
+class FieldPolicy(object): # pylint: disable=too-few-public-methods, useless-object-inheritance, too-many-instance-attributes
+    '''
+    Describes how one field of a generator's data points is protected before the points
+    are queued. path is a tuple of keys from the top of the properties ('*' matches every
+    item of a list). For each matching field (None values are only dropped):
+
+        encrypt_as: stores encrypt_content(value) under this key next to the field
+        hash_as: stores hash_content(value) under this key next to the field
+        length_as: stores len(value) under this key next to the field
+        annotate: runs annotate_fields on the values, named after the field (or this name)
+        drop: removes the cleartext field afterwards
+        serialize: JSON-encodes (non-string) values before encrypting or hashing them
+        on_record: stores the keys above and the annotations on the record itself
+            instead of next to the field
+    '''
+
+    def __init__(self, path, encrypt_as=None, hash_as=None, length_as=None, annotate=False, drop=False, serialize=False, on_record=False): # pylint: disable=too-many-arguments, too-many-positional-arguments
+        self.path = tuple(path)
+        self.encrypt_as = encrypt_as
+        self.hash_as = hash_as
+        self.length_as = length_as
+        self.annotate = annotate
+        self.drop = drop
+        self.serialize = serialize
+        self.on_record = on_record
+
+        self.label = '.'.join(self.path)
+
+    def collect(self, value, depth, fields, record=None):
+        if record is None:
+            record = value
+
+        key = self.path[depth]
+
+        if key == '*':
+            if isinstance(value, list):
+                items = enumerate(value)
+            else:
+                return
+        elif isinstance(value, dict) and key in value:
+            items = ((key, value[key]),)
+        else:
+            return
+
+        for item_key, item in items:
+            if depth == len(self.path) - 1:
+                fields.append((value, item_key, item, record))
+            elif item is not None:
+                self.collect(item, depth + 1, fields, record)
+
+    def apply(self, fields):
+        dropped = fields
+
+        fields = [field for field in fields if field[2] is not None]
+
+        targets = [(field[3] if self.on_record else field[0]) for field in fields]
+
+        values = [field[2] for field in fields]
+
+        if self.length_as is not None:
+            for target, value in zip(targets, values):
+                target[self.length_as] = len(value)
+
+        if self.serialize:
+            values = [json.dumps(value, indent=2) for value in values]
+
+        if self.encrypt_as is not None:
+            ciphertexts = encrypt_many([(value if isinstance(value, bytes) else value.encode('utf-8')) for value in values]) # Python 2 CSV values are already bytes.
+
+            for target, ciphertext in zip(targets, ciphertexts):
+                target[self.encrypt_as] = ciphertext
+
+        if self.hash_as is not None:
+            for target, hashed in zip(targets, hash_many(values)):
+                target[self.hash_as] = hashed
+
+        if self.annotate is not False:
+            self.annotate_values([field[1] for field in fields], targets, values)
+
+        if self.drop:
+            for (container, key, value, record) in reversed(dropped): # pylint: disable=unused-variable
+                del container[key] # Later list items first, so earlier indexes stay valid.
+
+    def annotate_values(self, keys, targets, values):
+        batches = {}
+
+        for key, target, value in zip(keys, targets, values):
+            containers, field_values = batches.setdefault(key if self.annotate is True else self.annotate, ([], []))
+
+            containers.append(target)
+            field_values.append(value)
+
+        for name, (containers, field_values) in batches.items():
+            annotate_fields(containers, name, field_values)
+
+class FieldPolicyTiming(object): # pylint: disable=useless-object-inheritance
+    '''
+    Time spent applying each field policy (see field_policy_timing), keyed by generator
+    identifier and field path.
+    '''
+
+    def __init__(self):
+        self.fields = {}
+
+    def record(self, generator_identifier, policy, count, elapsed):
+        key = (generator_identifier, policy.label)
+
+        total_count, total_elapsed = self.fields.get(key, (0, 0.0))
+
+        self.fields[key] = (total_count + count, total_elapsed + elapsed)
+
+    def summary(self, limit=5):
+        slowest = sorted(self.fields.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+
+        return 'field policies: ' + ', '.join('%s %s (%d fields, %.2f s)' % (generator, label, count, elapsed) for (generator, label), (count, elapsed) in slowest)
+
+@contextlib.contextmanager
+def field_policy_timing():
+    timing = FieldPolicyTiming()
+
+    previous = getattr(FIELD_POLICY_TIMINGS, 'timing', None)
+
+    FIELD_POLICY_TIMINGS.timing = timing
+
+    try:
+        yield timing
+    finally:
+        FIELD_POLICY_TIMINGS.timing = previous
+
+def register_field_policies(generator_identifier, *policies):
+    FIELD_POLICIES[generator_identifier] = policies
+
+def apply_field_policies(generator_identifier, records):
+    '''
+    Applies the field policies registered for generator_identifier to records (a list of
+    properties dicts, such as every included record of a bundle member), one field at a
+    time, so each field is encrypted and hashed as a single batch. Returns records.
+    '''
+
+    timing = getattr(FIELD_POLICY_TIMINGS, 'timing', None)
+
+    for policy in FIELD_POLICIES.get(generator_identifier, ()):
+        start = time.time()
+
+        fields = []
+
+        for record in records:
+            policy.collect(record, 0, fields)
+
+        if fields:
+            policy.apply(fields)
+
+        if timing is not None:
+            timing.record(generator_identifier, policy, len(fields), time.time() - start)
+
+    return records
@@ -0,0 +1,279 @@
+# pylint: disable=line-too-long
+
+import collections
+import importlib
+import pkgutil
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.signals import request_finished, setting_changed
+
+HOOK_REGISTRY = {}
+
+HOOK_RESULTS = threading.local()
+
+SOURCE_HOOKS_TTL = 60
+
+def build_hook_registry():
+    '''
+    Imports the pdk_external_api module and the annotator modules of every installed app
+    once (called from PassiveDataKitExternalDataConfig.ready), so hooks are dispatched
+    without per-call imports or package scans.
+    '''
+
+    api_modules = []
+    annotator_modules = []
+
+    for app in settings.INSTALLED_APPS:
+        try:
+            api_modules.append((app, importlib.import_module(app + '.pdk_external_api')))
+        except ImportError:
+            pass
+
+        try:
+            annotators = importlib.import_module(app + '.annotators')
+
+            prefix = annotators.__name__ + '.'
+
+            for importer, modname, ispkg in pkgutil.iter_modules(annotators.__path__, prefix): # pylint: disable=unused-variable
+                annotator_modules.append((app, importlib.import_module(modname)))
+        except ImportError:
+            pass
+
+    HOOK_REGISTRY.clear()
+
+    HOOK_REGISTRY['pdk_external_api'] = api_modules
+    HOOK_REGISTRY['annotators'] = annotator_modules
+    HOOK_REGISTRY['hooks'] = {}
+
+def reset_hook_registry(**kwargs): # pylint: disable=unused-argument
+    if kwargs.get('setting', None) == 'INSTALLED_APPS':
+        HOOK_REGISTRY.clear()
+
+        reset_hook_results()
+
+setting_changed.connect(reset_hook_registry)
+
+def registered_hooks(kind, name):
+    if ('hooks' in HOOK_REGISTRY) is False:
+        build_hook_registry()
+
+    hooks = HOOK_REGISTRY['hooks'].get((kind, name), None)
+
+    if hooks is None:
+        hooks = []
+
+        for app, module in HOOK_REGISTRY[kind]:
+            hook = getattr(module, name, None)
+
+            if hook is not None:
+                hooks.append((app, hook))
+
+        HOOK_REGISTRY['hooks'][(kind, name)] = hooks
+
+    return hooks
+
+def preferred_hooks(kind, names):
+    '''
+    Returns (app, name, function) for each module of kind ("pdk_external_api" or
+    "annotators") that defines any of names, using the first of names it defines (such as
+    a faster variant of a hook, falling back to the original).
+    '''
+
+    if ('hooks' in HOOK_REGISTRY) is False:
+        build_hook_registry()
+
+    key = (kind, tuple(names))
+
+    hooks = HOOK_REGISTRY['hooks'].get(key, None)
+
+    if hooks is None:
+        hooks = []
+
+        for app, module in HOOK_REGISTRY[kind]:
+            for name in names:
+                hook = getattr(module, name, None)
+
+                if hook is not None:
+                    hooks.append((app, name, hook))
+
+                    break
+
+        HOOK_REGISTRY['hooks'][key] = hooks
+
+    return hooks
+
+def external_api_hooks(name):
+    '''
+    Returns (app, function) for each installed app whose pdk_external_api module defines
+    name, in INSTALLED_APPS order.
+    '''
+
+    return registered_hooks('pdk_external_api', name)
+
+def annotator_hooks(name):
+    '''
+    Returns (app, function) for each annotator module (in each installed app's annotators
+    package) that defines name.
+    '''
+
+    return registered_hooks('annotators', name)
+
+def source_importer_hooks(name):
+    '''
+    Returns (app, source identifier, function) for each installed app's
+    importers.<identifier> module that defines name, for every ExternalDataSource, in
+    INSTALLED_APPS then source order. Cached until an ExternalDataSource changes in this
+    process (see reset_source_hooks) or for SOURCE_HOOKS_TTL seconds, so sources added by
+    other processes (such as pdk_external_seed_sources) are picked up.
+    '''
+
+    expire_source_hooks()
+
+    key = ('sources', name)
+
+    hooks = HOOK_REGISTRY.get(key, None)
+
+    if hooks is None:
+        hooks = []
+
+        identifiers = list(apps.get_model('passive_data_kit_external_data', 'ExternalDataSource').objects.all().values_list('identifier', flat=True))
+
+        for app in settings.INSTALLED_APPS:
+            for identifier in identifiers:
+                try:
+                    importer = importlib.import_module(app + '.importers.' + identifier)
+                except ImportError:
+                    continue
+
+                hook = getattr(importer, name, None)
+
+                if hook is not None:
+                    hooks.append((app, identifier, hook))
+
+        HOOK_REGISTRY[key] = hooks
+
+    return hooks
+
+def generator_metadata_hooks(generator_identifier):
+    '''
+    Returns the external_data_metadata hooks to try for generator_identifier: hooks of the
+    sources whose "pdk-external-<identifier>" prefix matches it (longest first), then the
+    others in source_importer_hooks order in case one of them claims the generator.
+    '''
+
+    expire_source_hooks()
+
+    generators = HOOK_REGISTRY.setdefault('generators', {})
+
+    hooks = generators.get(generator_identifier, None)
+
+    if hooks is None:
+        source_hooks = source_importer_hooks('external_data_metadata')
+
+        matches = [hook for hook in source_hooks if generator_identifier.startswith('pdk-external-' + hook[1])]
+        matches.sort(key=lambda hook: len(hook[1]), reverse=True)
+
+        hooks = matches + [hook for hook in source_hooks if (hook in matches) is False]
+
+        generators[generator_identifier] = hooks
+
+    return hooks
+
+def reset_source_hooks(**kwargs): # pylint: disable=unused-argument
+    for key in list(HOOK_REGISTRY.keys()):
+        if key in ('generators', 'sources_expire') or (isinstance(key, tuple) and key[0] == 'sources'):
+            del HOOK_REGISTRY[key]
+
+def expire_source_hooks():
+    if HOOK_REGISTRY.get('sources_expire', 0) < time.time():
+        reset_source_hooks()
+
+        HOOK_REGISTRY['sources_expire'] = time.time() + SOURCE_HOOKS_TTL
+
+def generator_importer_hooks(generator_identifier, name):
+    '''
+    Returns (app, function) for each installed app whose importers.<service> module
+    defines name, where service is the third token of a "pdk-external-<service>-..."
+    generator identifier (no hooks for other generators). Cached per generator identifier.
+    '''
+
+    generators = HOOK_REGISTRY.setdefault(('generator_importers', name), {})
+
+    hooks = generators.get(generator_identifier, None)
+
+    if hooks is None:
+        hooks = []
+
+        tokens = generator_identifier.split('-')
+
+        if generator_identifier.startswith('pdk-external-') and len(tokens) > 2:
+            for app in settings.INSTALLED_APPS:
+                try:
+                    importer = importlib.import_module(app + '.importers.' + tokens[2])
+                except ImportError:
+                    continue
+
+                hook = getattr(importer, name, None)
+
+                if hook is not None:
+                    hooks.append((app, hook))
+
+        generators[generator_identifier] = hooks
+
+    return hooks
+
+class HookResultMemo(object): # pylint: disable=useless-object-inheritance, too-few-public-methods
+    '''
+    Bounded LRU cache of memoized_hook_result values for one thread, dropped when the
+    request that filled it finishes (see reset_hook_results).
+    '''
+
+    def __init__(self, size):
+        self.size = size
+        self.results = collections.OrderedDict()
+
+    def result(self, key, compute):
+        if key in self.results:
+            value = self.results.pop(key) # Reinserted below as the most recent.
+        else:
+            value = compute()
+
+        self.results[key] = value
+
+        if len(self.results) > self.size:
+            self.results.popitem(last=False)
+
+        return value
+
+def hook_result_memo():
+    memo = getattr(HOOK_RESULTS, 'memo', None)
+
+    if memo is None:
+        try:
+            size = settings.PDK_EXTERNAL_HOOK_RESULT_MEMO_SIZE
+        except AttributeError:
+            size = 256
+
+        memo = HookResultMemo(size)
+
+        HOOK_RESULTS.memo = memo
+
+    return memo
+
+def reset_hook_results(**kwargs): # pylint: disable=unused-argument
+    HOOK_RESULTS.memo = None
+
+request_finished.connect(reset_hook_results)
+
+def memoized_hook_result(kind, key, compute):
+    '''
+    Returns compute() for (kind, key), calling it only the first time in the current
+    request (at most PDK_EXTERNAL_HOOK_RESULT_MEMO_SIZE results are kept). Used for hook
+    results that depend only on the observed generator identifiers, such as data type
+    names.
+    '''
+
+    return hook_result_memo().result((kind, key), compute)
@@ -8,15 +8,12 @@ import json
 import math
 
 import arrow
-import chardet
-import pandas
-import pathlib2
 
 from django.conf import settings
 
 from passive_data_kit.models import DataPoint
 
-from ..utils import hash_content, create_engagement_event
+from ..utils import hash_content, create_engagement_event, queue_batch_insert
 
 DROP_COLUMNS = (
     'Payment Instrument Type',
@@ -135,12 +132,18 @@ def process_item(request_identifier, item):
 
                 created = order_date.datetime
 
-                DataPoint.objects.create_data_point('pdk-external-amazon-item', request_identifier, pdk_item, user_agent='Passive Data Kit External Importer', created=created)
+                queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-amazon-item', request_identifier, pdk_item, user_agent='Passive Data Kit External Importer', created=created, skip_save=True))
 
                 create_engagement_event(source='amazon', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='purchase', start=created)
 
 
-def import_data(request_identifier, path): # pylint: disable=too-many-branches
+def import_data(request_identifier, path, data_file=None, batch_writer=None): # pylint: disable=too-many-branches, unused-argument
+    # Loaded here rather than at module import, so importer discovery stays cheap.
+
+    import chardet # pylint: disable=import-outside-toplevel
+    import pandas # pylint: disable=import-outside-toplevel
+    import pathlib2 # pylint: disable=import-outside-toplevel
+
     detected = chardet.detect(pathlib2.Path(path).read_bytes())
 
     encoding = detected.get('encoding')
@@ -9,60 +9,80 @@ import arrow
 
 from passive_data_kit.models import DataPoint
 
-from ..models import annotate_field
-from ..utils import encrypt_content, create_engagement_event, queue_batch_insert
+from ..field_policies import FieldPolicy, apply_field_policies, register_field_policies
+from ..utils import create_engagement_event, queue_batch_insert, include_data, include_data_range
 
-def process_conversations(request_identifier, conversations_raw):
-    conversations = json.loads(conversations_raw)
+register_field_policies('pdk-external-chatgpt-message',
+                        FieldPolicy(('conversation_title',), encrypt_as='pdk_encrypted_conversation_title', drop=True),
+                        FieldPolicy(('content',), encrypt_as='pdk_encrypted_content', annotate=True, drop=True))
+
+def include_messages(request_identifier, conversation, included):
+    conversation_title = conversation.get('title', None)
+    conversation_metadata = copy.deepcopy(conversation)
+
+    del conversation_metadata['mapping']
+
+    for msg_id, message in conversation.get('mapping', {}).items(): # pylint: disable=too-many-nested-blocks
+        message_obj = message.get('message', None)
 
-    for conversation in conversations: # pylint: disable=too-many-nested-blocks
-        conversation_title = conversation.get('title', None)
-        conversation_metadata = copy.deepcopy(conversation)
+        if message_obj is not None:
+            data_point = {
+                'message_id': msg_id
+            }
 
-        del conversation_metadata['mapping']
+            if message_obj.get('content', {}).get('content_type', None) == 'text':
+                create_ts = message_obj.get('create_time', 0)
 
-        for msg_id, message in conversation.get('mapping', {}).items():
-            message_obj = message.get('message', None)
+                if create_ts is not None:
+                    created = arrow.get(create_ts).datetime
 
-            if message_obj is not None:
-                data_point = {
-                    'message_id': msg_id
-                }
+                    if include_data(request_identifier, created, message_obj) is False:
+                        continue
 
-                if message_obj.get('content', {}).get('content_type', None) == 'text':
-                    create_ts = message_obj.get('create_time', 0)
+                    content_text = ''
 
-                    if create_ts is not None:
-                        created = arrow.get(create_ts).datetime
+                    for part in message_obj.get('content', {}).get('parts', []):
+                        if content_text == '':
+                            content_text = part
+                        else:
+                            content_text = '%s\n%s' % (content_text, part)
 
-                        content_text = ''
+                    author = message_obj.get('author', {}).get('role', 'unknown')
+
+                    data_point['author'] = author
+                    data_point['conversation_title'] = conversation_title
+                    data_point['conversation_metadata'] = conversation_metadata
+                    data_point['content'] = content_text
+
+                    included.append((data_point, created))
+
+def process_conversations(request_identifier, conversations_raw):
+    conversations = json.loads(conversations_raw)
 
-                        for part in message_obj.get('content', {}).get('parts', []):
-                            if content_text == '':
-                                content_text = part
-                            else:
-                                content_text = '%s\n%s' % (content_text, part)
+    included = []
 
-                        author = message_obj.get('author', {}).get('role', 'unknown')
+    for conversation in conversations:
+        create_time = conversation.get('create_time', None)
+        update_time = conversation.get('update_time', None)
 
-                        data_point['author'] = author
-                        data_point['pdk_encrypted_conversation_title'] = encrypt_content(conversation_title.encode('utf-8'))
-                        data_point['conversation_metadata'] = conversation_metadata
+        if create_time is not None and update_time is not None and include_data_range(request_identifier, arrow.get(create_time).datetime, arrow.get(update_time).datetime) is False:
+            continue
 
-                        data_point['pdk_encrypted_content'] = encrypt_content(content_text.encode('utf-8'))
+        include_messages(request_identifier, conversation, included)
 
-                        annotate_field(data_point, 'content', content_text)
+    apply_field_policies('pdk-external-chatgpt-message', [data_point for data_point, created in included])
 
-                        if data_point['author'] == 'user':
-                            create_engagement_event(source='chatgpt', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='message', start=created)
-                        elif data_point['author'] == 'system':
-                            create_engagement_event(source='chatgpt', identifier=request_identifier, incoming_engagement=1.0, engagement_type='message', start=created)
+    for data_point, created in included:
+        if data_point['author'] == 'user':
+            create_engagement_event(source='chatgpt', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='message', start=created)
+        elif data_point['author'] == 'system':
+            create_engagement_event(source='chatgpt', identifier=request_identifier, incoming_engagement=1.0, engagement_type='message', start=created)
 
-                        queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-chatgpt-message', request_identifier, data_point, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
+        queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-chatgpt-message', request_identifier, data_point, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
 
     return True
 
-def import_data(request_identifier, path): # pylint: disable=too-many-branches
+def import_data(request_identifier, path, data_file=None, batch_writer=None): # pylint: disable=too-many-branches, unused-argument
     with zipfile.ZipFile(path) as content_bundle:
         for content_file in content_bundle.namelist():
             with content_bundle.open(content_file) as opened_file:
@@ -5,96 +5,78 @@ from __future__ import print_function
 import copy
 import json
 import re
-import traceback
-import zipfile
 
 import arrow
 
 from passive_data_kit.models import DataPoint
-from passive_data_kit_external_data.models import annotate_field
 
-from ..utils import hash_content, encrypt_content, create_engagement_event, queue_batch_insert, include_data
+from ..field_policies import FieldPolicy, apply_field_policies, register_field_policies
+from ..utils import create_engagement_event, queue_batch_insert, include_data, include_data_range, import_bundle
 
-def process_comments(request_identifier, comments_raw): # pylint: disable=too-many-branches
-    comments = json.loads(comments_raw)
-
-    if 'comments' in comments: # pylint: disable=too-many-nested-blocks
-        for comment in comments['comments']: # pylint: disable=too-many-nested-blocks
-            comment = copy.deepcopy(comment)
-
-            created = arrow.get(comment['timestamp']).datetime
-
-            if include_data(request_identifier, created, comment):
-                if 'title' in comment:
-                    comment['pdk_encrypted_title'] = encrypt_content(comment['title'].encode('utf-8'))
-
-                    annotate_field(comment, 'title', comment['title'])
-
-                    del comment['title']
-
-                if 'data' in comment:
-                    data = comment['data']
-
-                    for datum in data:
-                        if 'comment' in datum:
-                            comment_obj = datum['comment']
-
-                            if 'comment' in comment_obj:
-                                comment_obj['pdk_encrypted_comment'] = encrypt_content(comment_obj['comment'].encode('utf-8'))
-
-                                annotate_field(comment_obj, 'comment', comment_obj['comment'])
+POST_ATTACHMENT = ('attachments', '*', 'data', '*')
 
-                                del comment_obj['comment']
+register_field_policies('pdk-external-facebook-comment',
+                        FieldPolicy(('title',), encrypt_as='pdk_encrypted_title', annotate=True, drop=True),
+                        FieldPolicy(('data', '*', 'comment', 'comment'), encrypt_as='pdk_encrypted_comment', annotate=True, drop=True),
+                        FieldPolicy(('data', '*', 'comment', 'author'), hash_as='pdk_hashed_author', encrypt_as='pdk_encrypted_author', drop=True))
 
-                            if 'author' in comment_obj:
-                                comment_obj['pdk_hashed_author'] = hash_content(comment_obj['author'])
-                                comment_obj['pdk_encrypted_author'] = encrypt_content(comment_obj['author'].encode('utf-8'))
+register_field_policies('pdk-external-facebook-post',
+                        FieldPolicy(('title',), encrypt_as='pdk_encrypted_title', annotate=True, drop=True),
+                        FieldPolicy(('data', '*', 'post'), encrypt_as='pdk_encrypted_post', annotate=True, drop=True),
+                        FieldPolicy(POST_ATTACHMENT + ('event', 'name'), encrypt_as='pdk_encrypted_name', annotate=True, drop=True),
+                        FieldPolicy(POST_ATTACHMENT + ('event', 'description'), encrypt_as='pdk_encrypted_description', annotate=True, drop=True),
+                        FieldPolicy(POST_ATTACHMENT + ('event', 'place'), encrypt_as='pdk_encrypted_place', annotate=True, drop=True, serialize=True),
+                        FieldPolicy(POST_ATTACHMENT + ('external_context', 'url'), encrypt_as='pdk_encrypted_url', annotate=True, drop=True),
+                        FieldPolicy(POST_ATTACHMENT + ('media', 'title'), encrypt_as='pdk_encrypted_title', annotate=True, drop=True),
+                        FieldPolicy(POST_ATTACHMENT + ('media', 'description'), encrypt_as='pdk_encrypted_description', annotate=True, drop=True),
+                        FieldPolicy(POST_ATTACHMENT + ('media', 'uri'), encrypt_as='pdk_encrypted_uri', annotate=True, drop=True),
+                        FieldPolicy(POST_ATTACHMENT + ('media', 'media_metadata'), encrypt_as='pdk_encrypted_media_metadata', drop=True, serialize=True),
+                        FieldPolicy(POST_ATTACHMENT + ('place',), encrypt_as='pdk_encrypted_place', drop=True, serialize=True))
 
-                                del comment_obj['author']
+register_field_policies('pdk-external-facebook-message',
+                        FieldPolicy(('content',), encrypt_as='pdk_encrypted_content', annotate=True, drop=True),
+                        FieldPolicy(('share', 'link'), encrypt_as='pdk_encrypted_link', annotate=True, drop=True))
 
-                queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-facebook-comment', request_identifier, comment, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
+# Viewed and visited entries keep their protected fields under "data", but are annotated
+# on the entry itself, so the name is annotated (on_record) before it is encrypted.
 
-                create_engagement_event(source='facebook', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='comment', start=created)
+ENTRY_URI = FieldPolicy(('data', 'uri'), encrypt_as='pdk_encrypted_uri', hash_as='pdk_hashed_uri', drop=True)
+ENTRY_SHARE = FieldPolicy(('data', 'share'), encrypt_as='pdk_encrypted_share', hash_as='pdk_hashed_share', drop=True)
+ENTRY_NAME_ANNOTATION = FieldPolicy(('data', 'name'), annotate=True, on_record=True)
+ENTRY_NAME = FieldPolicy(('data', 'name'), encrypt_as='pdk_encrypted_name', hash_as='pdk_hashed_name', drop=True)
 
-    if 'comments_v2' in comments: # pylint: disable=too-many-nested-blocks
-        for comment in comments['comments_v2']: # pylint: disable=too-many-nested-blocks
-            comment = copy.deepcopy(comment)
+for entry_generator in ('pdk-external-facebook-watch', 'pdk-external-facebook-market', 'pdk-external-facebook-ad-viewed', 'pdk-external-facebook-profile-visit', 'pdk-external-facebook-page-visit', 'pdk-external-facebook-event-visit', 'pdk-external-facebook-group-visit'):
+    register_field_policies(entry_generator, ENTRY_URI, ENTRY_NAME_ANNOTATION, ENTRY_NAME)
 
-            created = arrow.get(comment['timestamp']).datetime
+register_field_policies('pdk-external-facebook-link', ENTRY_URI, ENTRY_SHARE, ENTRY_NAME_ANNOTATION, ENTRY_NAME)
 
-            if include_data(request_identifier, created, comment):
-                if 'title' in comment:
-                    comment['pdk_encrypted_title'] = encrypt_content(comment['title'].encode('utf-8'))
+register_field_policies('pdk-external-facebook-reaction',
+                        FieldPolicy(('name',), encrypt_as='pdk_encrypted_name', annotate=True, drop=True),
+                        FieldPolicy(('title',), encrypt_as='pdk_encrypted_title', annotate=True, drop=True),
+                        FieldPolicy(('data', '*', 'reaction', 'actor'), encrypt_as='pdk_encrypted_actor', annotate=True, drop=True))
 
-                    annotate_field(comment, 'title', comment['title'])
+register_field_policies('pdk-external-facebook-search',
+                        FieldPolicy(('query',), encrypt_as='pdk_encrypted_query', annotate=True, drop=True))
 
-                    del comment['title']
-
-                if 'data' in comment:
-                    data = comment['data']
-
-                    for datum in data:
-                        if 'comment' in datum:
-                            comment_obj = datum['comment']
-
-                            if 'comment' in comment_obj:
-                                comment_obj['pdk_encrypted_comment'] = encrypt_content(comment_obj['comment'].encode('utf-8'))
+def process_comments(request_identifier, comments_raw):
+    comments = json.loads(comments_raw)
 
-                                annotate_field(comment_obj, 'comment', comment_obj['comment'])
+    included = []
 
-                                del comment_obj['comment']
+    for comment in comments.get('comments', []) + comments.get('comments_v2', []):
+        created = arrow.get(comment['timestamp']).datetime
 
-                            if 'author' in comment_obj:
-                                comment_obj['pdk_hashed_author'] = hash_content(comment_obj['author'])
-                                comment_obj['pdk_encrypted_author'] = encrypt_content(comment_obj['author'].encode('utf-8'))
+        if include_data(request_identifier, created, comment):
+            included.append((copy.deepcopy(comment), created))
 
-                                del comment_obj['author']
+    apply_field_policies('pdk-external-facebook-comment', [comment for comment, created in included])
 
-                queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-facebook-comment', request_identifier, comment, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
+    for comment, created in included:
+        queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-facebook-comment', request_identifier, comment, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
 
-                create_engagement_event(source='facebook', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='comment', start=created)
+        create_engagement_event(source='facebook', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='comment', start=created)
 
-def process_posts(request_identifier, posts_raw): # pylint: disable=too-many-branches, too-many-statements
+def process_posts(request_identifier, posts_raw):
     posts = json.loads(posts_raw)
 
     source = 'user'
@@ -108,489 +90,204 @@ def process_posts(request_identifier, posts_raw): # pylint: disable=too-many-bra
     if 'timestamp' in posts:
         posts = [posts]
 
-    for post in posts: # pylint: disable=too-many-nested-blocks
-        post = copy.deepcopy(post)
+    included = []
 
+    for post in posts:
         if isinstance(post, dict):
             created = arrow.get(post['timestamp']).datetime
 
             if include_data(request_identifier, created, post):
-                if 'title' in post:
-                    post['pdk_encrypted_title'] = encrypt_content(post['title'].encode('utf-8'))
-
-                    annotate_field(post, 'title', post['title'])
-
-                    del post['title']
-
-                if 'data' in post:
-                    for datum in post['data']:
-                        if 'post' in datum:
-                            datum['pdk_encrypted_post'] = encrypt_content(datum['post'].encode('utf-8'))
-
-                            annotate_field(datum, 'post', datum['post'])
-
-                            del datum['post']
-
-                if 'attachments' in post:
-                    for attachment in post['attachments']:
-                        if 'data' in attachment:
-                            for datum in attachment['data']:
-                                if 'event' in datum:
-                                    event = datum['event']
-
-                                    if 'name' in event:
-                                        event['pdk_encrypted_name'] = encrypt_content(event['name'].encode('utf-8'))
-
-                                        annotate_field(event, 'name', event['name'])
-
-                                        del event['name']
-
-                                    if 'description' in event:
-                                        event['pdk_encrypted_description'] = encrypt_content(event['description'].encode('utf-8'))
-
-                                        annotate_field(event, 'description', event['description'])
-
-                                        del event['description']
-
-                                    if 'place' in event:
-                                        place_str = json.dumps(event['place'], indent=2)
-                                        event['pdk_encrypted_place'] = encrypt_content(place_str.encode('utf-8'))
-
-                                        annotate_field(event, 'place', place_str)
-
-                                        del event['place']
-
-                                if 'external_context' in datum:
-                                    external_context = datum['external_context']
-
-                                    if 'url' in external_context:
-                                        external_context['pdk_encrypted_url'] = encrypt_content(external_context['url'].encode('utf-8'))
-
-                                        annotate_field(external_context, 'url', external_context['url'])
-
-                                        del external_context['url']
-
-                                if 'media' in datum:
-                                    media = datum['media']
-
-                                    if 'title' in media:
-                                        media['pdk_encrypted_title'] = encrypt_content(media['title'].encode('utf-8'))
-
-                                        annotate_field(media, 'title', media['title'])
-
-                                        del media['title']
-
-                                    if 'description' in media:
-                                        media['pdk_encrypted_description'] = encrypt_content(media['description'].encode('utf-8'))
-
-                                        annotate_field(media, 'description', media['description'])
+                post = copy.deepcopy(post)
+                post['pdk_facebook_source'] = source
 
-                                        del media['description']
+                included.append((post, created))
 
-                                    if 'uri' in media:
-                                        media['pdk_encrypted_uri'] = encrypt_content(media['uri'].encode('utf-8'))
+    apply_field_policies('pdk-external-facebook-post', [post for post, created in included])
 
-                                        annotate_field(media, 'uri', media['uri'])
+    for post, created in included:
+        queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-facebook-post', request_identifier, post, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
 
-                                        del media['uri']
+        create_engagement_event(source='facebook', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='post', start=created)
 
-                                    if 'media_metadata' in media:
-                                        metadata_str = json.dumps(media['media_metadata'], indent=2)
-                                        media['pdk_encrypted_media_metadata'] = encrypt_content(metadata_str.encode('utf-8'))
+def process_entries(request_identifier, entries, generator_identifier, engagement_type, included, duration_field=None): # pylint: disable=too-many-arguments, too-many-positional-arguments
+    for entry in entries:
+        created = arrow.get(entry['timestamp']).datetime
 
-                                        del media['media_metadata']
+        if include_data(request_identifier, created, entry):
+            engagement = {
+                'engagement_type': engagement_type,
+                'start': created,
+            }
 
-                                if 'place' in datum:
-                                    place_str = json.dumps(datum['place'], indent=2)
-                                    datum['pdk_encrypted_place'] = encrypt_content(place_str.encode('utf-8'))
+            if duration_field is not None:
+                engagement['duration'] = entry['data'][duration_field]
 
-                                    del datum['place']
+            included.append((generator_identifier, entry, created, engagement))
 
-                post['pdk_facebook_source'] = source
+def queue_entries(request_identifier, included):
+    for generator_identifier in sorted(set(generator_identifier for generator_identifier, entry, created, engagement in included)):
+        apply_field_policies(generator_identifier, [entry for entry_generator, entry, created, engagement in included if entry_generator == generator_identifier])
 
-                queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-facebook-post', request_identifier, post, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
+    for generator_identifier, entry, created, engagement in included:
+        queue_batch_insert(DataPoint.objects.create_data_point(generator_identifier, request_identifier, entry, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
 
-                create_engagement_event(source='facebook', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='post', start=created)
+        create_engagement_event(source='facebook', identifier=request_identifier, outgoing_engagement=0.0, **engagement)
 
-def process_viewed(request_identifier, viewed_raw): # pylint: disable=too-many-branches, too-many-statements
+def process_viewed(request_identifier, viewed_raw):
     metadata = json.loads(viewed_raw)
 
-    for thing in metadata['viewed_things']: # pylint: disable=too-many-nested-blocks
+    included = []
+
+    for thing in metadata['viewed_things']:
         if thing['name'] == 'Facebook Watch Videos and Shows':
             for child in thing['children']:
                 if child['name'] == 'Shows':
-                    for entry in child['entries']:
-                        created = arrow.get(entry['timestamp']).datetime
-
-                        if include_data(request_identifier, created, entry):
-                            entry['data']['pdk_encrypted_uri'] = encrypt_content(entry['data']['uri'].encode('utf-8'))
-                            entry['data']['pdk_hashed_uri'] = hash_content(entry['data']['uri'].encode('utf-8'))
-
-                            del entry['data']['uri']
-
-                            entry['data']['pdk_encrypted_name'] = encrypt_content(entry['data']['name'].encode('utf-8'))
-                            entry['data']['pdk_hashed_name'] = hash_content(entry['data']['name'].encode('utf-8'))
-
-                            annotate_field(entry, 'name', entry['data']['name'])
-
-                            del entry['data']['name']
-
-                            queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-facebook-watch', request_identifier, entry, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
-
-                            create_engagement_event(source='facebook', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='video', start=created)
-
+                    process_entries(request_identifier, child['entries'], 'pdk-external-facebook-watch', 'video', included)
                 elif child['name'] == 'Time Viewed':
-                    for entry in child['entries']:
-                        created = arrow.get(entry['timestamp']).datetime
-
-                        if include_data(request_identifier, created, entry):
-                            entry['data']['pdk_encrypted_uri'] = encrypt_content(entry['data']['uri'].encode('utf-8'))
-                            entry['data']['pdk_hashed_uri'] = hash_content(entry['data']['uri'].encode('utf-8'))
-
-                            del entry['data']['uri']
-
-                            entry['data']['pdk_encrypted_name'] = encrypt_content(entry['data']['name'].encode('utf-8'))
-                            entry['data']['pdk_hashed_name'] = hash_content(entry['data']['name'].encode('utf-8'))
-
-                            annotate_field(entry, 'name', entry['data']['name'])
-
-                            del entry['data']['name']
-
-                            queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-facebook-watch', request_identifier, entry, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
-
-                            create_engagement_event(source='facebook', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='video', start=created, duration=entry['data']['watch_position_seconds'])
-
+                    process_entries(request_identifier, child['entries'], 'pdk-external-facebook-watch', 'video', included, duration_field='watch_position_seconds')
         elif thing['name'] == 'Facebook Live Videos':
-            for entry in thing['entries']:
-                created = arrow.get(entry['timestamp']).datetime
-
-                if include_data(request_identifier, created, entry):
-                    entry['data']['pdk_encrypted_uri'] = encrypt_content(entry['data']['uri'].encode('utf-8'))
-                    entry['data']['pdk_hashed_uri'] = hash_content(entry['data']['uri'].encode('utf-8'))
-
-                    del entry['data']['uri']
-
-                    entry['data']['pdk_encrypted_name'] = encrypt_content(entry['data']['name'].encode('utf-8'))
-                    entry['data']['pdk_hashed_name'] = hash_content(entry['data']['name'].encode('utf-8'))
-
-                    annotate_field(entry, 'name', entry['data']['name'])
-
-                    del entry['data']['name']
-
-                    queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-facebook-watch', request_identifier, entry, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
-
-                    create_engagement_event(source='facebook', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='video', start=created)
-
+            process_entries(request_identifier, thing['entries'], 'pdk-external-facebook-watch', 'video', included)
         elif thing['name'] == 'Articles':
-            for entry in thing['entries']:
-                created = arrow.get(entry['timestamp']).datetime
-
-                if include_data(request_identifier, created, entry):
-                    entry['data']['pdk_encrypted_uri'] = encrypt_content(entry['data']['uri'].encode('utf-8'))
-                    entry['data']['pdk_hashed_uri'] = hash_content(entry['data']['uri'].encode('utf-8'))
-
-                    del entry['data']['uri']
-
-                    entry['data']['pdk_encrypted_share'] = encrypt_content(entry['data']['share'].encode('utf-8'))
-                    entry['data']['pdk_hashed_share'] = hash_content(entry['data']['share'].encode('utf-8'))
-
-                    del entry['data']['share']
-
-                    entry['data']['pdk_encrypted_name'] = encrypt_content(entry['data']['name'].encode('utf-8'))
-                    entry['data']['pdk_hashed_name'] = hash_content(entry['data']['name'].encode('utf-8'))
-
-                    annotate_field(entry, 'name', entry['data']['name'])
-
-                    del entry['data']['name']
-
-                    queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-facebook-link', request_identifier, entry, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
-
-                    create_engagement_event(source='facebook', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='link', start=created)
-
+            process_entries(request_identifier, thing['entries'], 'pdk-external-facebook-link', 'link', included)
         elif thing['name'] == 'Marketplace Interactions':
             for child in thing['children']:
                 if child['name'] == 'Marketplace Items':
-                    for entry in child['entries']:
-                        created = arrow.get(entry['timestamp']).datetime
-
-                        if include_data(request_identifier, created, entry):
-                            entry['data']['pdk_encrypted_uri'] = encrypt_content(entry['data']['uri'].encode('utf-8'))
-                            entry['data']['pdk_hashed_uri'] = hash_content(entry['data']['uri'].encode('utf-8'))
-
-                            del entry['data']['uri']
-
-                            entry['data']['pdk_encrypted_name'] = encrypt_content(entry['data']['name'].encode('utf-8'))
-                            entry['data']['pdk_hashed_name'] = hash_content(entry['data']['name'].encode('utf-8'))
-
-                            annotate_field(entry, 'name', entry['data']['name'])
-
-                            del entry['data']['name']
-
-                            queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-facebook-market', request_identifier, entry, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
-
-                            create_engagement_event(source='facebook', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='shopping', start=created)
-
+                    process_entries(request_identifier, child['entries'], 'pdk-external-facebook-market', 'shopping', included)
         elif thing['name'] == 'Ads':
-            for entry in thing['entries']:
-                created = arrow.get(entry['timestamp']).datetime
-
-                if include_data(request_identifier, created, entry):
-                    if 'uri' in entry['data']:
-                        entry['data']['pdk_encrypted_uri'] = encrypt_content(entry['data']['uri'].encode('utf-8'))
-                        entry['data']['pdk_hashed_uri'] = hash_content(entry['data']['uri'].encode('utf-8'))
-
-                        del entry['data']['uri']
-
-                    entry['data']['pdk_encrypted_name'] = encrypt_content(entry['data']['name'].encode('utf-8'))
-                    entry['data']['pdk_hashed_name'] = hash_content(entry['data']['name'].encode('utf-8'))
+            process_entries(request_identifier, thing['entries'], 'pdk-external-facebook-ad-viewed', 'advertising', included)
 
-                    annotate_field(entry, 'name', entry['data']['name'])
+    queue_entries(request_identifier, included)
 
-                    del entry['data']['name']
-
-                    queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-facebook-ad-viewed', request_identifier, entry, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
-
-                    create_engagement_event(source='facebook', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='advertising', start=created)
-
-def process_visited(request_identifier, viewed_raw): # pylint: disable=too-many-branches
+def process_visited(request_identifier, viewed_raw):
     metadata = json.loads(viewed_raw)
 
+    included = []
+
     for thing in metadata['visited_things']:
         if thing['name'] == 'Profile visits':
-            for entry in thing['entries']:
-                created = arrow.get(entry['timestamp']).datetime
-
-                if include_data(request_identifier, created, entry):
-                    entry['data']['pdk_encrypted_uri'] = encrypt_content(entry['data']['uri'].encode('utf-8'))
-                    entry['data']['pdk_hashed_uri'] = hash_content(entry['data']['uri'].encode('utf-8'))
-
-                    del entry['data']['uri']
-
-                    entry['data']['pdk_encrypted_name'] = encrypt_content(entry['data']['name'].encode('utf-8'))
-                    entry['data']['pdk_hashed_name'] = hash_content(entry['data']['name'].encode('utf-8'))
-
-                    annotate_field(entry, 'name', entry['data']['name'])
-
-                    del entry['data']['name']
-
-                    queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-facebook-profile-visit', request_identifier, entry, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
-
-                    create_engagement_event(source='facebook', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='profile', start=created)
-
+            process_entries(request_identifier, thing['entries'], 'pdk-external-facebook-profile-visit', 'profile', included)
         elif thing['name'] == 'Page visits':
-            for entry in thing['entries']:
-                created = arrow.get(entry['timestamp']).datetime
-
-                if include_data(request_identifier, created, entry):
-                    entry['data']['pdk_encrypted_uri'] = encrypt_content(entry['data']['uri'].encode('utf-8'))
-                    entry['data']['pdk_hashed_uri'] = hash_content(entry['data']['uri'].encode('utf-8'))
-
-                    del entry['data']['uri']
-
-                    entry['data']['pdk_encrypted_name'] = encrypt_content(entry['data']['name'].encode('utf-8'))
-                    entry['data']['pdk_hashed_name'] = hash_content(entry['data']['name'].encode('utf-8'))
-
-                    annotate_field(entry, 'name', entry['data']['name'])
-
-                    del entry['data']['name']
-
-                    queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-facebook-page-visit', request_identifier, entry, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
-
-                    create_engagement_event(source='facebook', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='page', start=created)
-
+            process_entries(request_identifier, thing['entries'], 'pdk-external-facebook-page-visit', 'page', included)
         elif thing['name'] == 'Events visited':
-            for entry in thing['entries']:
-                created = arrow.get(entry['timestamp']).datetime
-
-                if include_data(request_identifier, created, entry):
-                    entry['data']['pdk_encrypted_uri'] = encrypt_content(entry['data']['uri'].encode('utf-8'))
-                    entry['data']['pdk_hashed_uri'] = hash_content(entry['data']['uri'].encode('utf-8'))
-
-                    del entry['data']['uri']
-
-                    entry['data']['pdk_encrypted_name'] = encrypt_content(entry['data']['name'].encode('utf-8'))
-                    entry['data']['pdk_hashed_name'] = hash_content(entry['data']['name'].encode('utf-8'))
-
-                    annotate_field(entry, 'name', entry['data']['name'])
-
-                    del entry['data']['name']
-
-                    queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-facebook-event-visit', request_identifier, entry, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
-
-                    create_engagement_event(source='facebook', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='event', start=created)
-
+            process_entries(request_identifier, thing['entries'], 'pdk-external-facebook-event-visit', 'event', included)
         elif thing['name'] == 'Groups visited':
-            for entry in thing['entries']:
-                created = arrow.get(entry['timestamp']).datetime
-
-                if include_data(request_identifier, created, entry):
-                    entry['data']['pdk_encrypted_uri'] = encrypt_content(entry['data']['uri'].encode('utf-8'))
-                    entry['data']['pdk_hashed_uri'] = hash_content(entry['data']['uri'].encode('utf-8'))
+            process_entries(request_identifier, thing['entries'], 'pdk-external-facebook-group-visit', 'group', included)
 
-                    del entry['data']['uri']
-
-                    entry['data']['pdk_encrypted_name'] = encrypt_content(entry['data']['name'].encode('utf-8'))
-                    entry['data']['pdk_hashed_name'] = hash_content(entry['data']['name'].encode('utf-8'))
-
-                    annotate_field(entry, 'name', entry['data']['name'])
-
-                    del entry['data']['name']
-
-                    queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-facebook-group-visit', request_identifier, entry, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
-
-                    create_engagement_event(source='facebook', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='group', start=created)
+    queue_entries(request_identifier, included)
 
 def process_page_reactions(request_identifier, reactions_raw):
     reactions = json.loads(reactions_raw)
 
+    included = []
+
     for reaction in reactions['page_likes']:
         created = arrow.get(reaction['timestamp']).datetime
 
         if include_data(request_identifier, created, reaction):
-            if 'name' in reaction:
-                reaction['pdk_encrypted_name'] = encrypt_content(reaction['name'].encode('utf-8'))
-
-                annotate_field(reaction, 'name', reaction['name'])
-
-                del reaction['name']
-
             reaction['content_type'] = 'page'
             reaction['reaction'] = 'like'
 
-            queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-facebook-reaction', request_identifier, reaction, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
+            included.append((reaction, created))
 
-            create_engagement_event(source='facebook', identifier=request_identifier, outgoing_engagement=0.5, engagement_type='reaction', start=created)
+    apply_field_policies('pdk-external-facebook-reaction', [reaction for reaction, created in included])
 
-def process_post_comment_reactions(request_identifier, reactions_raw): # pylint: disable=too-many-branches, too-many-statements
-    reactions = json.loads(reactions_raw)
+    for reaction, created in included:
+        queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-facebook-reaction', request_identifier, reaction, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
 
-    if 'reactions' in reactions: # pylint: disable=too-many-nested-blocks
-        for reaction in reactions['reactions']: # pylint: disable=too-many-nested-blocks
-            created = arrow.get(reaction['timestamp']).datetime
+        create_engagement_event(source='facebook', identifier=request_identifier, outgoing_engagement=0.5, engagement_type='reaction', start=created)
 
-            if include_data(request_identifier, created, reaction):
-                if 'title' in reaction:
-                    reaction['pdk_encrypted_title'] = encrypt_content(reaction['title'].encode('utf-8'))
+def reaction_content_type(title):
+    if '\'s post' in title:
+        return 'post'
 
-                    annotate_field(reaction, 'title', reaction['title'])
+    if '\'s comment' in title:
+        return 'comment'
 
-                    if '\'s post' in reaction['title']:
-                        reaction['content_type'] = 'post'
-                    elif '\'s comment' in reaction['title']:
-                        reaction['content_type'] = 'comment'
-                    elif '\'s photo' in reaction['title']:
-                        reaction['content_type'] = 'photo'
-                    elif '\'s video' in reaction['title']:
-                        reaction['content_type'] = 'video'
-                    else:
-                        reaction['content_type'] = 'unknown'
+    if '\'s photo' in title:
+        return 'photo'
 
-                    del reaction['title']
+    if '\'s video' in title:
+        return 'video'
 
-                if 'data' in reaction:
-                    for data_item in reaction['data']:
-                        if 'reaction' in data_item:
-                            data_item['reaction']['reaction'] = data_item['reaction']['reaction'].lower()
+    return 'unknown'
 
-                            if 'actor' in data_item['reaction']:
-                                data_item['reaction']['pdk_encrypted_actor'] = encrypt_content(data_item['reaction']['actor'].encode('utf-8'))
-
-                                annotate_field(data_item['reaction'], 'actor', data_item['reaction']['actor'])
-
-                                del data_item['reaction']['actor']
-
-                    queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-facebook-reaction', request_identifier, reaction, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
-
-                    create_engagement_event(source='facebook', identifier=request_identifier, outgoing_engagement=0.5, engagement_type='reaction', start=created)
-
-    if 'reactions_v2' in reactions: # pylint: disable=too-many-nested-blocks
-        for reaction in reactions['reactions_v2']: # pylint: disable=too-many-nested-blocks
-            created = arrow.get(reaction['timestamp']).datetime
+def process_post_comment_reactions(request_identifier, reactions_raw):
+    reactions = json.loads(reactions_raw)
 
-            if include_data(request_identifier, created, reaction):
-                if 'title' in reaction:
-                    reaction['pdk_encrypted_title'] = encrypt_content(reaction['title'].encode('utf-8'))
+    included = []
 
-                    annotate_field(reaction, 'title', reaction['title'])
+    for reaction in reactions.get('reactions', []) + reactions.get('reactions_v2', []):
+        created = arrow.get(reaction['timestamp']).datetime
 
-                    if '\'s post' in reaction['title']:
-                        reaction['content_type'] = 'post'
-                    elif '\'s comment' in reaction['title']:
-                        reaction['content_type'] = 'comment'
-                    elif '\'s photo' in reaction['title']:
-                        reaction['content_type'] = 'photo'
-                    elif '\'s video' in reaction['title']:
-                        reaction['content_type'] = 'video'
-                    else:
-                        reaction['content_type'] = 'unknown'
+        if include_data(request_identifier, created, reaction) and 'data' in reaction:
+            if 'title' in reaction:
+                reaction['content_type'] = reaction_content_type(reaction['title'])
 
-                    del reaction['title']
+            for data_item in reaction['data']:
+                if 'reaction' in data_item:
+                    data_item['reaction']['reaction'] = data_item['reaction']['reaction'].lower()
 
-                if 'data' in reaction:
-                    for data_item in reaction['data']:
-                        if 'reaction' in data_item:
-                            data_item['reaction']['reaction'] = data_item['reaction']['reaction'].lower()
+            included.append((reaction, created))
 
-                            if 'actor' in data_item['reaction']:
-                                data_item['reaction']['pdk_encrypted_actor'] = encrypt_content(data_item['reaction']['actor'].encode('utf-8'))
+    apply_field_policies('pdk-external-facebook-reaction', [reaction for reaction, created in included])
 
-                                annotate_field(data_item['reaction'], 'actor', data_item['reaction']['actor'])
+    for reaction, created in included:
+        queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-facebook-reaction', request_identifier, reaction, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
 
-                                del data_item['reaction']['actor']
+        create_engagement_event(source='facebook', identifier=request_identifier, outgoing_engagement=0.5, engagement_type='reaction', start=created)
 
-                    queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-facebook-reaction', request_identifier, reaction, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
+def message_created(timestamp):
+    try:
+        return arrow.get(timestamp).datetime
+    except ValueError:
+        try:
+            return arrow.get(timestamp / 1000).datetime
+        except ValueError:
+            pass
 
-                    create_engagement_event(source='facebook', identifier=request_identifier, outgoing_engagement=0.5, engagement_type='reaction', start=created)
+    return None
 
 def process_messages(request_identifier, messages_raw, full_names):
     messages = json.loads(messages_raw)
 
-    for message in messages['messages']:
-        message = copy.deepcopy(message)
+    # Skip the whole thread if it falls outside the study window.
 
-        created = None
-
-        try:
-            created = arrow.get(message['timestamp_ms']).datetime
-        except ValueError:
-            try:
-                created = arrow.get(message['timestamp_ms'] / 1000).datetime
-            except ValueError:
-                pass
+    timestamps = [message['timestamp_ms'] for message in messages['messages'] if 'timestamp_ms' in message]
 
-        if created is not None and include_data(request_identifier, created, message):
-            if 'content' in message:
-                message['pdk_encrypted_content'] = encrypt_content(message['content'].encode('utf-8'))
+    if timestamps:
+        first = message_created(min(timestamps))
+        last = message_created(max(timestamps))
 
-                annotate_field(message, 'content', message['content'])
+        if first is not None and last is not None and include_data_range(request_identifier, first, last) is False:
+            return
 
-                del message['content']
+    included = []
 
-            if 'share' in message:
-                share = message['share']
-
-                for share_key in copy.deepcopy(share):
-                    if share_key == 'link':
-                        share['pdk_encrypted_link'] = encrypt_content(share[share_key].encode('utf-8'))
+    for message in messages['messages']:
+        created = message_created(message['timestamp_ms'])
 
-                        annotate_field(share, 'link', share[share_key])
+        if created is not None and include_data(request_identifier, created, message):
+            included.append((copy.deepcopy(message), created))
 
-                        del share[share_key]
+    apply_field_policies('pdk-external-facebook-message', [message for message, created in included])
 
-            if message['sender_name'] in full_names:
-                message['pdk_direction'] = 'outgoing'
+    for message, created in included:
+        if message['sender_name'] in full_names:
+            message['pdk_direction'] = 'outgoing'
 
-                create_engagement_event(source='facebook', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='message', start=created)
-            else:
-                message['pdk_direction'] = 'incoming'
+            create_engagement_event(source='facebook', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='message', start=created)
+        else:
+            message['pdk_direction'] = 'incoming'
 
-                create_engagement_event(source='facebook', identifier=request_identifier, incoming_engagement=1.0, engagement_type='message', start=created)
+            create_engagement_event(source='facebook', identifier=request_identifier, incoming_engagement=1.0, engagement_type='message', start=created)
 
-            queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-facebook-message', request_identifier, message, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
+        queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-facebook-message', request_identifier, message, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
 
 def process_search_history(request_identifier, searches_raw):
     searches = json.loads(searches_raw)
 
+    included = []
+
     for search in searches['searches']:
         created = None
 
@@ -602,96 +299,88 @@ def process_search_history(request_identifier, searches_raw):
             except ValueError:
                 pass
 
-        if created is not None and include_data(request_identifier, created, search): # pylint: disable=too-many-nested-blocks
-            if 'attachments' in search:
-                for attachment in search['attachments']:
-                    if 'data' in attachment:
-                        for data in attachment['data']:
-                            if 'text' in data:
-                                payload = {
-                                    'pdk_encrypted_query': encrypt_content(data['text'].encode('utf-8'))
-                                }
-
-                                annotate_field(payload, 'query', data['text'])
-
-                                create_engagement_event(source='facebook', identifier=request_identifier, outgoing_engagement=0.5, engagement_type='search', start=created)
-                                queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-facebook-search', request_identifier, payload, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
-
-def import_data(request_identifier, path): # pylint: disable=too-many-branches, too-many-statements
-    with zipfile.ZipFile(path) as content_bundle:
-        full_names = []
-
-        for content_file in content_bundle.namelist():
-            try:
-                with content_bundle.open(content_file) as opened_file:
-                    if re.match(r'^messages/inbox/.*\.json', content_file):
-                        if len(full_names) == 0: # pylint: disable=len-as-condition
-                            try:
-                                with content_bundle.open('messages/autofill_information.json') as autofill_file:
-                                    autofill = json.loads(autofill_file.read())
-
-                                    full_names.extend(autofill['autofill_information_v2']['FULL_NAME'])
-                            except KeyError:
-                                pass # missing autofill_information.json
-
-                        process_messages(request_identifier, opened_file.read(), full_names)
-                    elif content_file.endswith('/'):
-                        pass
-                    elif content_file.lower().endswith('.jpg'):
-                        pass
-                    elif content_file.lower().endswith('.png'):
-                        pass
-                    elif content_file.lower().endswith('.mp4'):
-                        pass
-                    elif content_file.lower().endswith('.gif'):
-                        pass
-                    elif content_file.lower().endswith('.pdf'):
-                        pass
-                    elif content_file.lower().endswith('.webp'):
-                        pass
-                    elif content_file.lower().endswith('.aac'):
-                        pass
-                    elif content_file.lower().endswith('.mp3'):
-                        pass
-                    elif content_file.lower().endswith('.psd'):
-                        pass
-                    elif content_file.lower().endswith('.docx'):
-                        pass
-                    elif content_file.lower().endswith('.otf'):
-                        pass
-                    elif content_file.lower().endswith('.xml'):
-                        pass
-                    elif content_file.lower().endswith('.zip'):
-                        pass
-                    elif content_file.lower().endswith('.rar'):
-                        pass
-                    elif re.match(r'^photos_and_videos\/', content_file):
-                        pass
-                    elif re.match(r'^comments\/.*\.json', content_file):
-                        process_comments(request_identifier, opened_file.read())
-                    elif re.match(r'^comments_and_reactions\/comments.json', content_file):
-                        process_comments(request_identifier, opened_file.read())
-                    elif re.match(r'^posts\/.*\.json', content_file):
-                        process_posts(request_identifier, opened_file.read())
-                    elif re.match(r'^about_you\/viewed.json', content_file):
-                        process_viewed(request_identifier, opened_file.read())
-                    elif re.match(r'^about_you\/visited.json', content_file):
-                        process_visited(request_identifier, opened_file.read())
-                    elif re.match(r'^likes_and_reactions\/pages.json', content_file):
-                        process_page_reactions(request_identifier, opened_file.read())
-                    elif re.match(r'^likes_and_reactions\/posts_and_comments.json', content_file):
-                        process_post_comment_reactions(request_identifier, opened_file.read())
-                    elif re.match(r'^comments_and_reactions\/posts_and_comments.json', content_file):
-                        process_post_comment_reactions(request_identifier, opened_file.read())
-                    elif re.match(r'^search_history\/your_search_history.json', content_file):
-                        process_search_history(request_identifier, opened_file.read())
-                    else:
-                        print('FACEBOOK[' + request_identifier + ']: Unable to process: ' + content_file + ' -- ' + str(content_bundle.getinfo(content_file).file_size))
-            except: # pylint: disable=bare-except
-                traceback.print_exc()
-                return False
-
-    return True
+        if created is not None and include_data(request_identifier, created, search):
+            for attachment in search.get('attachments', []):
+                for data in attachment.get('data', []):
+                    if 'text' in data:
+                        included.append(({'query': data['text']}, created))
+
+    apply_field_policies('pdk-external-facebook-search', [payload for payload, created in included])
+
+    for payload, created in included:
+        create_engagement_event(source='facebook', identifier=request_identifier, outgoing_engagement=0.5, engagement_type='search', start=created)
+        queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-facebook-search', request_identifier, payload, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
+
+def import_member(request_identifier, content_bundle, content_file, context): # pylint: disable=too-many-branches, too-many-statements
+    with content_bundle.open(content_file) as opened_file:
+        if re.match(r'^messages/inbox/.*\.json', content_file):
+            full_names = context.setdefault('full_names', [])
+
+            if len(full_names) == 0: # pylint: disable=len-as-condition
+                try:
+                    with content_bundle.open('messages/autofill_information.json') as autofill_file:
+                        autofill = json.loads(autofill_file.read())
+
+                        full_names.extend(autofill['autofill_information_v2']['FULL_NAME'])
+                except KeyError:
+                    pass # missing autofill_information.json
+
+            process_messages(request_identifier, opened_file.read(), full_names)
+        elif content_file.endswith('/'):
+            pass
+        elif content_file.lower().endswith('.jpg'):
+            pass
+        elif content_file.lower().endswith('.png'):
+            pass
+        elif content_file.lower().endswith('.mp4'):
+            pass
+        elif content_file.lower().endswith('.gif'):
+            pass
+        elif content_file.lower().endswith('.pdf'):
+            pass
+        elif content_file.lower().endswith('.webp'):
+            pass
+        elif content_file.lower().endswith('.aac'):
+            pass
+        elif content_file.lower().endswith('.mp3'):
+            pass
+        elif content_file.lower().endswith('.psd'):
+            pass
+        elif content_file.lower().endswith('.docx'):
+            pass
+        elif content_file.lower().endswith('.otf'):
+            pass
+        elif content_file.lower().endswith('.xml'):
+            pass
+        elif content_file.lower().endswith('.zip'):
+            pass
+        elif content_file.lower().endswith('.rar'):
+            pass
+        elif re.match(r'^photos_and_videos\/', content_file):
+            pass
+        elif re.match(r'^comments\/.*\.json', content_file):
+            process_comments(request_identifier, opened_file.read())
+        elif re.match(r'^comments_and_reactions\/comments.json', content_file):
+            process_comments(request_identifier, opened_file.read())
+        elif re.match(r'^posts\/.*\.json', content_file):
+            process_posts(request_identifier, opened_file.read())
+        elif re.match(r'^about_you\/viewed.json', content_file):
+            process_viewed(request_identifier, opened_file.read())
+        elif re.match(r'^about_you\/visited.json', content_file):
+            process_visited(request_identifier, opened_file.read())
+        elif re.match(r'^likes_and_reactions\/pages.json', content_file):
+            process_page_reactions(request_identifier, opened_file.read())
+        elif re.match(r'^likes_and_reactions\/posts_and_comments.json', content_file):
+            process_post_comment_reactions(request_identifier, opened_file.read())
+        elif re.match(r'^comments_and_reactions\/posts_and_comments.json', content_file):
+            process_post_comment_reactions(request_identifier, opened_file.read())
+        elif re.match(r'^search_history\/your_search_history.json', content_file):
+            process_search_history(request_identifier, opened_file.read())
+        else:
+            print('FACEBOOK[' + request_identifier + ']: Unable to process: ' + content_file + ' -- ' + str(content_bundle.getinfo(content_file).file_size))
+
+def import_data(request_identifier, path, data_file=None, batch_writer=None):
+    return import_bundle(request_identifier, path, import_member, data_file=data_file, batch_writer=batch_writer)
 
 def external_data_metadata(generator_identifier, point):
     if generator_identifier.startswith('pdk-external-facebook') is False:
@@ -5,16 +5,57 @@ from __future__ import print_function
 import json
 import re
 import traceback
-import zipfile
 
 import arrow
 import pytz
 
 from passive_data_kit.models import DataPoint
 
-from passive_data_kit_external_data.models import annotate_field
+from ..field_policies import FieldPolicy, apply_field_policies, register_field_policies
+from ..utils import hash_content, encrypt_content, create_engagement_event, queue_batch_insert, include_data, include_data_range, import_bundle
 
-from ..utils import hash_content, encrypt_content, create_engagement_event, queue_batch_insert, include_data
+register_field_policies('pdk-external-instagram-comment-posted',
+                        FieldPolicy(('title',), encrypt_as='encrypted_title', drop=True),
+                        FieldPolicy(('string_list_data', '*', 'value'), encrypt_as='encrypted_value', annotate=True, drop=True),
+                        FieldPolicy(('string_map_data', 'Comment', 'value'), encrypt_as='encrypted_value', annotate=True, drop=True),
+                        FieldPolicy(('string_map_data', 'Media owner', 'value'), encrypt_as='encrypted_value', drop=True))
+
+register_field_policies('pdk-external-instagram-post',
+                        FieldPolicy(('media', '*', 'title'), encrypt_as='encrypted_title', annotate=True, drop=True),
+                        FieldPolicy(('media', '*', 'media_metadata', 'photo_metadata', 'exif_data'), drop=True))
+
+register_field_policies('pdk-external-instagram-comment-like',
+                        FieldPolicy(('title',), encrypt_as='encrypted_title', drop=True),
+                        FieldPolicy(('string_map_data', 'href'), encrypt_as='encrypted_href', drop=True),
+                        FieldPolicy(('string_list_data', '*', 'href'), encrypt_as='encrypted_href', drop=True))
+
+register_field_policies('pdk-external-instagram-post-like',
+                        FieldPolicy(('title',), encrypt_as='encrypted_title', drop=True),
+                        FieldPolicy(('string_list_data', 'href'), encrypt_as='encrypted_href', drop=True))
+
+register_field_policies('pdk-external-instagram-login',
+                        FieldPolicy(('string_map_data', 'IP Address', 'value'), encrypt_as='encrypted_value', drop=True),
+                        FieldPolicy(('ip_address',), encrypt_as='ip_address_encrypted_value', drop=True),
+                        FieldPolicy(('device_id',), drop=True))
+
+register_field_policies('pdk-external-instagram-direct-message',
+                        FieldPolicy(('sender_name',), hash_as='pdk_hashed_senderId', encrypt_as='pdk_encrypted_sender', drop=True),
+                        FieldPolicy(('content',), encrypt_as='pdk_encrypted_content', annotate=True, drop=True),
+                        FieldPolicy(('text',), encrypt_as='pdk_encrypted_text', annotate=True, drop=True),
+                        FieldPolicy(('media_url',), encrypt_as='pdk_encrypted_media_url', drop=True),
+                        FieldPolicy(('share_text',), annotate=True, drop=True))
+
+register_field_policies('pdk-external-instagram-comment',
+                        FieldPolicy(('comment',), encrypt_as='pdk_encrypted_comment', annotate=True, drop=True),
+                        FieldPolicy(('profile',), hash_as='pdk_hashed_profile', encrypt_as='pdk_encrypted_profile', drop=True))
+
+register_field_policies('pdk-external-instagram-photo',
+                        FieldPolicy(('caption',), encrypt_as='pdk_encrypted_caption', annotate=True, drop=True),
+                        FieldPolicy(('location',), encrypt_as='pdk_encrypted_location', annotate=True, drop=True))
+
+register_field_policies('pdk-external-instagram-video',
+                        FieldPolicy(('caption',), encrypt_as='pdk_encrypted_caption', annotate=True, drop=True),
+                        FieldPolicy(('location',), encrypt_as='pdk_encrypted_location', annotate=True, drop=True))
 
 def process_ads_viewed(request_identifier, ads_viewed_raw):
     ads_viewed = json.loads(ads_viewed_raw)
@@ -92,38 +133,19 @@ def process_post_comments(request_identifier, post_comments_raw):
 
     warned = False
 
+    included = []
+
     for post_comment in post_comments['comments_media_comments']:
         try:
-            post_comment['encrypted_title'] = encrypt_content(post_comment['title'].encode('utf-8'))
-            del post_comment['title']
-
             if 'string_list_data' in post_comment:
-                post_comment['string_list_data'][0]['encrypted_value'] = encrypt_content(post_comment['string_list_data'][0]['value'].encode('utf-8'))
-                annotate_field(post_comment['string_list_data'][0], 'value', post_comment['string_list_data'][0]['value'])
-                del post_comment['string_list_data'][0]['value']
-
                 created = arrow.get(post_comment['string_list_data'][0]['timestamp']).datetime
-
-                if include_data(request_identifier, created, post_comment):
-                    queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-comment-posted', request_identifier, post_comment, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
-
-                    create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='comment', start=created)
-            elif 'string_map_data' in post_comment:
-                post_comment['string_map_data']['Comment']['encrypted_value'] = encrypt_content(post_comment['string_map_data']['Comment']['value'].encode('utf-8'))
-                annotate_field(post_comment['string_map_data']['Comment'], 'value', post_comment['string_map_data']['Comment']['value'])
-                del post_comment['string_map_data']['Comment']['value']
-
-                if 'Media owner' in post_comment['string_map_data']:
-                    post_comment['string_map_data']['Media owner']['encrypted_value'] = encrypt_content(post_comment['string_map_data']['Media owner']['value'].encode('utf-8'))
-                    del post_comment['string_map_data']['Media owner']['value']
-
+            elif 'string_map_data' in post_comment and 'Comment' in post_comment['string_map_data']:
                 created = arrow.get(post_comment['string_map_data']['Comment creation time']['timestamp']).datetime
+            else:
+                continue
 
-                if include_data(request_identifier, created, post_comment):
-                    queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-comment-posted', request_identifier, post_comment, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
-
-                    create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='comment', start=created)
-
+            if include_data(request_identifier, created, post_comment):
+                included.append((post_comment, created))
         except TypeError:
             if warned is False:
                 print('Unexpected structure encountered (process_post_comments): %s' % json.dumps(post_comment, indent=2))
@@ -133,29 +155,33 @@ def process_post_comments(request_identifier, post_comments_raw):
                 print('Unexpected structure encountered (process_post_comments): %s' % json.dumps(post_comment, indent=2))
                 warned = True
 
+    apply_field_policies('pdk-external-instagram-comment-posted', [post_comment for post_comment, created in included])
+
+    for post_comment, created in included:
+        queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-comment-posted', request_identifier, post_comment, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
+
+        create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='comment', start=created)
+
 def process_posts_made(request_identifier, posts_made_raw):
     posts_made = json.loads(posts_made_raw)
 
     if isinstance(posts_made, list) is False:
         return
 
+    included = []
+
     for post in posts_made:
         created = arrow.get(post['media'][0]['creation_timestamp']).datetime
 
         if include_data(request_identifier, created, post):
-            for media in post['media']:
-                media['encrypted_title'] = encrypt_content(media['title'].encode('utf-8'))
-                annotate_field(media, 'title', media['title'])
-                del media['title']
+            included.append((post, created))
 
-                try:
-                    del media['media_metadata']['photo_metadata']['exif_data']
-                except KeyError:
-                    pass
+    apply_field_policies('pdk-external-instagram-post', [post for post, created in included])
 
-            queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-post', request_identifier, post, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
+    for post, created in included:
+        queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-post', request_identifier, post, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
 
-            create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='post', start=created)
+        create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='post', start=created)
 
 def process_liked_comments(request_identifier, liked_comments_raw):
     liked_comments = json.loads(liked_comments_raw)
@@ -168,42 +194,24 @@ def process_liked_comments(request_identifier, liked_comments_raw):
 
     warned = False
 
+    included = []
+
     for liked_comment in liked_comments['likes_comment_likes']:
         try:
             comment_data = liked_comment.get('string_map_data', None)
 
-            if comment_data is not None:
-                created = arrow.get(comment_data['timestamp']).datetime
-
-                if include_data(request_identifier, created, liked_comment):
-                    liked_comment['encrypted_title'] = encrypt_content(liked_comment['title'].encode('utf-8'))
-                    del liked_comment['title']
-
-                    comment_data['encrypted_href'] = encrypt_content(comment_data['href'].encode('utf-8'))
-                    del comment_data['href']
-
-                    queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-comment-like', request_identifier, liked_comment, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
-
-                    create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=0.5, engagement_type='reaction', start=created)
-            else:
+            if comment_data is None:
                 comment_data = liked_comment.get('string_list_data', None)
 
-                if comment_data is not None and len(comment_data) > 0: # pylint: disable=len-as-condition
-                    comment_data = comment_data[0]
-
-                    created = arrow.get(comment_data['timestamp']).datetime
-
-                    if include_data(request_identifier, created, liked_comment):
-                        liked_comment['encrypted_title'] = encrypt_content(liked_comment['title'].encode('utf-8'))
-                        del liked_comment['title']
+                if comment_data is None or len(comment_data) == 0: # pylint: disable=len-as-condition
+                    continue
 
-                        comment_data['encrypted_href'] = encrypt_content(comment_data['href'].encode('utf-8'))
-                        del comment_data['href']
+                comment_data = comment_data[0]
 
-                        queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-comment-like', request_identifier, liked_comment, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
-
-                        create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=0.5, engagement_type='reaction', start=created)
+            created = arrow.get(comment_data['timestamp']).datetime
 
+            if include_data(request_identifier, created, liked_comment):
+                included.append((liked_comment, created))
         except TypeError:
             if warned is False:
                 print('Unexpected structure encountered (process_liked_comments): %s' % json.dumps(liked_comment, indent=2))
@@ -213,6 +221,13 @@ def process_liked_comments(request_identifier, liked_comments_raw):
                 print('Unexpected structure encountered (process_liked_comments): %s' % json.dumps(liked_comment, indent=2))
                 warned = True
 
+    apply_field_policies('pdk-external-instagram-comment-like', [liked_comment for liked_comment, created in included])
+
+    for liked_comment, created in included:
+        queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-comment-like', request_identifier, liked_comment, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
+
+        create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=0.5, engagement_type='reaction', start=created)
+
 def process_liked_posts(request_identifier, liked_posts_raw):
     liked_posts = json.loads(liked_posts_raw)
 
@@ -222,20 +237,20 @@ def process_liked_posts(request_identifier, liked_posts_raw):
     if ('likes_media_likes' in liked_posts) is False:
         return
 
+    included = []
+
     for liked_post in liked_posts['likes_media_likes']:
         created = arrow.get(liked_post['string_map_data']['timestamp']).datetime
 
         if include_data(request_identifier, created, liked_post):
-            liked_post['encrypted_title'] = encrypt_content(liked_post['title'].encode('utf-8'))
-            del liked_post['title']
+            included.append((liked_post, created))
 
-            liked_post['string_list_data']['encrypted_href'] = encrypt_content(liked_post['string_list_data']['href'].encode('utf-8'))
-            del liked_post['string_list_data']['href']
+    apply_field_policies('pdk-external-instagram-post-like', [liked_post for liked_post, created in included])
 
+    for liked_post, created in included:
+        queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-post-like', request_identifier, liked_post, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
 
-            queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-post-like', request_identifier, liked_post, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
-
-            create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=0.5, engagement_type='reaction', start=created)
+        create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=0.5, engagement_type='reaction', start=created)
 
 def process_login_activity(request_identifier, login_activity_raw):
     login_activity = json.loads(login_activity_raw)
@@ -246,16 +261,20 @@ def process_login_activity(request_identifier, login_activity_raw):
     if ('account_history_login_history' in login_activity) is False:
         return
 
+    included = []
+
     for login in login_activity['account_history_login_history']:
         created = arrow.get(login['string_map_data']['Time']['timestamp']).datetime
 
         if include_data(request_identifier, created, login):
-            login['string_map_data']['IP Address']['encrypted_value'] = encrypt_content(login['string_map_data']['IP Address']['value'] .encode('utf-8'))
-            del login['string_map_data']['IP Address']['value']
+            included.append((login, created))
 
-            queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-login', request_identifier, login, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
+    apply_field_policies('pdk-external-instagram-login', [login for login, created in included])
 
-            create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='login', start=created)
+    for login, created in included:
+        queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-login', request_identifier, login, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
+
+        create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='login', start=created)
 
 def process_account_history(request_identifier, history_raw):
     history = json.loads(history_raw)
@@ -263,18 +282,20 @@ def process_account_history(request_identifier, history_raw):
     if isinstance(history, dict) is False:
         return
 
+    included = []
+
     for login in history['login_history']:
         created = arrow.get(login['timestamp']).datetime
 
         if include_data(request_identifier, created, login):
-            login['ip_address_encrypted_value'] = encrypt_content(login['ip_address'] .encode('utf-8'))
+            included.append((login, created))
 
-            del login['ip_address']
-            del login['device_id']
+    apply_field_policies('pdk-external-instagram-login', [login for login, created in included])
 
-            queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-login', request_identifier, login, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
+    for login, created in included:
+        queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-login', request_identifier, login, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
 
-            create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='login', start=created)
+        create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='login', start=created)
 
 def process_stories(request_identifier, stories_raw):
     stories = json.loads(stories_raw)
@@ -305,16 +326,20 @@ def process_logout_activity(request_identifier, logout_activity_raw):
     if ('account_history_logout_history' in logout_activity) is False:
         return
 
+    included = []
+
     for logout in logout_activity['account_history_logout_history']:
         created = arrow.get(logout['string_map_data']['Time']['timestamp']).datetime
 
         if include_data(request_identifier, created, logout):
-            logout['string_map_data']['IP Address']['encrypted_value'] = encrypt_content(logout['string_map_data']['IP Address']['value'] .encode('utf-8'))
-            del logout['string_map_data']['IP Address']['value']
+            included.append((logout, created))
 
-            queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-login', request_identifier, logout, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
+    apply_field_policies('pdk-external-instagram-login', [logout for logout, created in included])
 
-            create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='logout', start=created)
+    for logout, created in included:
+        queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-login', request_identifier, logout, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
+
+        create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='logout', start=created)
 
 def process_messages_new(request_identifier, username, messages_raw):
     messages = json.loads(messages_raw)
@@ -322,34 +347,53 @@ def process_messages_new(request_identifier, username, messages_raw):
     if isinstance(messages, dict) is False:
         return
 
+    # Skip the whole thread if it falls outside the study window.
+
+    timestamps = [message['timestamp_ms'] for message in messages['messages']]
+
+    if timestamps and include_data_range(request_identifier, arrow.get(min(timestamps) / 1000).datetime, arrow.get(max(timestamps) / 1000).datetime) is False:
+        return
+
+    included = []
+
     for message in messages['messages']:
         created = arrow.get(message['timestamp_ms'] / 1000).datetime
 
         if include_data(request_identifier, created, message):
-            pdk_message = {
-                'pdk_recipients_count': len(messages['participants']) - 1,
-                'pdk_hashed_senderId': hash_content(message['sender_name']),
-                'pdk_encrypted_sender': encrypt_content(message['sender_name'].encode('utf-8')),
-                'created_at': message['timestamp_ms']
-            }
+            included.append((message, created))
 
-            if 'content' in message and message['content'] is not None:
-                annotate_field(pdk_message, 'content', message['content'])
-                pdk_message['pdk_encrypted_content'] = encrypt_content(message['content'].encode('utf-8'))
+    pdk_messages = []
 
-            if 'share' in message:
-                if 'link' in message['share']:
-                    pdk_message['pdk_encrypted_media_url'] = encrypt_content(message['share']['link'].encode('utf-8'))
+    for message, created in included:
+        pdk_message = {
+            'pdk_recipients_count': len(messages['participants']) - 1,
+            'sender_name': message['sender_name'],
+            'created_at': message['timestamp_ms']
+        }
 
-                if 'share_text' in message['share']:
-                    annotate_field(pdk_message, 'share_text', message['share']['share_text'])
+        if 'content' in message and message['content'] is not None:
+            pdk_message['content'] = message['content']
 
-            queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-direct-message', request_identifier, pdk_message, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
+        if 'share' in message:
+            if 'link' in message['share']:
+                pdk_message['media_url'] = message['share']['link']
 
-            if message['sender_name'] == username:
-                create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='message', start=created)
-            else:
-                create_engagement_event(source='instagram', identifier=request_identifier, incoming_engagement=1.0, engagement_type='message', start=created)
+            if 'share_text' in message['share']:
+                pdk_message['share_text'] = message['share']['share_text']
+
+        pdk_messages.append(pdk_message)
+
+    # Senders, contents, and links are each encrypted (and hashed) as one batch per thread.
+
+    apply_field_policies('pdk-external-instagram-direct-message', pdk_messages)
+
+    for pdk_message, (message, created) in zip(pdk_messages, included):
+        queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-direct-message', request_identifier, pdk_message, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
+
+        if message['sender_name'] == username:
+            create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='message', start=created)
+        else:
+            create_engagement_event(source='instagram', identifier=request_identifier, incoming_engagement=1.0, engagement_type='message', start=created)
 
 # Older format?
 
@@ -359,6 +403,8 @@ def process_comments(request_identifier, comments_raw):
     if isinstance(comments, dict) is False:
         return
 
+    included = []
+
     for key in comments:
         comment_list = comments[key]
 
@@ -366,66 +412,54 @@ def process_comments(request_identifier, comments_raw):
             created = arrow.get(comment[0]).replace(tzinfo=pytz.timezone('US/Pacific')).datetime
 
             if include_data(request_identifier, created, comment):
-                comment_point = {}
-
-
-                comment_point['pdk_encrypted_comment'] = encrypt_content(comment[1].encode('utf-8'))
+                comment_point = {
+                    'comment': comment[1],
+                    'profile': comment[2],
+                }
 
-                annotate_field(comment_point, 'comment', comment[1])
+                included.append((comment_point, created))
 
-                comment_point['pdk_hashed_profile'] = hash_content(comment[2])
-                comment_point['pdk_encrypted_profile'] = encrypt_content(comment[2].encode('utf-8'))
+    apply_field_policies('pdk-external-instagram-comment', [comment_point for comment_point, created in included])
 
-                queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-comment', request_identifier, comment_point, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
+    for comment_point, created in included:
+        queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-comment', request_identifier, comment_point, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
 
-                create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='comment', start=created)
+        create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='comment', start=created)
 
 def process_media(request_identifier, media_raw):
     media = json.loads(media_raw)
 
     if 'photos' in media:
+        included = []
+
         for photo in media['photos']:
             created = arrow.get(photo['taken_at']).replace(tzinfo=pytz.timezone('US/Pacific')).datetime
 
             if include_data(request_identifier, created, photo):
-                photo['pdk_encrypted_caption'] = encrypt_content(photo['caption'].encode('utf-8'))
-
-                annotate_field(photo, 'caption', photo['caption'])
-
-                del photo['caption']
+                included.append((photo, created))
 
-                if 'location' in photo:
-                    photo['pdk_encrypted_location'] = encrypt_content(photo['location'].encode('utf-8'))
+        apply_field_policies('pdk-external-instagram-photo', [photo for photo, created in included])
 
-                    annotate_field(photo, 'location', photo['location'])
+        for photo, created in included:
+            queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-photo', request_identifier, photo, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
 
-                    del photo['location']
-
-                queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-photo', request_identifier, photo, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
-
-                create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='photo', start=created)
+            create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='photo', start=created)
 
     if 'videos' in media:
+        included = []
+
         for video in media['videos']:
             created = arrow.get(video['taken_at']).replace(tzinfo=pytz.timezone('US/Pacific')).datetime
 
             if include_data(request_identifier, created, video):
-                video['pdk_encrypted_caption'] = encrypt_content(video['caption'].encode('utf-8'))
-
-                annotate_field(video, 'caption', video['caption'])
-
-                del video['caption']
-
-                if 'location' in video:
-                    video['pdk_encrypted_location'] = encrypt_content(video['location'].encode('utf-8'))
+                included.append((video, created))
 
-                    annotate_field(video, 'location', video['location'])
+        apply_field_policies('pdk-external-instagram-video', [video for video, created in included])
 
-                    del video['location']
+        for video, created in included:
+            queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-video', request_identifier, video, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
 
-                queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-video', request_identifier, video, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
-
-                create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='video', start=created)
+            create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='video', start=created)
 
 def process_likes(request_identifier, likes_raw):
     likes = json.loads(likes_raw)
@@ -494,31 +528,36 @@ def process_messages(request_identifier, username, messages_raw):
             if participant != username:
                 hashed_participants = hash_content(participant)
 
+        included = []
+
         for message in conversation['conversation']:
             created = arrow.get(message['created_at']).datetime
 
             if include_data(request_identifier, created, message):
                 pdk_message = {
                     'pdk_recipients_count': len(conversation['participants']) - 1,
-                    'pdk_hashed_senderId': hash_content(message['sender']),
-                    'pdk_encrypted_sender': encrypt_content(message['sender'].encode('utf-8')),
+                    'sender_name': message['sender'],
                     'pdk_hashed_participants': hashed_participants,
                     'created_at': message['created_at']
                 }
 
                 if 'text' in message and message['text'] is not None:
-                    annotate_field(pdk_message, 'text', message['text'])
-                    pdk_message['pdk_encrypted_text'] = encrypt_content(message['text'].encode('utf-8'))
+                    pdk_message['text'] = message['text']
 
                 if 'media_url' in message:
-                    pdk_message['pdk_encrypted_media_url'] = encrypt_content(message['media_url'].encode('utf-8'))
+                    pdk_message['media_url'] = message['media_url']
 
-                queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-direct-message', request_identifier, pdk_message, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
+                included.append((pdk_message, message, created))
 
-                if message['sender'] == username:
-                    create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='message', start=created)
-                else:
-                    create_engagement_event(source='instagram', identifier=request_identifier, incoming_engagement=1.0, engagement_type='message', start=created)
+        apply_field_policies('pdk-external-instagram-direct-message', [pdk_message for pdk_message, message, created in included])
+
+        for pdk_message, message, created in included:
+            queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-instagram-direct-message', request_identifier, pdk_message, user_agent='Passive Data Kit External Importer', created=created, skip_save=True, skip_extract_secondary_identifier=True))
+
+            if message['sender'] == username:
+                create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='message', start=created)
+            else:
+                create_engagement_event(source='instagram', identifier=request_identifier, incoming_engagement=1.0, engagement_type='message', start=created)
 
 def process_seen_content(request_identifier, seen_raw):
     seen = json.loads(seen_raw)
@@ -709,128 +748,123 @@ def process_save_events(request_identifier, json_string):
 
                 create_engagement_event(source='instagram', identifier=request_identifier, outgoing_engagement=0.5, engagement_type='saved-media', start=created)
 
-def import_data(request_identifier, path): # pylint: disable=too-many-branches, too-many-statements
-    with zipfile.ZipFile(path) as content_bundle:
-        skip_files = [
-            'autofill.json',
-            'uploaded_contacts.json',
-            'checkout.json',
-            'profile.json',
-            'settings.json',
-            'information_about_you.json',
-            'devices.json',
-            'shopping.json',
-            'guides.json',
-        ]
-
-        for content_file in content_bundle.namelist():
+SKIP_FILES = [
+    'autofill.json',
+    'uploaded_contacts.json',
+    'checkout.json',
+    'profile.json',
+    'settings.json',
+    'information_about_you.json',
+    'devices.json',
+    'shopping.json',
+    'guides.json',
+]
+
+def import_member(request_identifier, content_bundle, content_file, context): # pylint: disable=too-many-branches, too-many-statements, unused-argument
+    with content_bundle.open(content_file) as opened_file:
+        if content_file.endswith('/'):
+            pass
+        elif 'no-data' in content_file:
+            pass
+        elif '__MACOSX/' in content_file:
+            pass
+        elif '.DS_Store' in content_file:
+            pass
+        elif 'media/archived_posts' in content_file:
+            pass
+        elif 'media/stories' in content_file:
+            pass
+        elif content_file in SKIP_FILES:
+            pass
+        elif content_file.endswith('.mp4'):
+            pass
+        elif content_file.endswith('.m4a'):
+            pass
+        elif content_file.endswith('.jpg'):
+            pass
+        elif re.search(r'messages\/.*\/message_.*\.html', content_file):
+            pass
+        elif re.search(r'\/comments\.json', content_file):
+            print('OPEN: ' + content_file)
+            process_comments(request_identifier, opened_file.read())
+        elif re.search(r'stories_activities\.json', content_file):
+            process_stories(request_identifier, opened_file.read())
+        elif re.search(r'connections\.json', content_file):
+            process_connections_events(request_identifier, opened_file.read())
+        elif re.search(r'saved\.json', content_file):
+            process_save_events(request_identifier, opened_file.read())
+        elif re.search(r'media\.json', content_file):
+            process_media(request_identifier, opened_file.read())
+        elif re.search(r'story_likes\.json', content_file):
+            process_story_likes(request_identifier, opened_file.read())
+        elif re.search(r'likes\.json', content_file):
+            process_likes(request_identifier, opened_file.read())
+        elif re.search(r'seen_content\.json', content_file):
+            process_seen_content(request_identifier, opened_file.read())
+
+        elif re.search(r'word_or_phrase_searches\.json', content_file):
+            process_searches(request_identifier, opened_file.read())
+        elif re.search(r'account_searches\.json', content_file):
+            process_searches(request_identifier, opened_file.read())
+        elif re.search(r'tag_searches\.json', content_file):
+            process_searches(request_identifier, opened_file.read())
+
+        elif re.search(r'searches\.json', content_file):
+            process_searches(request_identifier, opened_file.read())
+        elif re.search(r'messages\.json', content_file):
+            with content_bundle.open('profile.json') as profile_file:
+                profile_json = json.loads(profile_file.read())
+
+                username = profile_json['username']
+
+                process_messages(request_identifier, username, opened_file.read())
+        elif re.search(r'ads_and_content\/ads_viewed\.json', content_file):
+            process_ads_viewed(request_identifier, opened_file.read())
+        elif re.search(r'ads_and_content\/posts_viewed\.json', content_file):
+            process_posts_viewed(request_identifier, opened_file.read())
+        elif re.search(r'ads_and_content\/suggested_accounts_viewed\.json', content_file):
+            process_suggested_accounts_viewed(request_identifier, opened_file.read())
+        elif re.search(r'ads_and_content\/videos_watched\.json', content_file):
+            process_videos_watched(request_identifier, opened_file.read())
+        elif re.search(r'comments\/post_comments\.json', content_file):
+            process_post_comments(request_identifier, opened_file.read())
+        elif re.search(r'posts\/post_.*\.json', content_file):
+            process_posts_made(request_identifier, opened_file.read())
+        elif re.search(r'likes\/liked_comments.json', content_file):
+            process_liked_comments(request_identifier, opened_file.read())
+        elif re.search(r'login_and_account_creation\/login_activity.json', content_file):
+            process_login_activity(request_identifier, opened_file.read())
+        elif re.search(r'account_history.json', content_file):
+            process_account_history(request_identifier, opened_file.read())
+        elif re.search(r'messages\/.*\/message_.*\.json', content_file):
             try:
-                with content_bundle.open(content_file) as opened_file:
-                    if content_file.endswith('/'):
-                        pass
-                    elif 'no-data' in content_file:
-                        pass
-                    elif '__MACOSX/' in content_file:
-                        pass
-                    elif '.DS_Store' in content_file:
-                        pass
-                    elif 'media/archived_posts' in content_file:
-                        pass
-                    elif 'media/stories' in content_file:
-                        pass
-                    elif content_file in skip_files:
-                        pass
-                    elif content_file.endswith('.mp4'):
-                        pass
-                    elif content_file.endswith('.m4a'):
-                        pass
-                    elif content_file.endswith('.jpg'):
-                        pass
-                    elif re.search(r'messages\/.*\/message_.*\.html', content_file):
-                        pass
-                    elif re.search(r'\/comments\.json', content_file):
-                        print('OPEN: ' + content_file)
-                        process_comments(request_identifier, opened_file.read())
-                    elif re.search(r'stories_activities\.json', content_file):
-                        process_stories(request_identifier, opened_file.read())
-                    elif re.search(r'connections\.json', content_file):
-                        process_connections_events(request_identifier, opened_file.read())
-                    elif re.search(r'saved\.json', content_file):
-                        process_save_events(request_identifier, opened_file.read())
-                    elif re.search(r'media\.json', content_file):
-                        process_media(request_identifier, opened_file.read())
-                    elif re.search(r'story_likes\.json', content_file):
-                        process_story_likes(request_identifier, opened_file.read())
-                    elif re.search(r'likes\.json', content_file):
-                        process_likes(request_identifier, opened_file.read())
-                    elif re.search(r'seen_content\.json', content_file):
-                        process_seen_content(request_identifier, opened_file.read())
-
-                    elif re.search(r'word_or_phrase_searches\.json', content_file):
-                        process_searches(request_identifier, opened_file.read())
-                    elif re.search(r'account_searches\.json', content_file):
-                        process_searches(request_identifier, opened_file.read())
-                    elif re.search(r'tag_searches\.json', content_file):
-                        process_searches(request_identifier, opened_file.read())
-
-                    elif re.search(r'searches\.json', content_file):
-                        process_searches(request_identifier, opened_file.read())
-                    elif re.search(r'messages\.json', content_file):
-                        with content_bundle.open('profile.json') as profile_file:
-                            profile_json = json.loads(profile_file.read())
-
-                            username = profile_json['username']
-
-                            process_messages(request_identifier, username, opened_file.read())
-                    elif re.search(r'ads_and_content\/ads_viewed\.json', content_file):
-                        process_ads_viewed(request_identifier, opened_file.read())
-                    elif re.search(r'ads_and_content\/posts_viewed\.json', content_file):
-                        process_posts_viewed(request_identifier, opened_file.read())
-                    elif re.search(r'ads_and_content\/suggested_accounts_viewed\.json', content_file):
-                        process_suggested_accounts_viewed(request_identifier, opened_file.read())
-                    elif re.search(r'ads_and_content\/videos_watched\.json', content_file):
-                        process_videos_watched(request_identifier, opened_file.read())
-                    elif re.search(r'comments\/post_comments\.json', content_file):
-                        process_post_comments(request_identifier, opened_file.read())
-                    elif re.search(r'posts\/post_.*\.json', content_file):
-                        process_posts_made(request_identifier, opened_file.read())
-                    elif re.search(r'likes\/liked_comments.json', content_file):
-                        process_liked_comments(request_identifier, opened_file.read())
-                    elif re.search(r'login_and_account_creation\/login_activity.json', content_file):
-                        process_login_activity(request_identifier, opened_file.read())
-                    elif re.search(r'account_history.json', content_file):
-                        process_account_history(request_identifier, opened_file.read())
-                    elif re.search(r'messages\/.*\/message_.*\.json', content_file):
-                        try:
-                            prefix_index = content_file.index('messages/')
-
-                            account_path = '%s%s' % (content_file[:prefix_index], 'account_information/personal_information.json')
-
-                            with content_bundle.open(account_path) as info_file:
-                                profile_json = json.loads(info_file.read())
-
-                                username = None
-
-                                if 'Username' in profile_json['profile_user'][0]['string_map_data']:
-                                    username = profile_json['profile_user'][0]['string_map_data']['Username']['value']
-
-                                if username is None and 'Name' in profile_json['profile_user'][0]['string_map_data']:
-                                    username = profile_json['profile_user'][0]['string_map_data']['Name']['value']
-
-                                if username is None:
-                                    username = 'Unknown'
-
-                                process_messages_new(request_identifier, username, opened_file.read())
-                        except KeyError:
-                            print('INSTAGRAM[' + request_identifier + ']: Unable to open: ' + content_file)
-                            traceback.print_exc()
-                    else:
-                        print('INSTAGRAM[' + request_identifier + ']: Unable to process: ' + content_file + ' -- ' + str(content_bundle.getinfo(content_file).file_size))
-            except: # pylint: disable=bare-except
+                prefix_index = content_file.index('messages/')
+
+                account_path = '%s%s' % (content_file[:prefix_index], 'account_information/personal_information.json')
+
+                with content_bundle.open(account_path) as info_file:
+                    profile_json = json.loads(info_file.read())
+
+                    username = None
+
+                    if 'Username' in profile_json['profile_user'][0]['string_map_data']:
+                        username = profile_json['profile_user'][0]['string_map_data']['Username']['value']
+
+                    if username is None and 'Name' in profile_json['profile_user'][0]['string_map_data']:
+                        username = profile_json['profile_user'][0]['string_map_data']['Name']['value']
+
+                    if username is None:
+                        username = 'Unknown'
+
+                    process_messages_new(request_identifier, username, opened_file.read())
+            except KeyError:
+                print('INSTAGRAM[' + request_identifier + ']: Unable to open: ' + content_file)
                 traceback.print_exc()
-                return False
+        else:
+            print('INSTAGRAM[' + request_identifier + ']: Unable to process: ' + content_file + ' -- ' + str(content_bundle.getinfo(content_file).file_size))
 
-    return True
+def import_data(request_identifier, path, data_file=None, batch_writer=None):
+    return import_bundle(request_identifier, path, import_member, data_file=data_file, batch_writer=batch_writer)
 
 def external_data_metadata(generator_identifier, point): # pylint: disable=unused-argument
     if generator_identifier.startswith('pdk-external-instagram') is False:
@@ -4,8 +4,6 @@ from __future__ import print_function
 
 import csv
 import re
-import traceback
-import zipfile
 
 from io import BytesIO
 
@@ -15,25 +13,93 @@ from django.conf import settings
 
 from passive_data_kit.models import DataPoint
 
-from ..utils import hash_content, encrypt_content, create_engagement_event
+from ..field_policies import FieldPolicy, apply_field_policies, register_field_policies
+from ..utils import create_engagement_event, queue_batch_insert, import_bundle
+
+register_field_policies('pdk-external-linkedin-follow',
+                        FieldPolicy(('organization',), encrypt_as='pdk_encrypted_organization', hash_as='pdk_hashed_organization', drop=True))
+
+register_field_policies('pdk-external-linkedin-connection',
+                        FieldPolicy(('first_name',), encrypt_as='pdk_encrypted_first_name', hash_as='pdk_hashed_first_name', drop=True),
+                        FieldPolicy(('last_name',), encrypt_as='pdk_encrypted_last_name', hash_as='pdk_hashed_last_name', drop=True),
+                        FieldPolicy(('email',), encrypt_as='pdk_encrypted_email', hash_as='pdk_hashed_email', drop=True),
+                        FieldPolicy(('company',), encrypt_as='pdk_encrypted_company', hash_as='pdk_hashed_company', drop=True),
+                        FieldPolicy(('position',), encrypt_as='pdk_encrypted_position', hash_as='pdk_hashed_position', drop=True))
+
+register_field_policies('pdk-external-linkedin-contact',
+                        FieldPolicy(('first_name',), encrypt_as='pdk_encrypted_first_name', hash_as='pdk_hashed_first_name', drop=True),
+                        FieldPolicy(('last_name',), encrypt_as='pdk_encrypted_last_name', hash_as='pdk_hashed_last_name', drop=True),
+                        FieldPolicy(('companies',), encrypt_as='pdk_encrypted_companies', drop=True),
+                        FieldPolicy(('title',), encrypt_as='pdk_encrypted_title', hash_as='pdk_hashed_title', drop=True),
+                        FieldPolicy(('emails',), encrypt_as='pdk_encrypted_emails', drop=True),
+                        FieldPolicy(('phone_numbers',), encrypt_as='pdk_encrypted_phone_numbers', drop=True),
+                        FieldPolicy(('row',), encrypt_as='pdk_encrypted_row', drop=True))
+
+register_field_policies('pdk-external-linkedin-email',
+                        FieldPolicy(('email',), encrypt_as='pdk_encrypted_email', hash_as='pdk_hashed_email', drop=True))
+
+register_field_policies('pdk-external-linkedin-membership',
+                        FieldPolicy(('group_name',), encrypt_as='pdk_encrypted_group_name', hash_as='pdk_hashed_group_name', drop=True),
+                        FieldPolicy(('group_description',), encrypt_as='pdk_encrypted_group_description', drop=True),
+                        FieldPolicy(('group_rules',), encrypt_as='pdk_encrypted_group_rules', drop=True))
+
+register_field_policies('pdk-external-linkedin-invitation',
+                        FieldPolicy(('from',), encrypt_as='pdk_encrypted_from', hash_as='pdk_hashed_from', drop=True),
+                        FieldPolicy(('to',), encrypt_as='pdk_encrypted_to', hash_as='pdk_hashed_to', drop=True),
+                        FieldPolicy(('message',), encrypt_as='pdk_encrypted_message', length_as='pdk_length_message', drop=True))
+
+register_field_policies('pdk-external-linkedin-message',
+                        FieldPolicy(('from',), encrypt_as='pdk_encrypted_from', hash_as='pdk_hashed_from', drop=True),
+                        FieldPolicy(('to',), encrypt_as='pdk_encrypted_to', hash_as='pdk_hashed_to', drop=True),
+                        FieldPolicy(('subject',), encrypt_as='pdk_encrypted_subject', length_as='pdk_length_subject', drop=True),
+                        FieldPolicy(('content',), encrypt_as='pdk_encrypted_content', length_as='pdk_length_content', drop=True))
+
+RECOMMENDATION_POLICIES = (
+    FieldPolicy(('first_name',), encrypt_as='pdk_encrypted_first_name', hash_as='pdk_hashed_first_name', drop=True),
+    FieldPolicy(('last_name',), encrypt_as='pdk_encrypted_last_name', hash_as='pdk_hashed_last_name', drop=True),
+    FieldPolicy(('company',), encrypt_as='pdk_encrypted_company', hash_as='pdk_hashed_company', drop=True),
+    FieldPolicy(('title',), encrypt_as='pdk_encrypted_title', hash_as='pdk_hashed_title', drop=True),
+    FieldPolicy(('text',), encrypt_as='pdk_encrypted_text', length_as='pdk_length_text', drop=True),
+)
+
+register_field_policies('pdk-external-linkedin-recommendation-given', *RECOMMENDATION_POLICIES)
+register_field_policies('pdk-external-linkedin-recommendation-received', *RECOMMENDATION_POLICIES)
+
+register_field_policies('pdk-external-linkedin-registration',
+                        FieldPolicy(('ip_address',), encrypt_as='pdk_encrypted_ip_address', drop=True))
+
+def queue_included(request_identifier, generator_identifier, included, **engagement):
+    '''
+    Applies generator_identifier's field policies to the included (record, created) pairs,
+    then queues each record (with an engagement event, if engagement is given).
+    '''
+
+    apply_field_policies(generator_identifier, [record for record, created in included])
+
+    for record, created in included:
+        queue_batch_insert(DataPoint.objects.create_data_point(generator_identifier, request_identifier, record, user_agent='Passive Data Kit External Importer', created=created, skip_save=True))
+
+        if engagement:
+            create_engagement_event(source='linkedin', identifier=request_identifier, start=created, **engagement)
 
 def process_follows(request_identifier, follows_raw):
     file_like = BytesIO(follows_raw)
 
     csv_reader = csv.reader(file_like)
 
+    included = []
+
     for row in csv_reader:
         if row[0] != 'Organization':
             follow_point = {}
 
             created = arrow.get(row[1], 'ddd MMM DD HH:mm:ss ZZZ YYYY').datetime
 
-            follow_point['pdk_encrypted_organization'] = encrypt_content(row[0])
-            follow_point['pdk_hashed_organization'] = hash_content(row[0])
+            follow_point['organization'] = row[0]
 
-            DataPoint.objects.create_data_point('pdk-external-linkedin-follow', request_identifier, follow_point, user_agent='Passive Data Kit External Importer', created=created)
+            included.append((follow_point, created))
 
-            create_engagement_event(source='linkedin', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='follow', start=created)
+    queue_included(request_identifier, 'pdk-external-linkedin-follow', included, outgoing_engagement=1.0, engagement_type='follow')
 
 
 def process_connections(request_identifier, connections_raw):
@@ -41,6 +107,8 @@ def process_connections(request_identifier, connections_raw):
 
     csv_reader = csv.reader(file_like)
 
+    included = []
+
     for row in csv_reader:
         if len(row) >= 6:
             if row[0] != 'First Name':
@@ -48,22 +116,15 @@ def process_connections(request_identifier, connections_raw):
 
                 created = arrow.get(row[5], 'DD MMM YYYY').to(settings.TIME_ZONE).replace(hour=12, minute=0, second=0).datetime
 
-                connection_point['pdk_encrypted_first_name'] = encrypt_content(row[0])
-                connection_point['pdk_hashed_first_name'] = hash_content(row[0])
-
-                connection_point['pdk_encrypted_last_name'] = encrypt_content(row[1])
-                connection_point['pdk_hashed_last_name'] = hash_content(row[1])
-
-                connection_point['pdk_encrypted_email'] = encrypt_content(row[2])
-                connection_point['pdk_hashed_email'] = hash_content(row[2])
+                connection_point['first_name'] = row[0]
+                connection_point['last_name'] = row[1]
+                connection_point['email'] = row[2]
+                connection_point['company'] = row[3]
+                connection_point['position'] = row[4]
 
-                connection_point['pdk_encrypted_company'] = encrypt_content(row[3])
-                connection_point['pdk_hashed_company'] = hash_content(row[3])
+                included.append((connection_point, created))
 
-                connection_point['pdk_encrypted_position'] = encrypt_content(row[4])
-                connection_point['pdk_hashed_position'] = hash_content(row[4])
-
-                DataPoint.objects.create_data_point('pdk-external-linkedin-connection', request_identifier, connection_point, user_agent='Passive Data Kit External Importer', created=created)
+    queue_included(request_identifier, 'pdk-external-linkedin-connection', included)
 
 
 def process_contacts(request_identifier, contacts_raw):
@@ -71,6 +132,8 @@ def process_contacts(request_identifier, contacts_raw):
 
     csv_reader = csv.reader(file_like)
 
+    included = []
+
     for row in csv_reader:
         if row[0] != 'Source':
             contact_point = {}
@@ -79,27 +142,22 @@ def process_contacts(request_identifier, contacts_raw):
 
             contact_point['source'] = row[0]
 
-            contact_point['pdk_encrypted_first_name'] = encrypt_content(row[1])
-            contact_point['pdk_hashed_first_name'] = hash_content(row[1])
-
-            contact_point['pdk_encrypted_last_name'] = encrypt_content(row[2])
-            contact_point['pdk_hashed_last_name'] = hash_content(row[2])
-
-            contact_point['pdk_encrypted_companies'] = encrypt_content(row[3])
-
-            contact_point['pdk_encrypted_title'] = encrypt_content(row[4])
-            contact_point['pdk_hashed_title'] = hash_content(row[4])
-
-            contact_point['pdk_encrypted_emails'] = encrypt_content(row[5])
-            contact_point['pdk_encrypted_phone_numbers'] = encrypt_content(row[6])
+            contact_point['first_name'] = row[1]
+            contact_point['last_name'] = row[2]
+            contact_point['companies'] = row[3]
+            contact_point['title'] = row[4]
+            contact_point['emails'] = row[5]
+            contact_point['phone_numbers'] = row[6]
 
             row_io = BytesIO()
             row_csv = csv.writer(row_io)
             row_csv.writerow(row)
 
-            contact_point['pdk_encrypted_row'] = encrypt_content(row_io.getvalue())
+            contact_point['row'] = row_io.getvalue()
+
+            included.append((contact_point, created))
 
-            DataPoint.objects.create_data_point('pdk-external-linkedin-contact', request_identifier, contact_point, user_agent='Passive Data Kit External Importer', created=created)
+    queue_included(request_identifier, 'pdk-external-linkedin-contact', included)
 
 
 def process_email_addresses(request_identifier, emails_raw):
@@ -107,6 +165,8 @@ def process_email_addresses(request_identifier, emails_raw):
 
     csv_reader = csv.reader(file_like)
 
+    included = []
+
     for row in csv_reader:
         if row[0] != 'Email Address':
             email_point = {}
@@ -114,13 +174,14 @@ def process_email_addresses(request_identifier, emails_raw):
             if row[3] != 'Not Available':
                 created = arrow.get(row[3], 'M/D/YY, h:mm A').to(settings.TIME_ZONE).datetime
 
-                email_point['pdk_encrypted_email'] = encrypt_content(row[0])
-                email_point['pdk_hashed_email'] = hash_content(row[0])
+                email_point['email'] = row[0]
 
                 email_point['pdk_confirmed'] = row[1] == 'Yes'
                 email_point['pdk_is_primary'] = row[2] == 'Yes'
 
-                DataPoint.objects.create_data_point('pdk-external-linkedin-email', request_identifier, email_point, user_agent='Passive Data Kit External Importer', created=created)
+                included.append((email_point, created))
+
+    queue_included(request_identifier, 'pdk-external-linkedin-email', included)
 
 
 def process_groups(request_identifier, groups_raw):
@@ -128,21 +189,23 @@ def process_groups(request_identifier, groups_raw):
 
     csv_reader = csv.reader(file_like)
 
+    included = []
+
     for row in csv_reader:
         if row[0] != 'Group name':
             group_point = {}
 
             created = arrow.get(row[3], 'YYYY/MM/DD HH:mm:ss ZZZ').datetime
 
-            group_point['pdk_encrypted_group_name'] = encrypt_content(row[0])
-            group_point['pdk_hashed_group_name'] = hash_content(row[0])
-
-            group_point['pdk_encrypted_group_description'] = encrypt_content(row[1])
-            group_point['pdk_encrypted_group_rules'] = encrypt_content(row[2])
+            group_point['group_name'] = row[0]
+            group_point['group_description'] = row[1]
+            group_point['group_rules'] = row[2]
 
             group_point['pdk_membership'] = row[4]
 
-            DataPoint.objects.create_data_point('pdk-external-linkedin-membership', request_identifier, group_point, user_agent='Passive Data Kit External Importer', created=created)
+            included.append((group_point, created))
+
+    queue_included(request_identifier, 'pdk-external-linkedin-membership', included)
 
 
 def process_invitations(request_identifier, invitations_raw):
@@ -150,24 +213,23 @@ def process_invitations(request_identifier, invitations_raw):
 
     csv_reader = csv.reader(file_like)
 
+    included = []
+
     for row in csv_reader:
         if row[0] != 'From':
             invite_point = {}
 
             created = arrow.get(row[2], 'M/D/YY, h:mm A').to(settings.TIME_ZONE).datetime
 
-            invite_point['pdk_encrypted_from'] = encrypt_content(row[0])
-            invite_point['pdk_hashed_from'] = hash_content(row[0])
-
-            invite_point['pdk_encrypted_to'] = encrypt_content(row[1])
-            invite_point['pdk_hashed_to'] = hash_content(row[1])
-
-            invite_point['pdk_encrypted_message'] = encrypt_content(row[3])
-            invite_point['pdk_length_message'] = len(row[3])
+            invite_point['from'] = row[0]
+            invite_point['to'] = row[1]
+            invite_point['message'] = row[3]
 
             invite_point['pdk_direction'] = row[4]
 
-            DataPoint.objects.create_data_point('pdk-external-linkedin-invitation', request_identifier, invite_point, user_agent='Passive Data Kit External Importer', created=created)
+            included.append((invite_point, created))
+
+    queue_included(request_identifier, 'pdk-external-linkedin-invitation', included)
 
 
 def process_messages(request_identifier, messages_raw):
@@ -177,6 +239,8 @@ def process_messages(request_identifier, messages_raw):
 
     csv_reader = csv.reader(file_like)
 
+    included = []
+
     for row in csv_reader:
         if row[2] != 'FROM' and row[5] != 'DIRECTION':
             message_point = {}
@@ -191,100 +255,62 @@ def process_messages(request_identifier, messages_raw):
                 except arrow.parser.ParserError:
                     print('Invalid LinkedIn messages file: ' + request_identifier)
 
-                    return
+                    break # Keeps the messages read so far.
 
-            message_point['pdk_encrypted_from'] = encrypt_content(row[2])
-            message_point['pdk_hashed_from'] = hash_content(row[2])
-
-            message_point['pdk_encrypted_to'] = encrypt_content(row[4])
-            message_point['pdk_hashed_to'] = hash_content(row[4])
-
-            message_point['pdk_encrypted_subject'] = encrypt_content(row[6])
-            message_point['pdk_length_subject'] = len(row[6])
-
-            message_point['pdk_encrypted_content'] = encrypt_content(row[7])
-            message_point['pdk_length_content'] = len(row[7])
+            message_point['from'] = row[2]
+            message_point['to'] = row[4]
+            message_point['subject'] = row[6]
+            message_point['content'] = row[7]
 
             # message_point['pdk_direction'] = row[5]
             message_point['pdk_folder'] = row[8]
 
-            DataPoint.objects.create_data_point('pdk-external-linkedin-message', request_identifier, message_point, user_agent='Passive Data Kit External Importer', created=created)
+            included.append((message_point, created))
 
-            create_engagement_event(source='linkedin', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='message', start=created)
+    queue_included(request_identifier, 'pdk-external-linkedin-message', included, outgoing_engagement=1.0, engagement_type='message')
 
 
-def process_recommendations_given(request_identifier, recommendations_raw):
+def included_recommendations(recommendations_raw):
     file_like = BytesIO(recommendations_raw)
 
     csv_reader = csv.reader(file_like)
 
+    included = []
+
     for row in csv_reader:
         if row[0] != 'First Name':
             recommendation_point = {}
 
             created = arrow.get(row[5], 'M/D/YY, h:mm A').to(settings.TIME_ZONE).datetime
 
-            recommendation_point['pdk_encrypted_first_name'] = encrypt_content(row[0])
-            recommendation_point['pdk_hashed_first_name'] = hash_content(row[0])
-
-            recommendation_point['pdk_encrypted_last_name'] = encrypt_content(row[1])
-            recommendation_point['pdk_hashed_last_name'] = hash_content(row[1])
-
-            recommendation_point['pdk_encrypted_company'] = encrypt_content(row[2])
-            recommendation_point['pdk_hashed_company'] = hash_content(row[2])
-
-            recommendation_point['pdk_encrypted_title'] = encrypt_content(row[3])
-            recommendation_point['pdk_hashed_title'] = hash_content(row[3])
-
-            recommendation_point['pdk_encrypted_text'] = encrypt_content(row[5])
-            recommendation_point['pdk_length_text'] = len(row[5])
+            recommendation_point['first_name'] = row[0]
+            recommendation_point['last_name'] = row[1]
+            recommendation_point['company'] = row[2]
+            recommendation_point['title'] = row[3]
+            recommendation_point['text'] = row[5]
 
             if row[5]:
                 recommendation_point['pdk_status'] = len(row[5])
 
-            DataPoint.objects.create_data_point('pdk-external-linkedin-recommendation-given', request_identifier, recommendation_point, user_agent='Passive Data Kit External Importer', created=created)
-
-            create_engagement_event(source='linkedin', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='recommendation', start=created)
-
-
-def process_recommendations_received(request_identifier, recommendations_raw): # pylint: disable=invalid-name
-    file_like = BytesIO(recommendations_raw)
-
-    csv_reader = csv.reader(file_like)
+            included.append((recommendation_point, created))
 
-    for row in csv_reader:
-        if row[0] != 'First Name':
-            recommendation_point = {}
-
-            created = arrow.get(row[5], 'M/D/YY, h:mm A').to(settings.TIME_ZONE).datetime
+    return included
 
-            recommendation_point['pdk_encrypted_first_name'] = encrypt_content(row[0])
-            recommendation_point['pdk_hashed_first_name'] = hash_content(row[0])
 
-            recommendation_point['pdk_encrypted_last_name'] = encrypt_content(row[1])
-            recommendation_point['pdk_hashed_last_name'] = hash_content(row[1])
-
-            recommendation_point['pdk_encrypted_company'] = encrypt_content(row[2])
-            recommendation_point['pdk_hashed_company'] = hash_content(row[2])
-
-            recommendation_point['pdk_encrypted_title'] = encrypt_content(row[3])
-            recommendation_point['pdk_hashed_title'] = hash_content(row[3])
-
-            recommendation_point['pdk_encrypted_text'] = encrypt_content(row[5])
-            recommendation_point['pdk_length_text'] = len(row[5])
-
-            if row[5]:
-                recommendation_point['pdk_status'] = len(row[5])
+def process_recommendations_given(request_identifier, recommendations_raw):
+    queue_included(request_identifier, 'pdk-external-linkedin-recommendation-given', included_recommendations(recommendations_raw), outgoing_engagement=1.0, engagement_type='recommendation')
 
-            DataPoint.objects.create_data_point('pdk-external-linkedin-recommendation-received', request_identifier, recommendation_point, user_agent='Passive Data Kit External Importer', created=created)
 
-            create_engagement_event(source='linkedin', identifier=request_identifier, incoming_engagement=1.0, engagement_type='registration', start=created)
+def process_recommendations_received(request_identifier, recommendations_raw): # pylint: disable=invalid-name
+    queue_included(request_identifier, 'pdk-external-linkedin-recommendation-received', included_recommendations(recommendations_raw), incoming_engagement=1.0, engagement_type='registration')
 
 def process_registration(request_identifier, registration_raw):
     file_like = BytesIO(registration_raw)
 
     csv_reader = csv.reader(file_like)
 
+    included = []
+
     for row in csv_reader:
         if row[0] != 'Registered At':
             registration_point = {}
@@ -292,50 +318,45 @@ def process_registration(request_identifier, registration_raw):
             created = arrow.get(row[0], 'M/D/YY, h:mm A').to(settings.TIME_ZONE).datetime
 
             if row[1]:
-                registration_point['pdk_encrypted_ip_address'] = encrypt_content(row[1])
+                registration_point['ip_address'] = row[1]
 
             if row[2]:
                 registration_point['pdk_subscription_types'] = row[2]
 
-            DataPoint.objects.create_data_point('pdk-external-linkedin-registration', request_identifier, registration_point, user_agent='Passive Data Kit External Importer', created=created)
-
-            create_engagement_event(source='linkedin', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='registration', start=created)
-
+            included.append((registration_point, created))
+
+    queue_included(request_identifier, 'pdk-external-linkedin-registration', included, outgoing_engagement=1.0, engagement_type='registration')
+
+
+def import_member(request_identifier, content_bundle, content_file, context): # pylint: disable=too-many-branches, unused-argument
+    with content_bundle.open(content_file) as opened_file:
+        if content_file.endswith('/'):
+            pass
+        elif re.match(r'^Company\ Follows\.csv', content_file):
+            process_follows(request_identifier, opened_file.read())
+        elif re.match(r'^Connections\.csv', content_file):
+            process_connections(request_identifier, opened_file.read())
+        elif re.match(r'^Contacts\.csv', content_file):
+            process_contacts(request_identifier, opened_file.read())
+        elif re.match(r'^Email\ Addresses\.csv', content_file):
+            process_email_addresses(request_identifier, opened_file.read())
+        elif re.match(r'^Groups\.csv', content_file):
+            process_groups(request_identifier, opened_file.read())
+        elif re.match(r'^Invitations\.csv', content_file):
+            process_invitations(request_identifier, opened_file.read())
+        elif re.match(r'^messages\.csv', content_file):
+            process_messages(request_identifier, opened_file.read())
+        elif re.match(r'^Recommendations\ Given\.csv', content_file):
+            process_recommendations_given(request_identifier, opened_file.read())
+        elif re.match(r'^Recommendations\ Received\.csv', content_file):
+            process_recommendations_received(request_identifier, opened_file.read())
+        elif re.match(r'^Registration\.csv', content_file):
+            process_registration(request_identifier, opened_file.read())
+        else:
+            print('LINKEDIN[' + request_identifier + ']: Unable to process: ' + content_file + ' -- ' + str(content_bundle.getinfo(content_file).file_size))
 
-def import_data(request_identifier, path): # pylint: disable=too-many-branches
-    with zipfile.ZipFile(path) as content_bundle:
-        for content_file in content_bundle.namelist():
-            try:
-                with content_bundle.open(content_file) as opened_file:
-                    if content_file.endswith('/'):
-                        pass
-                    elif re.match(r'^Company\ Follows\.csv', content_file):
-                        process_follows(request_identifier, opened_file.read())
-                    elif re.match(r'^Connections\.csv', content_file):
-                        process_connections(request_identifier, opened_file.read())
-                    elif re.match(r'^Contacts\.csv', content_file):
-                        process_contacts(request_identifier, opened_file.read())
-                    elif re.match(r'^Email\ Addresses\.csv', content_file):
-                        process_email_addresses(request_identifier, opened_file.read())
-                    elif re.match(r'^Groups\.csv', content_file):
-                        process_groups(request_identifier, opened_file.read())
-                    elif re.match(r'^Invitations\.csv', content_file):
-                        process_invitations(request_identifier, opened_file.read())
-                    elif re.match(r'^messages\.csv', content_file):
-                        process_messages(request_identifier, opened_file.read())
-                    elif re.match(r'^Recommendations\ Given\.csv', content_file):
-                        process_recommendations_given(request_identifier, opened_file.read())
-                    elif re.match(r'^Recommendations\ Received\.csv', content_file):
-                        process_recommendations_received(request_identifier, opened_file.read())
-                    elif re.match(r'^Registration\.csv', content_file):
-                        process_registration(request_identifier, opened_file.read())
-                    else:
-                        print('LINKEDIN[' + request_identifier + ']: Unable to process: ' + content_file + ' -- ' + str(content_bundle.getinfo(content_file).file_size))
-            except: # pylint: disable=bare-except
-                traceback.print_exc()
-                return False
-
-    return True
+def import_data(request_identifier, path, data_file=None, batch_writer=None):
+    return import_bundle(request_identifier, path, import_member, data_file=data_file, batch_writer=batch_writer)
 
 
 def external_data_metadata(generator_identifier, point):
@@ -4,82 +4,154 @@ from __future__ import print_function
 
 import json
 import re
-import traceback
-import zipfile
 
 import arrow
 
 from passive_data_kit.models import DataPoint
 
-from ..utils import hash_content, encrypt_content, create_engagement_event, include_data
+from ..field_policies import FieldPolicy, apply_field_policies, register_field_policies
+from ..utils import create_engagement_event, queue_batch_insert, include_data, import_bundle
+
+register_field_policies('pdk-external-snapchat-chat-received',
+                        FieldPolicy(('from',), hash_as='pdk_hashed_from', encrypt_as='pdk_encrypted_from', length_as='pdk_length_from', drop=True))
+
+register_field_policies('pdk-external-snapchat-chat-sent',
+                        FieldPolicy(('to',), hash_as='pdk_hashed_to', encrypt_as='pdk_encrypted_to', length_as='pdk_length_to', drop=True))
+
+register_field_policies('pdk-external-snapchat-memory-history',
+                        FieldPolicy(('download_link',), hash_as='pdk_hashed_download_link', encrypt_as='pdk_encrypted_download_link', length_as='pdk_length_download_link', drop=True))
+
+register_field_policies('pdk-external-snapchat-shared-story',
+                        FieldPolicy(('story_id',), hash_as='pdk_hashed_story_id', encrypt_as='pdk_encrypted_story_id', length_as='pdk_length_story_id', drop=True),
+                        FieldPolicy(('content', '*', 'item'), hash_as='pdk_hashed_item', encrypt_as='pdk_encrypted_item', length_as='pdk_length_item', drop=True))
+
+register_field_policies('pdk-external-snapchat-spoytlight-history',
+                        FieldPolicy(('story_url',), hash_as='pdk_hashed_story_url', encrypt_as='pdk_encrypted_story_url', drop=True))
+
+register_field_policies('pdk-external-snapchat-snap-received',
+                        FieldPolicy(('from',), hash_as='pdk_hashed_from', encrypt_as='pdk_encrypted_from', length_as='pdk_length_from', drop=True))
+
+register_field_policies('pdk-external-snapchat-snap-sent',
+                        FieldPolicy(('to',), hash_as='pdk_hashed_to', encrypt_as='pdk_encrypted_to', length_as='pdk_length_to', drop=True))
+
+register_field_policies('pdk-external-snapchat-support-note',
+                        FieldPolicy(('subject',), hash_as='pdk_hashed_subject', encrypt_as='pdk_encrypted_subject', length_as='pdk_length_subject', drop=True),
+                        FieldPolicy(('message',), hash_as='pdk_hashed_message', encrypt_as='pdk_encrypted_message', length_as='pdk_length_message', drop=True))
+
+register_field_policies('pdk-external-snapchat-login',
+                        FieldPolicy(('ip_address',), hash_as='pdk_hashed_ip_address', encrypt_as='pdk_encrypted_ip_address', drop=True))
+
+register_field_policies('pdk-external-snapchat-story-view',
+                        FieldPolicy(('View',), hash_as='pdk_hashed_viewer', drop=True))
+
+CONTACT_POLICIES = (
+    FieldPolicy(('Username',), encrypt_as='pdk_encrypted_username', drop=True),
+    FieldPolicy(('Display Name',), encrypt_as='pdk_encrypted_display_name', drop=True),
+)
+
+register_field_policies('pdk-external-snapchat-deleted-contact', *CONTACT_POLICIES)
+register_field_policies('pdk-external-snapchat-requested-contact', *CONTACT_POLICIES)
+register_field_policies('pdk-external-snapchat-blocked-contact', *CONTACT_POLICIES)
+register_field_policies('pdk-external-snapchat-added-contact', *CONTACT_POLICIES)
+
+register_field_policies('pdk-external-snapchat-scan',
+                        FieldPolicy(('Scan Image',), encrypt_as='pdk_encrypted_scan_image', drop=True),
+                        FieldPolicy(('Location',), encrypt_as='pdk_encrypted_location', drop=True))
+
+register_field_policies('pdk-external-snapchat-place-share',
+                        FieldPolicy(('Place Location',), encrypt_as='pdk_encrypted_place_location', drop=True),
+                        FieldPolicy(('Place',), encrypt_as='pdk_encrypted_place', drop=True))
+
+register_field_policies('pdk-external-snapchat-call',
+                        FieldPolicy(('City',), encrypt_as='pdk_encrypted_city', drop=True))
+
+register_field_policies('pdk-external-snapchat-search',
+                        FieldPolicy(('Search Term',), encrypt_as='pdk_encrypted_query', drop=True),
+                        FieldPolicy(('Location',), encrypt_as='pdk_encrypted_location', drop=True))
+
+def queue_included(request_identifier, generator_identifier, included, duration_field=None, **engagement):
+    '''
+    Applies generator_identifier's field policies to the included (record, created) pairs,
+    then queues each record with an engagement event (lasting record[duration_field]).
+    '''
+
+    apply_field_policies(generator_identifier, [record for record, created in included])
+
+    for record, created in included:
+        queue_batch_insert(DataPoint.objects.create_data_point(generator_identifier, request_identifier, record, user_agent='Passive Data Kit External Importer', created=created, skip_save=True))
+
+        if duration_field is not None:
+            engagement['duration'] = record[duration_field]
+
+        create_engagement_event(source='snapchat', identifier=request_identifier, start=created, **engagement)
 
 def process_chat_history(request_identifier, json_string):
     chat_history = json.loads(json_string)
 
+    received = []
+
     for message in chat_history.get('Received Chat History', []):
         created = arrow.get(message['Created'], 'YYYY-MM-DD HH:mm:ss ZZZ').datetime
 
         if include_data(request_identifier, created, message):
             pdk_message = {
-                'pdk_hashed_from': hash_content(message['From']),
-                'pdk_encrypted_from': encrypt_content(message['From'].encode('utf-8')),
-                'pdk_length_from': len(message['From']),
+                'from': message['From'],
                 'media_type': message['Media Type'],
                 'created': message['Created'],
             }
 
-            DataPoint.objects.create_data_point('pdk-external-snapchat-chat-received', request_identifier, pdk_message, user_agent='Passive Data Kit External Importer', created=created)
+            received.append((pdk_message, created))
+
+    queue_included(request_identifier, 'pdk-external-snapchat-chat-received', received, incoming_engagement=1.0, engagement_type='message')
 
-            create_engagement_event(source='snapchat', identifier=request_identifier, incoming_engagement=1.0, engagement_type='message', start=created)
+    sent = []
 
     for message in chat_history.get('Sent Chat History', []):
         created = arrow.get(message['Created'], 'YYYY-MM-DD HH:mm:ss ZZZ').datetime
 
         if include_data(request_identifier, created, message):
             pdk_message = {
-                'pdk_hashed_to': hash_content(message['To']),
-                'pdk_encrypted_to': encrypt_content(message['To'].encode('utf-8')),
-                'pdk_length_to': len(message['To']),
+                'to': message['To'],
                 'media_type': message['Media Type'],
                 'created': message['Created'],
             }
 
-            DataPoint.objects.create_data_point('pdk-external-snapchat-chat-sent', request_identifier, pdk_message, user_agent='Passive Data Kit External Importer', created=created)
+            sent.append((pdk_message, created))
 
-            create_engagement_event(source='snapchat', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='message', start=created)
+    queue_included(request_identifier, 'pdk-external-snapchat-chat-sent', sent, outgoing_engagement=1.0, engagement_type='message')
 
 
 def process_memories_history(request_identifier, json_string):
     memories_history = json.loads(json_string)
 
+    included = []
+
     for media in memories_history.get('Saved Media', []):
         created = arrow.get(media['Date'], 'YYYY-MM-DD HH:mm:ss ZZZ').datetime
 
         if include_data(request_identifier, created, media):
             pdk_media = {
-                'pdk_hashed_download_link': hash_content(media['Download Link']),
-                'pdk_encrypted_download_link': encrypt_content(media['Download Link'].encode('utf-8')),
-                'pdk_length_download_link': len(media['Download Link']),
+                'download_link': media['Download Link'],
                 'media_type': media['Media Type'],
                 'date': media['Date'],
             }
 
-            DataPoint.objects.create_data_point('pdk-external-snapchat-memory-history', request_identifier, pdk_media, user_agent='Passive Data Kit External Importer', created=created)
+            included.append((pdk_media, created))
 
-            create_engagement_event(source='snapchat', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='memory', start=created)
+    queue_included(request_identifier, 'pdk-external-snapchat-memory-history', included, outgoing_engagement=1.0, engagement_type='memory')
 
 
 def process_shared_story(request_identifier, json_string):
     shared_story = json.loads(json_string)
 
+    included = []
+
     for story in shared_story.get('Shared Story', []):
         created = arrow.get(story['Created'], 'YYYY-MM-DD HH:mm:ss ZZZ').datetime
 
         if include_data(request_identifier, created, story):
             pdk_story = {
-                'pdk_hashed_story_id': hash_content(story['Story Id']),
-                'pdk_encrypted_story_id': encrypt_content(story['Story Id'].encode('utf-8')),
-                'pdk_length_story_id': len(story['Story Id']),
+                'story_id': story['Story Id'],
                 'create_time': story['Created'],
                 'content': [],
             }
@@ -89,287 +161,179 @@ def process_shared_story(request_identifier, json_string):
 
             for item in story['Content']:
                 content_obj = {
-                    'pdk_hashed_item': hash_content(item),
-                    'pdk_encrypted_item': encrypt_content(item.encode('utf-8')),
-                    'pdk_length_item': len(item),
+                    'item': item,
                     'item_extension': item.split('.')[-1],
                 }
 
                 pdk_story['content'].append(content_obj)
 
-            DataPoint.objects.create_data_point('pdk-external-snapchat-shared-story', request_identifier, pdk_story, user_agent='Passive Data Kit External Importer', created=created)
+            included.append((pdk_story, created))
 
-            create_engagement_event(source='snapchat', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='share', start=created)
+    queue_included(request_identifier, 'pdk-external-snapchat-shared-story', included, outgoing_engagement=1.0, engagement_type='share')
+
+    spotlight = []
 
     for story in shared_story.get('Spotlight History', []):
         created = arrow.get(story['Story Date'], 'YYYY-MM-DD HH:mm:ss ZZZ').datetime
 
         if include_data(request_identifier, created, story):
             pdk_story = {
-                'pdk_hashed_story_url': hash_content(story['Story URL']),
-                'pdk_encrypted_story_url': encrypt_content(story['Story URL'].encode('utf-8')),
+                'story_url': story['Story URL'],
                 'create_time': story['Story Date'],
                 'view_duration': float(story['View Time'].replace(' seconds', '')),
             }
 
-            DataPoint.objects.create_data_point('pdk-external-snapchat-spoytlight-history', request_identifier, pdk_story, user_agent='Passive Data Kit External Importer', created=created)
+            spotlight.append((pdk_story, created))
 
-            create_engagement_event(source='snapchat', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='post', start=created, duration=pdk_story['view_duration'])
+    queue_included(request_identifier, 'pdk-external-snapchat-spoytlight-history', spotlight, duration_field='view_duration', outgoing_engagement=1.0, engagement_type='post')
 
 
 def process_snap_history(request_identifier, json_string):
     snap_history = json.loads(json_string)
 
+    received = []
+
     for snap in snap_history.get('Received Snap History', []):
         created = arrow.get(snap['Created'], 'YYYY-MM-DD HH:mm:ss ZZZ').datetime
 
         if include_data(request_identifier, created, snap):
             pdk_snap = {
-                'pdk_hashed_from': hash_content(snap['From']),
-                'pdk_encrypted_from': encrypt_content(snap['From'].encode('utf-8')),
-                'pdk_length_from': len(snap['From']),
+                'from': snap['From'],
                 'create_time': snap['Created'],
                 'media_type': snap['Media Type'],
             }
 
-            DataPoint.objects.create_data_point('pdk-external-snapchat-snap-received', request_identifier, pdk_snap, user_agent='Passive Data Kit External Importer', created=created)
+            received.append((pdk_snap, created))
+
+    queue_included(request_identifier, 'pdk-external-snapchat-snap-received', received, incoming_engagement=1.0, engagement_type='message')
 
-            create_engagement_event(source='snapchat', identifier=request_identifier, incoming_engagement=1.0, engagement_type='message', start=created)
+    sent = []
 
     for snap in snap_history.get('Sent Snap History', []):
         created = arrow.get(snap['Created'], 'YYYY-MM-DD HH:mm:ss ZZZ').datetime
 
         if include_data(request_identifier, created, snap):
             pdk_snap = {
-                'pdk_hashed_to': hash_content(snap['To']),
-                'pdk_encrypted_to': encrypt_content(snap['To'].encode('utf-8')),
-                'pdk_length_to': len(snap['To']),
+                'to': snap['To'],
                 'create_time': snap['Created'],
                 'media_type': snap['Media Type'],
             }
 
-            DataPoint.objects.create_data_point('pdk-external-snapchat-snap-sent', request_identifier, pdk_snap, user_agent='Passive Data Kit External Importer', created=created)
+            sent.append((pdk_snap, created))
 
-            create_engagement_event(source='snapchat', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='message', start=created)
+    queue_included(request_identifier, 'pdk-external-snapchat-snap-sent', sent, outgoing_engagement=1.0, engagement_type='message')
 
 
 def process_support_notes(request_identifier, json_string):
     support_notes = json.loads(json_string)
 
+    included = []
+
     for report_type in support_notes.keys():
         for note in support_notes[report_type]:
             created = arrow.get(note['Create Time'], 'YYYY-MM-DD HH:mm:ss ZZZ').datetime
 
             if include_data(request_identifier, created, note):
                 pdk_note = {
-                    'pdk_hashed_subject': hash_content(note['Subject']),
-                    'pdk_encrypted_subject': encrypt_content(note['Subject'].encode('utf-8')),
-                    'pdk_length_subject': len(note['Subject']),
-                    'pdk_hashed_message': hash_content(note['Message']),
-                    'pdk_encrypted_message': encrypt_content(note['Message'].encode('utf-8')),
-                    'pdk_length_message': len(note['Message']),
+                    'subject': note['Subject'],
+                    'message': note['Message'],
                     'create_time': note['Create Time'],
                     'note_type': report_type,
                 }
 
-                DataPoint.objects.create_data_point('pdk-external-snapchat-support-note', request_identifier, pdk_note, user_agent='Passive Data Kit External Importer', created=created)
+                included.append((pdk_note, created))
 
-                create_engagement_event(source='snapchat', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='support', start=created)
+    queue_included(request_identifier, 'pdk-external-snapchat-support-note', included, outgoing_engagement=1.0, engagement_type='support')
 
 
 def process_account_events(request_identifier, json_string):
     account_events = json.loads(json_string)
 
+    included = []
+
     for login in account_events.get('Login History', []):
         created = arrow.get(login['Created'], 'YYYY-MM-DD HH:mm:ss ZZZ').datetime
 
         if include_data(request_identifier, created, login):
             pdk_login = {
-                'pdk_hashed_ip_address': hash_content(login['IP']),
-                'pdk_encrypted_ip_address': encrypt_content(login['IP'].encode('utf-8')),
+                'ip_address': login['IP'],
                 'country': login['Country'],
                 'status': login['Status'],
                 'device': login['Device'],
                 'created': login['Created']
             }
 
-            DataPoint.objects.create_data_point('pdk-external-snapchat-login', request_identifier, pdk_login, user_agent='Passive Data Kit External Importer', created=created)
-
-            create_engagement_event(source='snapchat', identifier=request_identifier, outgoing_engagement=0.5, engagement_type='login', start=created)
-
-def process_story_history(request_identifier, json_string):
-    story_history = json.loads(json_string)
-
-    for view in story_history.get('Your Story Views', []):
-        if 'View' in view:
-            created = arrow.get(view['View Date'], 'YYYY-MM-DD HH:mm:ss ZZZ').datetime
-
-            if include_data(request_identifier, created, view):
-                view['pdk_hashed_viewer'] = hash_content(view['View'])
-
-                del view['View']
-
+            included.append((pdk_login, created))
 
-                DataPoint.objects.create_data_point('pdk-external-snapchat-story-view', request_identifier, view, user_agent='Passive Data Kit External Importer', created=created)
+    queue_included(request_identifier, 'pdk-external-snapchat-login', included, outgoing_engagement=0.5, engagement_type='login')
 
-                create_engagement_event(source='snapchat', identifier=request_identifier, incoming_engagement=0.0, engagement_type='story-view', start=created)
+def included_views(request_identifier, views):
+    included = []
 
-    for view in story_history.get('Friend and Public Story Views', []):
+    for view in views:
         if 'View' in view:
             created = arrow.get(view['View Date'], 'YYYY-MM-DD HH:mm:ss ZZZ').datetime
 
             if include_data(request_identifier, created, view):
-                view['pdk_hashed_viewer'] = hash_content(view['View'])
-
-                del view['View']
-
-                DataPoint.objects.create_data_point('pdk-external-snapchat-story-view', request_identifier, view, user_agent='Passive Data Kit External Importer', created=created)
-
-                create_engagement_event(source='snapchat', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='story-view', start=created)
-
-def process_friends_events(request_identifier, json_string): # pylint: disable=too-many-branches
-    friends_history = json.loads(json_string)
-
-    for action in friends_history.get('Deleted Friends', []):
-        if 'Creation Timestamp' in action:
-            created = arrow.get(action['Creation Timestamp'], 'YYYY-MM-DD HH:mm:ss ZZZ').datetime
-
-            if include_data(request_identifier, created, action):
-                action['pdk_encrypted_username'] = encrypt_content(action['Username'].encode('utf-8'))
-                del action['Username']
+                included.append((view, created))
 
-                action['pdk_encrypted_display_name'] = encrypt_content(action['Display Name'].encode('utf-8'))
-                del action['Display Name']
+    return included
 
-                DataPoint.objects.create_data_point('pdk-external-snapchat-deleted-contact', request_identifier, action, user_agent='Passive Data Kit External Importer', created=created)
-
-                create_engagement_event(source='snapchat', identifier=request_identifier, outgoing_engagement=0.5, engagement_type='deleted-contact', start=created)
-
-    for action in friends_history.get('Friend Requests Sent', []):
-        if 'Creation Timestamp' in action:
-            created = arrow.get(action['Creation Timestamp'], 'YYYY-MM-DD HH:mm:ss ZZZ').datetime
-
-            if include_data(request_identifier, created, action):
-                action['pdk_encrypted_username'] = encrypt_content(action['Username'].encode('utf-8'))
-                del action['Username']
+def process_story_history(request_identifier, json_string):
+    story_history = json.loads(json_string)
 
-                action['pdk_encrypted_display_name'] = encrypt_content(action['Display Name'].encode('utf-8'))
-                del action['Display Name']
+    queue_included(request_identifier, 'pdk-external-snapchat-story-view', included_views(request_identifier, story_history.get('Your Story Views', [])), incoming_engagement=0.0, engagement_type='story-view')
 
-                DataPoint.objects.create_data_point('pdk-external-snapchat-requested-contact', request_identifier, action, user_agent='Passive Data Kit External Importer', created=created)
+    queue_included(request_identifier, 'pdk-external-snapchat-story-view', included_views(request_identifier, story_history.get('Friend and Public Story Views', [])), outgoing_engagement=0.0, engagement_type='story-view')
 
-                create_engagement_event(source='snapchat', identifier=request_identifier, outgoing_engagement=0.5, engagement_type='deleted-contact', start=created)
+def included_actions(request_identifier, actions, date_field):
+    included = []
 
-    for action in friends_history.get('Blocked Users', []):
-        if 'Creation Timestamp' in action:
-            created = arrow.get(action['Creation Timestamp'], 'YYYY-MM-DD HH:mm:ss ZZZ').datetime
+    for action in actions:
+        if date_field in action:
+            created = arrow.get(action[date_field], 'YYYY-MM-DD HH:mm:ss ZZZ').datetime
 
             if include_data(request_identifier, created, action):
-                action['pdk_encrypted_username'] = encrypt_content(action['Username'].encode('utf-8'))
-                del action['Username']
-
-                action['pdk_encrypted_display_name'] = encrypt_content(action['Display Name'].encode('utf-8'))
-                del action['Display Name']
-
-                DataPoint.objects.create_data_point('pdk-external-snapchat-blocked-contact', request_identifier, action, user_agent='Passive Data Kit External Importer', created=created)
+                included.append((action, created))
 
-                create_engagement_event(source='snapchat', identifier=request_identifier, outgoing_engagement=0.5, engagement_type='blocked-contact', start=created)
+    return included
 
-    for action in friends_history.get('Friends', []):
-        if 'Creation Timestamp' in action:
-            created = arrow.get(action['Creation Timestamp'], 'YYYY-MM-DD HH:mm:ss ZZZ').datetime
+def process_friends_events(request_identifier, json_string):
+    friends_history = json.loads(json_string)
 
-            if include_data(request_identifier, created, action):
-                action['pdk_encrypted_username'] = encrypt_content(action['Username'].encode('utf-8'))
-                del action['Username']
+    queue_included(request_identifier, 'pdk-external-snapchat-deleted-contact', included_actions(request_identifier, friends_history.get('Deleted Friends', []), 'Creation Timestamp'), outgoing_engagement=0.5, engagement_type='deleted-contact')
 
-                action['pdk_encrypted_display_name'] = encrypt_content(action['Display Name'].encode('utf-8'))
-                del action['Display Name']
+    queue_included(request_identifier, 'pdk-external-snapchat-requested-contact', included_actions(request_identifier, friends_history.get('Friend Requests Sent', []), 'Creation Timestamp'), outgoing_engagement=0.5, engagement_type='deleted-contact')
 
-                DataPoint.objects.create_data_point('pdk-external-snapchat-added-contact', request_identifier, action, user_agent='Passive Data Kit External Importer', created=created)
+    queue_included(request_identifier, 'pdk-external-snapchat-blocked-contact', included_actions(request_identifier, friends_history.get('Blocked Users', []), 'Creation Timestamp'), outgoing_engagement=0.5, engagement_type='blocked-contact')
 
-                create_engagement_event(source='snapchat', identifier=request_identifier, outgoing_engagement=0.5, engagement_type='added-contact', start=created)
+    queue_included(request_identifier, 'pdk-external-snapchat-added-contact', included_actions(request_identifier, friends_history.get('Friends', []), 'Creation Timestamp'), outgoing_engagement=0.5, engagement_type='added-contact')
 
 def process_scan_events(request_identifier, json_string):
     scan_history = json.loads(json_string)
 
-    for action in scan_history.get('Scan History', []):
-        created = arrow.get(action['Date'], 'YYYY-MM-DD HH:mm:ss ZZZ').datetime
+    included = included_actions(request_identifier, scan_history.get('Scan History', []), 'Date')
 
-        if include_data(request_identifier, created, action):
-            action['pdk_encrypted_scan_image'] = encrypt_content(json.dumps(action['Scan Image']).encode('utf-8'))
-            del action['Scan Image']
+    for action, created in included: # pylint: disable=unused-variable
+        action['Scan Image'] = json.dumps(action['Scan Image'])
 
-            action['pdk_encrypted_location'] = encrypt_content(action['Location'].encode('utf-8'))
-            del action['Location']
-
-            DataPoint.objects.create_data_point('pdk-external-snapchat-scan', request_identifier, action, user_agent='Passive Data Kit External Importer', created=created)
-
-            create_engagement_event(source='snapchat', identifier=request_identifier, outgoing_engagement=0.5, engagement_type='scanned-code', start=created)
+    queue_included(request_identifier, 'pdk-external-snapchat-scan', included, outgoing_engagement=0.5, engagement_type='scanned-code')
 
 def process_snap_map_events(request_identifier, json_string):
     map_history = json.loads(json_string)
 
-    for action in map_history.get('Snap Map Places History', []):
-        created = arrow.get(action['Date'], 'YYYY-MM-DD HH:mm:ss ZZZ').datetime
-
-        if include_data(request_identifier, created, action):
-            action['pdk_encrypted_place_location'] = encrypt_content(action['Place Location'].encode('utf-8'))
-            del action['Place Location']
-
-            action['pdk_encrypted_place'] = encrypt_content(action['Place'].encode('utf-8'))
-            del action['Place']
-
-            DataPoint.objects.create_data_point('pdk-external-snapchat-place-share', request_identifier, action, user_agent='Passive Data Kit External Importer', created=created)
+    queue_included(request_identifier, 'pdk-external-snapchat-place-share', included_actions(request_identifier, map_history.get('Snap Map Places History', []), 'Date'), outgoing_engagement=1.0, engagement_type='shared-place')
 
-            create_engagement_event(source='snapchat', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='shared-place', start=created)
-
-def process_talk_events(request_identifier, json_string): # pylint: disable=too-many-branches
+def process_talk_events(request_identifier, json_string):
     talk_history = json.loads(json_string)
 
-    for action in talk_history.get('Incoming Calls', []):
-        created = arrow.get(action['Date & Time'], 'YYYY-MM-DD HH:mm:ss ZZZ').datetime
-
-        if include_data(request_identifier, created, action):
-            action['pdk_encrypted_city'] = encrypt_content(action['City'].encode('utf-8'))
-            del action['City']
-
-            DataPoint.objects.create_data_point('pdk-external-snapchat-call', request_identifier, action, user_agent='Passive Data Kit External Importer', created=created)
-
-            create_engagement_event(source='snapchat', identifier=request_identifier, incoming_engagement=1.0, engagement_type='call', start=created, duration=action['Length (sec)'])
-
-    for action in talk_history.get('Outgoing Calls', []):
-        created = arrow.get(action['Date & Time'], 'YYYY-MM-DD HH:mm:ss ZZZ').datetime
+    queue_included(request_identifier, 'pdk-external-snapchat-call', included_actions(request_identifier, talk_history.get('Incoming Calls', []), 'Date & Time'), duration_field='Length (sec)', incoming_engagement=1.0, engagement_type='call')
 
-        if include_data(request_identifier, created, action):
-            action['pdk_encrypted_city'] = encrypt_content(action['City'].encode('utf-8'))
-            del action['City']
+    queue_included(request_identifier, 'pdk-external-snapchat-call', included_actions(request_identifier, talk_history.get('Outgoing Calls', []), 'Date & Time'), duration_field='Length (sec)', outgoing_engagement=1.0, engagement_type='call')
 
-            DataPoint.objects.create_data_point('pdk-external-snapchat-call', request_identifier, action, user_agent='Passive Data Kit External Importer', created=created)
+    queue_included(request_identifier, 'pdk-external-snapchat-call', included_actions(request_identifier, talk_history.get('Completed Calls', []), 'Date & Time'), duration_field='Length (sec)', outgoing_engagement=1.0, engagement_type='call')
 
-            create_engagement_event(source='snapchat', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='call', start=created, duration=action['Length (sec)'])
-
-    for action in talk_history.get('Completed Calls', []):
-        created = arrow.get(action['Date & Time'], 'YYYY-MM-DD HH:mm:ss ZZZ').datetime
-
-        if include_data(request_identifier, created, action):
-            action['pdk_encrypted_city'] = encrypt_content(action['City'].encode('utf-8'))
-            del action['City']
-
-            DataPoint.objects.create_data_point('pdk-external-snapchat-call', request_identifier, action, user_agent='Passive Data Kit External Importer', created=created)
-
-            create_engagement_event(source='snapchat', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='call', start=created, duration=action['Length (sec)'])
-
-    for action in talk_history.get('Game Sessions', []):
-        created = arrow.get(action['Date & Time'], 'YYYY-MM-DD HH:mm:ss ZZZ').datetime
-
-        if include_data(request_identifier, created, action):
-            action['pdk_encrypted_city'] = encrypt_content(action['City'].encode('utf-8'))
-            del action['City']
-
-            DataPoint.objects.create_data_point('pdk-external-snapchat-call', request_identifier, action, user_agent='Passive Data Kit External Importer', created=created)
-
-            create_engagement_event(source='snapchat', identifier=request_identifier, incoming_engagement=1.0, outgoing_engagement=1.0, engagement_type='call', start=created, duration=action['Length (sec)'])
+    queue_included(request_identifier, 'pdk-external-snapchat-call', included_actions(request_identifier, talk_history.get('Game Sessions', []), 'Date & Time'), duration_field='Length (sec)', incoming_engagement=1.0, outgoing_engagement=1.0, engagement_type='call')
 
     if 'Chat Sessions' in talk_history:
         print('CHAT SESSIONS: ' + json.dumps(talk_history['Chat Sessions'], indent=2))
@@ -378,83 +342,74 @@ def process_talk_events(request_identifier, json_string): # pylint: disable=too-
 def process_search_history(request_identifier, json_string):
     searches = json.loads(json_string)
 
+    included = []
+
     for search in searches:
         created = arrow.get(search['Date and time (hourly)'], 'YYYY-MM-DD HH:mm:ss ZZZ').datetime
 
         if include_data(request_identifier, created, search):
-            search['pdk_encrypted_query'] = encrypt_content(search['Search Term'].encode('utf-8'))
-            del search['Search Term']
-
-            search['pdk_encrypted_location'] = encrypt_content(search['Location'].encode('utf-8'))
-            del search['Location']
-
-            DataPoint.objects.create_data_point('pdk-external-snapchat-search', request_identifier, search, user_agent='Passive Data Kit External Importer', created=created)
-
-            create_engagement_event(source='snapchat', identifier=request_identifier, outgoing_engagement=0.5, engagement_type='search', start=created)
-
-def import_data(request_identifier, path): # pylint: disable=too-many-branches
-    with zipfile.ZipFile(path) as content_bundle:
-        skip_files = [
-            'json/account_history.json',
-            'json/bitmoji.json ',
-            'json/bitmoji_kit_user.json',
-            'json/community_lenses.json',
-            'json/connected_apps.json',
-            'json/email_campaign_history.json',
-            'json/in_app_reports.json',
-            'json/location_history.json',
-            'json/ranking.json',
-            'json/snap_pro.json',
-            'json/subscriptions.json',
-            'json/terms_history.json',
-            'json/user_profile.json',
-            'json/bitmoji.json',
-            'json/cameos_metadata.json',
-            'json/in_app_surveys.json',
-        ]
-
-        for content_file in content_bundle.namelist():
-            try:
-                with content_bundle.open(content_file) as opened_file:
-                    if content_file.endswith('/'):
-                        pass
-                    elif content_file.endswith('.html'):
-                        pass
-                    elif '__MACOSX' in content_file:
-                        pass
-                    elif content_file in skip_files:
-                        pass
-                    elif content_file == 'talk_history.json' or re.match(r'.*\/talk_history\.json$', content_file):
-                        process_talk_events(request_identifier, opened_file.read())
-                    elif content_file == 'snap_map_places_history.json' or re.match(r'.*\/snap_map_places_history\.json$', content_file):
-                        process_snap_map_events(request_identifier, opened_file.read())
-                    elif content_file == 'scans.json' or re.match(r'.*\/scans\.json$', content_file):
-                        process_scan_events(request_identifier, opened_file.read())
-                    elif content_file == 'friends.json' or re.match(r'.*\/friends\.json$', content_file):
-                        process_friends_events(request_identifier, opened_file.read())
-                    elif content_file == 'account.json' or re.match(r'.*\/account\.json$', content_file):
-                        process_account_events(request_identifier, opened_file.read())
-                    elif content_file == 'chat_history.json' or re.match(r'.*\/chat_history\.json$', content_file):
-                        process_chat_history(request_identifier, opened_file.read())
-                    elif content_file == 'memories_history.json' or re.match(r'.*\/memories_history\.json$', content_file):
-                        process_memories_history(request_identifier, opened_file.read())
-                    elif content_file == 'shared_story.json' or re.match(r'.*\/shared_story\.json$', content_file):
-                        process_shared_story(request_identifier, opened_file.read())
-                    elif content_file == 'snap_history.json' or re.match(r'.*\/snap_history\.json$', content_file):
-                        process_snap_history(request_identifier, opened_file.read())
-                    elif content_file == 'support_note.json' or re.match(r'.*\/support_note\.json$', content_file):
-                        process_support_notes(request_identifier, opened_file.read())
-                    elif content_file == 'search_history.json' or re.match(r'.*\/search_history\.json$', content_file):
-                        process_search_history(request_identifier, opened_file.read())
-                    elif content_file == 'story_history.json' or re.match(r'.*\/story_history\.json$', content_file):
-                        process_story_history(request_identifier, opened_file.read())
-                    else:
-                        print('SNAPCHAT[' + request_identifier + ']: Unable to process: ' + content_file + ' -- ' + str(content_bundle.getinfo(content_file).file_size))
-            except: # pylint: disable=bare-except
-                traceback.print_exc()
-                return False
-
-    return True
+            included.append((search, created))
+
+    queue_included(request_identifier, 'pdk-external-snapchat-search', included, outgoing_engagement=0.5, engagement_type='search')
+
+SKIP_FILES = [
+    'json/account_history.json',
+    'json/bitmoji.json ',
+    'json/bitmoji_kit_user.json',
+    'json/community_lenses.json',
+    'json/connected_apps.json',
+    'json/email_campaign_history.json',
+    'json/in_app_reports.json',
+    'json/location_history.json',
+    'json/ranking.json',
+    'json/snap_pro.json',
+    'json/subscriptions.json',
+    'json/terms_history.json',
+    'json/user_profile.json',
+    'json/bitmoji.json',
+    'json/cameos_metadata.json',
+    'json/in_app_surveys.json',
+]
+
+def import_member(request_identifier, content_bundle, content_file, context): # pylint: disable=too-many-branches, unused-argument
+    with content_bundle.open(content_file) as opened_file:
+        if content_file.endswith('/'):
+            pass
+        elif content_file.endswith('.html'):
+            pass
+        elif '__MACOSX' in content_file:
+            pass
+        elif content_file in SKIP_FILES:
+            pass
+        elif content_file == 'talk_history.json' or re.match(r'.*\/talk_history\.json$', content_file):
+            process_talk_events(request_identifier, opened_file.read())
+        elif content_file == 'snap_map_places_history.json' or re.match(r'.*\/snap_map_places_history\.json$', content_file):
+            process_snap_map_events(request_identifier, opened_file.read())
+        elif content_file == 'scans.json' or re.match(r'.*\/scans\.json$', content_file):
+            process_scan_events(request_identifier, opened_file.read())
+        elif content_file == 'friends.json' or re.match(r'.*\/friends\.json$', content_file):
+            process_friends_events(request_identifier, opened_file.read())
+        elif content_file == 'account.json' or re.match(r'.*\/account\.json$', content_file):
+            process_account_events(request_identifier, opened_file.read())
+        elif content_file == 'chat_history.json' or re.match(r'.*\/chat_history\.json$', content_file):
+            process_chat_history(request_identifier, opened_file.read())
+        elif content_file == 'memories_history.json' or re.match(r'.*\/memories_history\.json$', content_file):
+            process_memories_history(request_identifier, opened_file.read())
+        elif content_file == 'shared_story.json' or re.match(r'.*\/shared_story\.json$', content_file):
+            process_shared_story(request_identifier, opened_file.read())
+        elif content_file == 'snap_history.json' or re.match(r'.*\/snap_history\.json$', content_file):
+            process_snap_history(request_identifier, opened_file.read())
+        elif content_file == 'support_note.json' or re.match(r'.*\/support_note\.json$', content_file):
+            process_support_notes(request_identifier, opened_file.read())
+        elif content_file == 'search_history.json' or re.match(r'.*\/search_history\.json$', content_file):
+            process_search_history(request_identifier, opened_file.read())
+        elif content_file == 'story_history.json' or re.match(r'.*\/story_history\.json$', content_file):
+            process_story_history(request_identifier, opened_file.read())
+        else:
+            print('SNAPCHAT[' + request_identifier + ']: Unable to process: ' + content_file + ' -- ' + str(content_bundle.getinfo(content_file).file_size))
+
+def import_data(request_identifier, path, data_file=None, batch_writer=None):
+    return import_bundle(request_identifier, path, import_member, data_file=data_file, batch_writer=batch_writer)
 
 def external_data_metadata(generator_identifier, point):
     if generator_identifier.startswith('pdk-external-snapchat') is False:
@@ -4,63 +4,78 @@ from __future__ import print_function
 
 import json
 import re
-import traceback
-import zipfile
 
 import arrow
 
 from passive_data_kit.models import DataPoint
-from passive_data_kit_external_data.models import annotate_field
 
-from ..utils import hash_content, encrypt_content, create_engagement_event, include_data
+from ..field_policies import FieldPolicy, apply_field_policies, register_field_policies
+from ..utils import create_engagement_event, queue_batch_insert, include_data, import_bundle
+
+register_field_policies('pdk-external-tumblr-unfollow',
+                        FieldPolicy(('blog_name',), encrypt_as='pdk_encrypted_blog_name', hash_as='pdk_hashed_blog_name', annotate=True, drop=True))
+
+# Ads served, Gemini, client-side and explore takeover analytics share a generator, but
+# not every one of them carries both fields.
+
+register_field_policies('pdk-external-tumblr-ads-served',
+                        FieldPolicy(('post_url',), encrypt_as='pdk_encrypted_post_url', hash_as='pdk_hashed_post_url', drop=True),
+                        FieldPolicy(('placement_id',), encrypt_as='pdk_encrypted_placement_id', hash_as='pdk_hashed_placement_id', drop=True))
+
+register_field_policies('pdk-external-tumblr-push-notification-open',
+                        FieldPolicy(('from_blog',), encrypt_as='pdk_encrypted_from_blog', hash_as='pdk_hashed_from_blog', drop=True),
+                        FieldPolicy(('to_blog',), encrypt_as='pdk_encrypted_to_blog', hash_as='pdk_hashed_to_blog', drop=True))
 
 def process_dashboard(request_identifier, dashboard):
     for item in dashboard:
         created = arrow.get(item['serve_time']).datetime
 
         if include_data(request_identifier, created, item):
-            DataPoint.objects.create_data_point('pdk-external-tumblr-dashboard-item', request_identifier, item, user_agent='Passive Data Kit External Importer', created=created)
+            queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-tumblr-dashboard-item', request_identifier, item, user_agent='Passive Data Kit External Importer', created=created, skip_save=True))
 
 def process_unfollows(request_identifier, unfollows):
+    included = []
+
     for item in unfollows:
         created = arrow.get(item['timestamp']).datetime
 
         if include_data(request_identifier, created, item):
             pdk_item = {
-                'pdk_hashed_blog_name': hash_content(item['blog_name']),
-                'pdk_encrypted_blog_name': encrypt_content(item['blog_name'].encode('utf-8')),
+                'blog_name': item['blog_name'],
                 'timestamp': item['timestamp'],
             }
 
-            annotate_field(pdk_item, 'blog_name', item['blog_name'])
+            included.append((pdk_item, created))
+
+    apply_field_policies('pdk-external-tumblr-unfollow', [pdk_item for pdk_item, created in included])
+
+    for pdk_item, created in included:
+        queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-tumblr-unfollow', request_identifier, pdk_item, user_agent='Passive Data Kit External Importer', created=created, skip_save=True))
 
+        create_engagement_event(source='tumblr', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='follow', start=created)
 
-            DataPoint.objects.create_data_point('pdk-external-tumblr-unfollow', request_identifier, pdk_item, user_agent='Passive Data Kit External Importer', created=created)
+def queue_ads_served(request_identifier, included):
+    apply_field_policies('pdk-external-tumblr-ads-served', [pdk_item for pdk_item, created in included])
 
-            create_engagement_event(source='tumblr', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='follow', start=created)
+    for pdk_item, created in included:
+        queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-tumblr-ads-served', request_identifier, pdk_item, user_agent='Passive Data Kit External Importer', created=created, skip_save=True))
+
+        create_engagement_event(source='tumblr', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='advertising', start=created)
 
 def process_ads_served(request_identifier, ads_served):
+    included = []
+
     for item in ads_served:
         try:
             created = arrow.get(item['serve_time']).datetime
 
             if include_data(request_identifier, created, item):
-                pdk_item = {
-                    'pdk_hashed_post_url': hash_content(item['post_url']),
-                    'pdk_encrypted_post_url': encrypt_content(item['post_url'].encode('utf-8')),
-                    'pdk_hashed_placement_id': hash_content(item['placement_id']),
-                    'pdk_encrypted_placement_id': encrypt_content(item['placement_id'].encode('utf-8')),
-                    'serve_time': item['serve_time'],
-                    'viewed': item['viewed'],
-                    'interacted': item['interacted'],
-                }
-
-                DataPoint.objects.create_data_point('pdk-external-tumblr-ads-served', request_identifier, pdk_item, user_agent='Passive Data Kit External Importer', created=created)
-
-                create_engagement_event(source='tumblr', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='advertising', start=created)
+                included.append(({key: item[key] for key in ('post_url', 'placement_id', 'serve_time', 'viewed', 'interacted')}, created))
         except arrow.parser.ParserError:
             print('[' + request_identifier + ']: Skipped ad_served: Unable to parse date: "' + str(item['serve_time']) + '".')
 
+    queue_ads_served(request_identifier, included)
+
 def process_active_times(request_identifier, active_times):
     for item in active_times:
         pdk_item = {
@@ -70,7 +85,7 @@ def process_active_times(request_identifier, active_times):
         created = arrow.get(item).datetime
 
         if include_data(request_identifier, created, item):
-            DataPoint.objects.create_data_point('pdk-external-tumblr-active-time', request_identifier, pdk_item, user_agent='Passive Data Kit External Importer', created=created)
+            queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-tumblr-active-time', request_identifier, pdk_item, user_agent='Passive Data Kit External Importer', created=created, skip_save=True))
 
             create_engagement_event(source='tumblr', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='active-time', start=created)
 
@@ -79,104 +94,79 @@ def process_api_applications_used(request_identifier, api_applications_used):
         created = arrow.get(item['session_created_time']).datetime
 
         if include_data(request_identifier, created, item):
-            DataPoint.objects.create_data_point('pdk-external-tumblr-api-session', request_identifier, item, user_agent='Passive Data Kit External Importer', created=created)
+            queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-tumblr-api-session', request_identifier, item, user_agent='Passive Data Kit External Importer', created=created, skip_save=True))
 
             create_engagement_event(source='tumblr', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='api-session', start=created)
 
 def process_push_notifications(request_identifier, notifications):
+    included = []
+
     for item in notifications:
         created = arrow.get(item['timestamp']).datetime
 
         if include_data(request_identifier, created, item):
-            pdk_item = {
-                'pdk_hashed_from_blog': hash_content(item['from_blog']),
-                'pdk_encrypted_from_blog': encrypt_content(item['from_blog'].encode('utf-8')),
-                'pdk_hashed_to_blog': hash_content(item['to_blog']),
-                'pdk_encrypted_to_blog': encrypt_content(item['to_blog'].encode('utf-8')),
-                'timestamp': item['timestamp'],
-                'notification_type': item['notification_type'],
-                'device': item['device'],
-                'follow_up_action': item['follow_up_action'],
-                'app_version': item['app_version'],
-            }
+            pdk_item = {key: item[key] for key in ('from_blog', 'to_blog', 'timestamp', 'notification_type', 'device', 'follow_up_action', 'app_version')}
 
-            DataPoint.objects.create_data_point('pdk-external-tumblr-push-notification-open', request_identifier, pdk_item, user_agent='Passive Data Kit External Importer', created=created)
+            included.append((pdk_item, created))
 
-            create_engagement_event(source='tumblr', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='notification-open', start=created)
+    apply_field_policies('pdk-external-tumblr-push-notification-open', [pdk_item for pdk_item, created in included])
+
+    for pdk_item, created in included:
+        queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-tumblr-push-notification-open', request_identifier, pdk_item, user_agent='Passive Data Kit External Importer', created=created, skip_save=True))
+
+        create_engagement_event(source='tumblr', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='notification-open', start=created)
 
 def process_push_notification_settings(request_identifier, settings): # pylint: disable=invalid-name
     for item in settings:
         created = arrow.get(item['timestamp']).datetime
 
         if include_data(request_identifier, created, item):
-            DataPoint.objects.create_data_point('pdk-external-tumblr-push-notification-setting', request_identifier, item, user_agent='Passive Data Kit External Importer', created=created)
+            queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-tumblr-push-notification-setting', request_identifier, item, user_agent='Passive Data Kit External Importer', created=created, skip_save=True))
 
             create_engagement_event(source='tumblr', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='notification-setting', start=created)
 
 def process_gemini_analytics(request_identifier, ads_served):
+    included = []
+
     for item in ads_served:
         try:
             created = arrow.get(item['serve_time']).datetime
 
             if include_data(request_identifier, created, item):
-                pdk_item = {
-                    'pdk_hashed_placement_id': hash_content(item['placement_id']),
-                    'pdk_encrypted_placement_id': encrypt_content(item['placement_id'].encode('utf-8')),
-                    'serve_time': item['serve_time'],
-                    'viewed': item['viewed'],
-                    'interacted': item['interacted'],
-                }
-
-                DataPoint.objects.create_data_point('pdk-external-tumblr-ads-served', request_identifier, pdk_item, user_agent='Passive Data Kit External Importer', created=created)
-
-                create_engagement_event(source='tumblr', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='advertising', start=created)
-
+                included.append(({key: item[key] for key in ('placement_id', 'serve_time', 'viewed', 'interacted')}, created))
         except arrow.parser.ParserError:
             print('[' + request_identifier + ']: Skipped ad_served: Unable to parse date: "' + str(item['serve_time']) + '".')
 
+    queue_ads_served(request_identifier, included)
+
 def process_client_side_ad_analytics(request_identifier, ads_served): # pylint: disable=invalid-name
+    included = []
+
     for item in ads_served:
         try:
             created = arrow.get(item['serve_time']).datetime
 
             if include_data(request_identifier, created, item):
-                pdk_item = {
-                    'pdk_hashed_placement_id': hash_content(item['placement_id']),
-                    'pdk_encrypted_placement_id': encrypt_content(item['placement_id'].encode('utf-8')),
-                    'ad_type': item['ad_type'],
-                    'serve_time': item['serve_time'],
-                    'viewed': item['viewed'],
-                    'interacted': item['interacted'],
-                }
-
-                DataPoint.objects.create_data_point('pdk-external-tumblr-ads-served', request_identifier, pdk_item, user_agent='Passive Data Kit External Importer', created=created)
-
-                create_engagement_event(source='tumblr', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='advertising', start=created)
+                included.append(({key: item[key] for key in ('placement_id', 'ad_type', 'serve_time', 'viewed', 'interacted')}, created))
         except arrow.parser.ParserError:
             print('[' + request_identifier + ']: Skipped ad_served: Unable to parse date: "' + str(item['serve_time']) + '".')
 
+    queue_ads_served(request_identifier, included)
+
 def process_explore_takeover_analytics(request_identifier, ads_served): # pylint: disable=invalid-name
+    included = []
+
     for item in ads_served:
         try:
             created = arrow.get(item['serve_time']).datetime
 
             if include_data(request_identifier, created, item):
-                pdk_item = {
-                    'pdk_hashed_post_url': hash_content(item['post_url']),
-                    'pdk_encrypted_post_url': encrypt_content(item['post_url'].encode('utf-8')),
-                    'tracked_unit': item['tracked_unit'],
-                    'serve_time': item['serve_time'],
-                    'viewed': item['viewed'],
-                    'interacted': item['interacted'],
-                }
-
-                DataPoint.objects.create_data_point('pdk-external-tumblr-ads-served', request_identifier, pdk_item, user_agent='Passive Data Kit External Importer', created=created)
-
-                create_engagement_event(source='tumblr', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='advertising', start=created)
-
+                included.append(({key: item[key] for key in ('post_url', 'tracked_unit', 'serve_time', 'viewed', 'interacted')}, created))
         except arrow.parser.ParserError:
             print('[' + request_identifier + ']: Skipped ad_served: Unable to parse date: "' + str(item['serve_time']) + '".')
 
+    queue_ads_served(request_identifier, included)
+
 def process_payload(request_identifier, payload_json):
     payloads = json.loads(payload_json)
 
@@ -213,22 +203,17 @@ def process_payload(request_identifier, payload_json):
         if 'explore_takeover_analytics' in data:
             process_explore_takeover_analytics(request_identifier, data['explore_takeover_analytics'])
 
-def import_data(request_identifier, path):
-    with zipfile.ZipFile(path) as content_bundle:
-        for content_file in content_bundle.namelist():
-            with content_bundle.open(content_file) as opened_file:
-                try:
-                    if content_file.endswith('/'):
-                        pass
-                    elif re.match(r'^payload.*\.json', content_file):
-                        process_payload(request_identifier, opened_file.read())
-                    else:
-                        print('TUMBLR[' + request_identifier + ']: Unable to process: ' + content_file + ' -- ' + str(content_bundle.getinfo(content_file).file_size))
-                except: # pylint: disable=bare-except
-                    traceback.print_exc()
-                    return False
-
-    return True
+def import_member(request_identifier, content_bundle, content_file, context): # pylint: disable=unused-argument
+    with content_bundle.open(content_file) as opened_file:
+        if content_file.endswith('/'):
+            pass
+        elif re.match(r'^payload.*\.json', content_file):
+            process_payload(request_identifier, opened_file.read())
+        else:
+            print('TUMBLR[' + request_identifier + ']: Unable to process: ' + content_file + ' -- ' + str(content_bundle.getinfo(content_file).file_size))
+
+def import_data(request_identifier, path, data_file=None, batch_writer=None):
+    return import_bundle(request_identifier, path, import_member, data_file=data_file, batch_writer=batch_writer)
 
 def external_data_metadata(generator_identifier, point): # pylint: disable=unused-argument
     if generator_identifier.startswith('pdk-external-tumblr') is False:
@@ -4,37 +4,72 @@ from __future__ import print_function
 
 import json
 import re
-import traceback
-import zipfile
 
 import arrow
 
 from django.utils import timezone
 
 from passive_data_kit.models import DataPoint
-from passive_data_kit_external_data.models import annotate_field
 
-from ..utils import hash_content, encrypt_content, create_engagement_event, include_data
+from ..field_policies import FieldPolicy, apply_field_policies, register_field_policies
+from ..utils import create_engagement_event, queue_batch_insert, include_data, import_bundle
+
+register_field_policies('pdk-external-twitter-like',
+                        FieldPolicy(('tweetId',), hash_as='pdk_hashed_tweetId', encrypt_as='pdk_encrypted_tweetId', drop=True),
+                        FieldPolicy(('fullText',), encrypt_as='pdk_encrypted_fullText', annotate=True, drop=True))
+
+register_field_policies('pdk-external-twitter-tweet',
+                        FieldPolicy(('id',), hash_as='pdk_hashed_id', encrypt_as='pdk_encrypted_id', drop=True),
+                        FieldPolicy(('id_str',), hash_as='pdk_hashed_id_str', encrypt_as='pdk_encrypted_id_str', drop=True),
+                        FieldPolicy(('full_text',), encrypt_as='pdk_encrypted_full_text', annotate=True, drop=True),
+                        FieldPolicy(('entities',), encrypt_as='pdk_encrypted_entities', drop=True, serialize=True),
+                        FieldPolicy(('urls',), encrypt_as='pdk_encrypted_urls', drop=True, serialize=True))
+
+register_field_policies('pdk-external-twitter-direct-message',
+                        FieldPolicy(('recipientId',), hash_as='pdk_hashed_recipientId', encrypt_as='pdk_encrypted_recipientId', drop=True),
+                        FieldPolicy(('senderId',), hash_as='pdk_hashed_senderId', encrypt_as='pdk_encrypted_senderId', drop=True),
+                        FieldPolicy(('text',), encrypt_as='pdk_encrypted_text', annotate=True, drop=True),
+                        FieldPolicy(('mediaUrls',), encrypt_as='pdk_encrypted_mediaUrls', drop=True, serialize=True))
+
+register_field_policies('pdk-external-twitter-direct-message-reaction',
+                        FieldPolicy(('senderId',), hash_as='pdk_hashed_senderId', encrypt_as='pdk_encrypted_senderId', drop=True))
+
+register_field_policies('pdk-external-twitter-ad-viewed',
+                        FieldPolicy(('promotedTweetInfo', 'tweetText'), annotate='tweet_text', on_record=True))
+
+def queue_included(request_identifier, included):
+    '''
+    Applies the field policies of each generator to the included (generator identifier,
+    record, created, engagement) tuples, then queues each record in order with its
+    engagement event (create_engagement_event arguments).
+    '''
+
+    for generator_identifier in sorted(set(item[0] for item in included)):
+        apply_field_policies(generator_identifier, [record for record_generator, record, created, engagement in included if record_generator == generator_identifier])
+
+    for generator_identifier, record, created, engagement in included:
+        queue_batch_insert(DataPoint.objects.create_data_point(generator_identifier, request_identifier, record, user_agent='Passive Data Kit External Importer', created=created, skip_save=True))
+
+        create_engagement_event(source='twitter', identifier=request_identifier, start=created, **engagement)
 
 def process_likes(request_identifier, likes_raw):
     likes_raw = likes_raw.replace('window.YTD.like.part0 = ', '')
 
     likes = json.loads(likes_raw)
 
+    included = []
+
     for like in likes:
         pdk_like = {
-            'pdk_hashed_tweetId': hash_content(like['like']['tweetId']),
-            'pdk_encrypted_tweetId': encrypt_content(like['like']['tweetId'].encode('utf-8')),
-            'pdk_encrypted_fullText': encrypt_content(like['like']['fullText'].encode('utf-8')),
+            'tweetId': like['like']['tweetId'],
+            'fullText': like['like']['fullText'],
         }
 
-        annotate_field(pdk_like, 'fullText', like['like']['fullText'])
-
         created = timezone.now() # No timestamp available in this file!
 
-        DataPoint.objects.create_data_point('pdk-external-twitter-like', request_identifier, pdk_like, user_agent='Passive Data Kit External Importer', created=created)
+        included.append(('pdk-external-twitter-like', pdk_like, created, {'outgoing_engagement': 0.5, 'engagement_type': 'reaction'}))
 
-        create_engagement_event(source='twitter', identifier=request_identifier, outgoing_engagement=0.5, engagement_type='reaction', start=created)
+    queue_included(request_identifier, included)
 
 
 def process_tweets(request_identifier, tweets_raw):
@@ -42,6 +77,8 @@ def process_tweets(request_identifier, tweets_raw):
 
     tweets = json.loads(tweets_raw)
 
+    included = []
+
     for tweet in tweets:
         if 'tweet' in tweet:
             tweet = tweet['tweet']
@@ -49,38 +86,9 @@ def process_tweets(request_identifier, tweets_raw):
         created = arrow.get(tweet['created_at'], 'ddd MMM DD HH:mm:ss Z YYYY').datetime
 
         if include_data(request_identifier, created, tweet):
-            if 'id' in tweet:
-                tweet['pdk_hashed_id'] = hash_content(tweet['id'])
-                tweet['pdk_encrypted_id'] = encrypt_content(tweet['id'].encode('utf-8'))
-                del tweet['id']
-
-            if 'id_str' in tweet:
-                tweet['pdk_hashed_id_str'] = hash_content(tweet['id_str'])
-                tweet['pdk_encrypted_id_str'] = encrypt_content(tweet['id_str'].encode('utf-8'))
-                del tweet['id_str']
-
-            if 'full_text' in tweet:
-                tweet['pdk_encrypted_full_text'] = encrypt_content(tweet['full_text'].encode('utf-8'))
-
-                annotate_field(tweet, 'full_text', tweet['full_text'])
-
-                del tweet['full_text']
+            included.append(('pdk-external-twitter-tweet', tweet, created, {'outgoing_engagement': 1.0, 'engagement_type': 'post'}))
 
-            if 'entities' in tweet:
-                entities_str = json.dumps(tweet['entities'], indent=2)
-                tweet['pdk_encrypted_entities'] = encrypt_content(entities_str.encode('utf-8'))
-
-                del tweet['entities']
-
-            if 'urls' in tweet:
-                urls_str = json.dumps(tweet['urls'], indent=2)
-                tweet['pdk_encrypted_urls'] = urls_str(entities_str.encode('utf-8'))
-
-                del tweet['urls']
-
-            DataPoint.objects.create_data_point('pdk-external-twitter-tweet', request_identifier, tweet, user_agent='Passive Data Kit External Importer', created=created)
-
-            create_engagement_event(source='twitter', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='post', start=created)
+    queue_included(request_identifier, included)
 
 def process_direct_messages(request_identifier, messages_raw): # pylint: disable=too-many-branches
     messages_raw = messages_raw.replace('window.YTD.direct_message.part0 = ', '')
@@ -99,6 +107,8 @@ def process_direct_messages(request_identifier, messages_raw): # pylint: disable
             else:
                 my_ids = list(set().union(my_ids, tokens))
 
+    included = []
+
     if len(my_ids) > 0: # pylint: disable=len-as-condition, too-many-nested-blocks
         my_id = my_ids[0]
 
@@ -111,29 +121,23 @@ def process_direct_messages(request_identifier, messages_raw): # pylint: disable
 
                     if include_data(request_identifier, created, msg_data):
                         pdk_message = {
-                            'pdk_hashed_recipientId': hash_content(msg_data['recipientId']),
-                            'pdk_encrypted_recipientId': encrypt_content(msg_data['recipientId'].encode('utf-8')),
-                            'pdk_hashed_senderId': hash_content(msg_data['senderId']),
-                            'pdk_encrypted_senderId': encrypt_content(msg_data['senderId'].encode('utf-8')),
-                            'pdk_encrypted_text': encrypt_content(msg_data['text'].encode('utf-8')),
+                            'recipientId': msg_data['recipientId'],
+                            'senderId': msg_data['senderId'],
+                            'text': msg_data['text'],
                             'id': msg_data['id'],
                             'conversationId': conversation['dmConversation']['conversationId'],
                             'createdAt': msg_data['createdAt']
                         }
 
-                        annotate_field(pdk_message, 'text', msg_data['text'])
-
                         if msg_data['mediaUrls']:
-                            media_urls_str = json.dumps(msg_data['mediaUrls'], indent=2)
-                            pdk_message['pdk_encrypted_mediaUrls'] = encrypt_content(media_urls_str.encode('utf-8'))
-
-
-                        DataPoint.objects.create_data_point('pdk-external-twitter-direct-message', request_identifier, pdk_message, user_agent='Passive Data Kit External Importer', created=created)
+                            pdk_message['mediaUrls'] = msg_data['mediaUrls']
 
                         if my_id == msg_data['senderId']:
-                            create_engagement_event(source='twitter', identifier=request_identifier, outgoing_engagement=1.0, engagement_type='message', start=created)
+                            engagement = {'outgoing_engagement': 1.0, 'engagement_type': 'message'}
                         else:
-                            create_engagement_event(source='twitter', identifier=request_identifier, incoming_engagement=1.0, engagement_type='message', start=created)
+                            engagement = {'incoming_engagement': 1.0, 'engagement_type': 'message'}
+
+                        included.append(('pdk-external-twitter-direct-message', pdk_message, created, engagement))
                 elif 'reactionCreate' in message:
                     msg_data = message['reactionCreate']
 
@@ -141,38 +145,38 @@ def process_direct_messages(request_identifier, messages_raw): # pylint: disable
 
                     if include_data(request_identifier, created, msg_data):
                         pdk_message = {
-                            'pdk_hashed_senderId': hash_content(msg_data['senderId']),
-                            'pdk_encrypted_senderId': encrypt_content(msg_data['senderId'].encode('utf-8')),
+                            'senderId': msg_data['senderId'],
                             'eventId': msg_data['eventId'],
                             'reactionKey': msg_data['reactionKey'],
                             'createdAt': msg_data['createdAt']
                         }
 
-                        DataPoint.objects.create_data_point('pdk-external-twitter-direct-message-reaction', request_identifier, pdk_message, user_agent='Passive Data Kit External Importer', created=created)
-
                         if my_id == msg_data['senderId']:
-                            create_engagement_event(source='twitter', identifier=request_identifier, outgoing_engagement=0.5, engagement_type='reaction', start=created)
+                            engagement = {'outgoing_engagement': 0.5, 'engagement_type': 'reaction'}
                         else:
-                            create_engagement_event(source='twitter', identifier=request_identifier, incoming_engagement=0.5, engagement_type='reaction', start=created)
+                            engagement = {'incoming_engagement': 0.5, 'engagement_type': 'reaction'}
+
+                        included.append(('pdk-external-twitter-direct-message-reaction', pdk_message, created, engagement))
                 else:
                     print('TWITTER/MSG: ' + json.dumps(message, indent=2))
 
+    queue_included(request_identifier, included)
+
 def process_ad_impressions(request_identifier, ads_raw):
     ads_raw = ads_raw.replace('window.YTD.ad_impressions.part0 = ', '')
 
     ads = json.loads(ads_raw)
 
+    included = []
+
     for ad_view in ads:
         for impression in ad_view['ad']['adsUserData']['adImpressions']['impressions']:
             created = arrow.get(impression['impressionTime']).datetime
 
             if include_data(request_identifier, created, impression):
-                if 'promotedTweetInfo' in impression:
-                    annotate_field(impression, 'tweet_text', impression['promotedTweetInfo']['tweetText'])
-
-                DataPoint.objects.create_data_point('pdk-external-twitter-ad-viewed', request_identifier, impression, user_agent='Passive Data Kit External Importer', created=created)
+                included.append(('pdk-external-twitter-ad-viewed', impression, created, {'outgoing_engagement': 0.0, 'engagement_type': 'advertising'}))
 
-                create_engagement_event(source='twitter', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='advertising', start=created)
+    queue_included(request_identifier, included)
 
 def process_ad_engagements(request_identifier, ads_raw):
     ads_raw = ads_raw.replace('window.YTD.ad_engagements.part0 = ', '')
@@ -188,89 +192,84 @@ def process_ad_engagements(request_identifier, ads_raw):
                     payload = engagement['impressionAttributes']
                     payload['engagementAttribute'] = engagement_attribute
 
-                    DataPoint.objects.create_data_point('pdk-external-twitter-ad-engagement', request_identifier, payload, user_agent='Passive Data Kit External Importer', created=created)
+                    queue_batch_insert(DataPoint.objects.create_data_point('pdk-external-twitter-ad-engagement', request_identifier, payload, user_agent='Passive Data Kit External Importer', created=created, skip_save=True))
 
                     create_engagement_event(source='twitter', identifier=request_identifier, outgoing_engagement=0.0, engagement_type='advertising', start=created)
 
-def import_data(request_identifier, path): # pylint: disable=too-many-branches
-    with zipfile.ZipFile(path) as content_bundle:
-        skip_files = [
-            'data/manifest.js',
-            'data/account-creation-ip.js',
-            'data/account-suspension.js',
-            'data/account-timezone.js',
-            'data/account.js',
-            'data/ad-mobile-conversions-attributed.js',
-            'data/ad-mobile-conversions-unattributed.js',
-            'data/ad-online-conversions-attributed.js',
-            'data/ad-online-conversions-unattributed.js',
-            'data/ageinfo.js',
-            'data/block.js',
-            'data/branch-links.js',
-            'data/connected-application.js',
-            'data/contact.js',
-            'data/device-token.js',
-            'data/direct-message-group-headers.js',
-            'data/direct-message-headers.js',
-            'data/direct-messages-group.js',
-            'data/email-address-change.js',
-            'data/follower.js',
-            'data/following.js',
-            'data/ip-audit.js',
-            'data/like.js',
-            'data/moment.js',
-            'data/mute.js',
-            'data/ni-devices.js',
-            'data/periscope-account-information.js',
-            'data/periscope-ban-information.js',
-            'data/periscope-broadcast-metadata.js',
-            'data/periscope-profile-description.js',
-            'data/personalization.js',
-            'data/phone-number.js',
-            'data/profile.js',
-            'data/saved-search.js',
-            'data/screen-name-change.js',
-            'data/verified.js',
-        ]
-
-        for content_file in content_bundle.namelist():
-            with content_bundle.open(content_file) as opened_file:
-                try:
-                    if content_file.endswith('/'):
-                        pass
-                    elif content_file in skip_files:
-                        pass
-                    elif 'assets/' in content_file:
-                        pass
-                    elif '.i18n.' in content_file:
-                        pass
-                    elif content_file.endswith('.png'):
-                        pass
-                    elif content_file.endswith('.svg'):
-                        pass
-                    elif content_file.endswith('.jpg'):
-                        pass
-                    elif content_file.endswith('.mp4'):
-                        pass
-                    elif re.match(r'.*\/direct-message\.js', content_file) or content_file == 'direct-message.js':
-                        process_direct_messages(request_identifier, opened_file.read())
-                    elif re.match(r'.*\/direct-messages\.js', content_file) or content_file == 'direct-messages.js':
-                        process_direct_messages(request_identifier, opened_file.read())
-                    # elif re.match(r'^like\.js', content_file[-1]):
-                    #    process_likes(request_identifier, content_bundle.open(content_file).read())
-                    elif re.match(r'.*\/tweet\.js', content_file) or content_file == 'tweet.js':
-                        process_tweets(request_identifier, opened_file.read())
-                    elif re.match(r'.*\/ad-impressions\.js', content_file):
-                        process_ad_impressions(request_identifier, opened_file.read())
-                    elif re.match(r'.*\/ad-engagements\.js', content_file):
-                        process_ad_engagements(request_identifier, opened_file.read())
-                    else:
-                        print('TWITTER[' + request_identifier + ']: Unable to process: ' + content_file + ' -- ' + str(content_bundle.getinfo(content_file).file_size))
-                except: # pylint: disable=bare-except
-                    traceback.print_exc()
-                    return False
-
-    return True
+SKIP_FILES = [
+    'data/manifest.js',
+    'data/account-creation-ip.js',
+    'data/account-suspension.js',
+    'data/account-timezone.js',
+    'data/account.js',
+    'data/ad-mobile-conversions-attributed.js',
+    'data/ad-mobile-conversions-unattributed.js',
+    'data/ad-online-conversions-attributed.js',
+    'data/ad-online-conversions-unattributed.js',
+    'data/ageinfo.js',
+    'data/block.js',
+    'data/branch-links.js',
+    'data/connected-application.js',
+    'data/contact.js',
+    'data/device-token.js',
+    'data/direct-message-group-headers.js',
+    'data/direct-message-headers.js',
+    'data/direct-messages-group.js',
+    'data/email-address-change.js',
+    'data/follower.js',
+    'data/following.js',
+    'data/ip-audit.js',
+    'data/like.js',
+    'data/moment.js',
+    'data/mute.js',
+    'data/ni-devices.js',
+    'data/periscope-account-information.js',
+    'data/periscope-ban-information.js',
+    'data/periscope-broadcast-metadata.js',
+    'data/periscope-profile-description.js',
+    'data/personalization.js',
+    'data/phone-number.js',
+    'data/profile.js',
+    'data/saved-search.js',
+    'data/screen-name-change.js',
+    'data/verified.js',
+]
+
+def import_member(request_identifier, content_bundle, content_file, context): # pylint: disable=too-many-branches, unused-argument
+    with content_bundle.open(content_file) as opened_file:
+        if content_file.endswith('/'):
+            pass
+        elif content_file in SKIP_FILES:
+            pass
+        elif 'assets/' in content_file:
+            pass
+        elif '.i18n.' in content_file:
+            pass
+        elif content_file.endswith('.png'):
+            pass
+        elif content_file.endswith('.svg'):
+            pass
+        elif content_file.endswith('.jpg'):
+            pass
+        elif content_file.endswith('.mp4'):
+            pass
+        elif re.match(r'.*\/direct-message\.js', content_file) or content_file == 'direct-message.js':
+            process_direct_messages(request_identifier, opened_file.read())
+        elif re.match(r'.*\/direct-messages\.js', content_file) or content_file == 'direct-messages.js':
+            process_direct_messages(request_identifier, opened_file.read())
+        # elif re.match(r'^like\.js', content_file[-1]):
+        #    process_likes(request_identifier, content_bundle.open(content_file).read())
+        elif re.match(r'.*\/tweet\.js', content_file) or content_file == 'tweet.js':
+            process_tweets(request_identifier, opened_file.read())
+        elif re.match(r'.*\/ad-impressions\.js', content_file):
+            process_ad_impressions(request_identifier, opened_file.read())
+        elif re.match(r'.*\/ad-engagements\.js', content_file):
+            process_ad_engagements(request_identifier, opened_file.read())
+        else:
+            print('TWITTER[' + request_identifier + ']: Unable to process: ' + content_file + ' -- ' + str(content_bundle.getinfo(content_file).file_size))
+
+def import_data(request_identifier, path, data_file=None, batch_writer=None):
+    return import_bundle(request_identifier, path, import_member, data_file=data_file, batch_writer=batch_writer)
 
 def external_data_metadata(generator_identifier, point):
     if generator_identifier.startswith('pdk-external-twitter') is False:
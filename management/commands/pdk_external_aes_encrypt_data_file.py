@@ -2,10 +2,6 @@
 
 from __future__ import print_function
 
-import os
-
-from django.conf import settings
-from django.core.files import File
 from django.core.management.base import BaseCommand
 
 from passive_data_kit.decorators import handle_lock
@@ -13,7 +9,7 @@ from passive_data_kit.decorators import handle_lock
 from ...models import ExternalDataRequestFile
 
 class Command(BaseCommand):
-    help = 'Encrypts file using AES for larger files.'
+    help = 'Encrypts file using chunked streaming encryption for larger files (formerly AES via OpenSSL).'
 
     def add_arguments(self, parser):
         parser.add_argument('file_pk',
@@ -26,24 +22,7 @@ class Command(BaseCommand):
         query = ExternalDataRequestFile.objects.filter(pk=options['file_pk'])
 
         for data_file in query.order_by('-pk'):
-            original_path = data_file.data_file.path
-
-            encrypted_path = data_file.data_file.path + '.aes-tmp'
-
-            cmd_line = 'openssl enc -aes-256-cbc -in'.split(' ')
-
-            cmd_line.append(original_path)
-            cmd_line.append('-out')
-            cmd_line.append(encrypted_path)
-            cmd_line.append('-k')
-            cmd_line.append(settings.PDK_EXTERNAL_CONTENT_SYMETRIC_KEY)
-
-            os.system(' '.join(cmd_line)) # nosec
-
-            new_filename = os.path.basename(encrypted_path).replace('.aes-tmp', '.aes')
-
-            with open(encrypted_path, 'rb') as export_file:
-                data_file.data_file.save(new_filename, File(export_file))
-
-            os.remove(original_path)
-            os.remove(encrypted_path)
+            if data_file.encrypted():
+                print('Already encrypted: ' + data_file.data_file.path)
+            else:
+                data_file.encrypt_data_file()
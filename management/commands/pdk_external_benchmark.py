@@ -0,0 +1,451 @@
+# pylint: disable=no-member,line-too-long
+
+from __future__ import print_function
+
+import base64
+import hashlib
+import importlib
+import os
+import pkgutil
+import random
+import string
+import subprocess
+import sys
+import time
+
+from nacl.public import SealedBox, PublicKey
+
+from django.conf import settings
+from django.core.management import get_commands
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from passive_data_kit.models import DataPoint
+
+from ...annotation_engine import annotate_texts
+from ...hooks import annotator_hooks
+from ...models import annotate_field
+from ...pdk_api import import_external_data
+from ...utils import assert_max_queries, encrypt_content, encrypt_many, encryption_executor, hash_content, hash_many, insert_data_points, PENDING_POINTS_LIMIT
+
+def synthetic_data_points(count):
+    now = timezone.now()
+
+    data_points = []
+
+    for index in range(0, count):
+        payload = {
+            'pdk_encrypted_content': 'benchmark-' + str(index) + ('x' * 128),
+            'pdk_length': 128,
+            'direction': 'outgoing' if index % 2 == 0 else 'incoming',
+        }
+
+        data_points.append(DataPoint.objects.create_data_point('pdk-external-benchmark', 'pdk-external-benchmark', payload, user_agent='Passive Data Kit External Benchmark', created=now, skip_save=True, skip_extract_secondary_identifier=True))
+
+    return data_points
+
+def benchmark_batch_insert(options):
+    '''
+    Compares bulk_create with the COPY loader (PDK_EXTERNAL_BATCH_INSERT_METHOD) by
+    inserting the same synthetic points in PENDING_POINTS_LIMIT-sized batches. Each
+    run happens in a transaction that is rolled back.
+    '''
+
+    results = {}
+
+    for method in ('bulk_create', 'copy'):
+        data_points = synthetic_data_points(options['points'])
+
+        with transaction.atomic():
+            start = time.time()
+
+            for index in range(0, len(data_points), options['batch_size']):
+                insert_data_points(data_points[index:(index + options['batch_size'])], method=method)
+
+            elapsed = time.time() - start
+
+            transaction.set_rollback(True)
+
+        results[method] = elapsed
+
+        print('%s: %d points in %.3f s (%.0f points/s)' % (method, len(data_points), elapsed, len(data_points) / max(elapsed, 0.001)))
+        sys.stdout.flush()
+
+    print('copy speedup: %.2fx' % (results['bulk_create'] / max(results['copy'], 0.001)))
+
+def benchmark_import_queries(options):
+    '''
+    Imports --bundle as a --source upload inside a rolled-back transaction and reports
+    the number of queries it ran, failing if that exceeds --max-queries (if set).
+    '''
+
+    if options['bundle'] is None or options['source'] is None:
+        print('Skipping: --bundle and --source are required.')
+
+        return
+
+    max_queries = options['max_queries'] if options['max_queries'] > 0 else sys.maxsize
+
+    with transaction.atomic():
+        start = time.time()
+
+        with assert_max_queries(max_queries) as context:
+            succeeded = import_external_data(options['source'], 'pdk-external-benchmark', options['bundle'])
+
+        elapsed = time.time() - start
+
+        transaction.set_rollback(True)
+
+    print('%s: succeeded=%s, %d queries in %.3f s' % (options['source'], succeeded, len(context.captured_queries), elapsed))
+
+def time_operation(label, count, operation):
+    start = time.time()
+
+    operation()
+
+    elapsed = time.time() - start
+
+    print('%s: %d fields in %.3f s (%.0f fields/s)' % (label, count, elapsed, count / max(elapsed, 0.001)))
+    sys.stdout.flush()
+
+    return elapsed
+
+def benchmark_crypto(options):
+    '''
+    Compares rebuilding the cipher and hash state for every field (the previous
+    encrypt_content and hash_content behavior) with the cached content cipher, per field
+    and through encrypt_many and hash_many. With --encryption-processes, also times
+    encrypt_content through an EncryptionExecutor (including pool startup).
+    '''
+
+    count = options['points']
+
+    names = ['Participant %d' % (index % 3) for index in range(0, count)]
+    contents = [('Message %d ' % index).encode('utf-8') * 8 for index in range(0, count)]
+
+    def uncached_encrypt():
+        for content in contents:
+            box = SealedBox(PublicKey(base64.b64decode(settings.PDK_EXTERNAL_CONTENT_PUBLIC_KEY)))
+
+            base64.b64encode(box.encrypt(content)).decode('ascii')
+
+    def uncached_hash():
+        for name in names:
+            sha512 = hashlib.sha512()
+
+            sha512.update(settings.PDK_EXTERNAL_CONTENT_PUBLIC_KEY.encode('utf-8'))
+            sha512.update(name.encode('utf-8'))
+
+            sha512.hexdigest()
+
+    time_operation('encrypt (uncached)', count, uncached_encrypt)
+    time_operation('encrypt_content', count, lambda: [encrypt_content(content) for content in contents])
+    time_operation('encrypt_many', count, lambda: encrypt_many(contents))
+
+    if options['encryption_processes'] > 1:
+        def offloaded_encrypt():
+            with encryption_executor(processes=options['encryption_processes']) as executor:
+                placeholders = [encrypt_content(content) for content in contents]
+
+                if executor is not None:
+                    executor.resolve(placeholders)
+
+        time_operation('encrypt_content (%d processes)' % options['encryption_processes'], count, offloaded_encrypt)
+
+    time_operation('hash (uncached)', count, uncached_hash)
+    time_operation('hash_content', count, lambda: [hash_content(name) for name in names])
+    time_operation('hash_many', count, lambda: hash_many(names))
+
+def legacy_run_annotators(annotators_app, container, field_name, field_value):
+    annotators = importlib.import_module(annotators_app + '.annotators')
+
+    prefix = annotators.__name__ + '.'
+
+    for importer, modname, ispkg in pkgutil.iter_modules(annotators.__path__, prefix): # pylint: disable=unused-variable
+        module = __import__(modname, fromlist='dummy')
+
+        annotations = module.annotate(field_value, field_name)
+
+        if annotations is not None:
+            for key in annotations.keys():
+                container[key] = annotations[key]
+
+def legacy_annotate_field(container, field_name=None, field_value=None):
+    # annotate_field and pdk_annotate_field as they dispatched before the hook registry.
+
+    for app in settings.INSTALLED_APPS:
+        try:
+            importlib.import_module(app + '.pdk_external_api')
+
+            for annotators_app in settings.INSTALLED_APPS:
+                try:
+                    legacy_run_annotators(annotators_app, container, field_name, field_value)
+                except ImportError:
+                    pass
+                except AttributeError:
+                    pass
+        except ImportError:
+            pass
+        except AttributeError:
+            pass
+
+def benchmark_annotate_dispatch(options):
+    '''
+    Times annotate_field through the per-call imports and package scans it used before
+    the hook registry, through the registry, and the annotators called directly (the
+    cost of the annotations themselves).
+    '''
+
+    count = min(options['points'], 20000)
+
+    texts = [('Message %d with a few more words in it. ' % index) * 4 for index in range(0, count)]
+
+    def direct_annotate():
+        for text in texts:
+            container = {}
+
+            for app, annotate in annotator_hooks('annotate'): # pylint: disable=unused-variable
+                container.update(annotate(text, 'content'))
+
+    legacy = time_operation('annotate_field (legacy dispatch)', count, lambda: [legacy_annotate_field({}, 'content', text) for text in texts])
+    registry = time_operation('annotate_field (hook registry)', count, lambda: [annotate_field({}, 'content', text) for text in texts])
+    direct = time_operation('annotators only', count, direct_annotate)
+
+    print('per call: legacy %.1f us, registry %.1f us, annotators %.1f us' % (1e6 * legacy / count, 1e6 * registry / count, 1e6 * direct / count))
+
+DIRECT_MESSAGE_PHRASES = (
+    'ok',
+    'lol',
+    'haha',
+    'omg yes!!',
+    'see you at 7?',
+    'on my way \U0001f697',
+    'did you see this?',
+    'wait... what?!',
+    'can you send me the notes from class',
+    "I'm so tired today, didn't sleep at all",
+    'happy birthday!!! \U0001f389\U0001f382',
+    'https://www.instagram.com/p/Cx1a2b3c4d5/',
+    "that's hilarious \U0001f602\U0001f602\U0001f602",
+    "Let me know when you're free this weekend - maybe Saturday afternoon?",
+)
+
+def synthetic_direct_messages(count):
+    '''
+    Direct message bodies shaped like a typical export: mostly short replies, some
+    multi-line messages, and a few pasted messages with long runs of spaces.
+    '''
+
+    generator = random.Random(count)
+
+    messages = []
+
+    for index in range(0, count): # pylint: disable=unused-variable
+        kind = generator.random()
+
+        if kind < 0.7:
+            messages.append(' '.join(generator.choice(DIRECT_MESSAGE_PHRASES) for phrase in range(0, generator.randint(1, 3))))
+        elif kind < 0.95:
+            messages.append('\n'.join(' '.join(generator.choice(DIRECT_MESSAGE_PHRASES) for phrase in range(0, generator.randint(2, 6))) for line in range(0, generator.randint(2, 5))))
+        else:
+            messages.append(''.join(generator.choice(DIRECT_MESSAGE_PHRASES) + (' ' * generator.randint(2, 200)) for phrase in range(0, generator.randint(5, 20))))
+
+    return messages
+
+def legacy_annotate(content, field_name):
+    # The length and word count annotators as they ran before the annotation engine.
+
+    annotations = {
+        'pdk_length_' + field_name: len(content)
+    }
+
+    non_punc = set(string.punctuation)
+
+    content_nopunc = ''.join(ch for ch in content if ch not in non_punc)
+
+    while '  ' in content_nopunc:
+        content_nopunc = content_nopunc.replace('  ', ' ')
+
+    annotations['pdk_word_count_' + field_name] = len(content_nopunc.strip().split(' '))
+
+    return annotations
+
+def benchmark_annotate_engine(options):
+    '''
+    Times the length and word count annotations over a synthetic direct message corpus:
+    as separate passes (before the annotation engine), through annotate_field per message,
+    and through annotate_texts for the whole batch. Reports any message where the engine
+    disagrees with the previous annotators.
+    '''
+
+    count = min(options['points'], 50000)
+
+    messages = synthetic_direct_messages(count)
+
+    legacy_results = []
+    batch_results = []
+
+    legacy = time_operation('annotators (separate passes)', count, lambda: legacy_results.extend(legacy_annotate(message, 'content') for message in messages))
+    single = time_operation('annotate_field (engine)', count, lambda: [annotate_field({}, 'content', message) for message in messages])
+    batch = time_operation('annotate_texts (engine, batch)', count, lambda: batch_results.extend(annotate_texts(messages, 'content')))
+
+    mismatches = 0
+
+    for expected, annotations in zip(legacy_results, batch_results):
+        for key, value in expected.items():
+            if annotations.get(key, None) != value:
+                mismatches += 1
+
+    print('per message: separate %.1f us, annotate_field %.1f us, batch %.1f us; %d mismatched annotations' % (1e6 * legacy / count, 1e6 * single / count, 1e6 * batch / count, mismatches))
+
+STARTUP_HEAVY_MODULES = ('bs4', 'chardet', 'lxml', 'pandas', 'pathlib2',)
+
+def parse_import_times(output):
+    '''
+    Returns (cumulative microseconds, module, depth) for each import reported by python
+    -X importtime. Depth 0 imports are top-level; nested imports are also counted in
+    their parent's cumulative time.
+    '''
+
+    imports = []
+
+    for line in output.splitlines():
+        if line.startswith('import time:') is False:
+            continue
+
+        fields = line[len('import time:'):].split('|')
+
+        if len(fields) != 3:
+            continue
+
+        try:
+            cumulative = int(fields[1])
+        except ValueError:
+            continue # Header line
+
+        depth = (len(fields[2]) - len(fields[2].lstrip()) - 1) // 2
+
+        imports.append((cumulative, fields[2].strip(), depth))
+
+    return imports
+
+def benchmark_startup(options):
+    '''
+    Starts each pdk_external_* command (with --help, so only Django setup and the
+    command's imports are measured) under python -X importtime and reports its wall time,
+    total import time, slowest top-level imports and any heavy importer dependencies that
+    were loaded. Fails if a command starts slower than --startup-budget seconds (if set).
+    '''
+
+    manage_script = os.path.abspath(sys.argv[0])
+
+    commands = sorted(name for name in get_commands().keys() if name.startswith('pdk_external_'))
+
+    over_budget = []
+
+    for command in commands:
+        start = time.time()
+
+        process = subprocess.Popen([sys.executable, '-X', 'importtime', manage_script, command, '--help'], stdout=subprocess.PIPE, stderr=subprocess.PIPE) # pylint: disable=consider-using-with
+
+        stdout, stderr = process.communicate() # pylint: disable=unused-variable
+
+        elapsed = time.time() - start
+
+        imports = parse_import_times(stderr.decode('utf-8', 'replace'))
+
+        loaded = set(module for cumulative, module, depth in imports)
+
+        heavy = [module for module in STARTUP_HEAVY_MODULES if module in loaded]
+
+        imports = sorted([(cumulative, module) for cumulative, module, depth in imports if depth == 0], reverse=True)
+
+        print('%s: %.3f s (imports %.3f s; slowest: %s; heavy: %s)' % (command, elapsed, sum(cumulative for cumulative, module in imports) / 1e6, ', '.join('%s %.3f s' % (module, cumulative / 1e6) for cumulative, module in imports[:5]), ', '.join(heavy) if heavy else 'none'))
+        sys.stdout.flush()
+
+        if process.returncode != 0:
+            print('  exited with status %d: %s' % (process.returncode, stderr.decode('utf-8', 'replace').strip().splitlines()[-1:]))
+
+        if 0 < options['startup_budget'] < elapsed:
+            over_budget.append(command)
+
+    if over_budget:
+        raise AssertionError('%s started slower than %.3f s.' % (', '.join(over_budget), options['startup_budget']))
+
+BENCHMARKS = {
+    'annotate-dispatch': benchmark_annotate_dispatch,
+    'annotate-engine': benchmark_annotate_engine,
+    'batch-insert': benchmark_batch_insert,
+    'crypto': benchmark_crypto,
+    'import-queries': benchmark_import_queries,
+    'startup': benchmark_startup,
+}
+
+class Command(BaseCommand):
+    help = 'Runs performance benchmarks for the external data pipeline.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('benchmark',
+                            type=str,
+                            nargs='*',
+                            help='Benchmarks to run (default: all). Available: ' + ', '.join(sorted(BENCHMARKS.keys())))
+
+        parser.add_argument('--points',
+                            type=int,
+                            dest='points',
+                            default=100000,
+                            help='Number of synthetic data points to generate')
+
+        parser.add_argument('--bundle',
+                            type=str,
+                            dest='bundle',
+                            default=None,
+                            help='Path to an export bundle for import benchmarks (imported in a rolled-back transaction)')
+
+        parser.add_argument('--source',
+                            type=str,
+                            dest='source',
+                            default=None,
+                            help='External data source identifier of --bundle (e.g. snapchat)')
+
+        parser.add_argument('--max-queries',
+                            type=int,
+                            dest='max_queries',
+                            default=0,
+                            help='Fail the import-queries benchmark if the import runs more queries than this')
+
+        parser.add_argument('--startup-budget',
+                            type=float,
+                            dest='startup_budget',
+                            default=0.0,
+                            help='Fail the startup benchmark if a pdk_external_* command takes longer than this many seconds to start')
+
+        parser.add_argument('--encryption-processes',
+                            type=int,
+                            dest='encryption_processes',
+                            default=0,
+                            help='Also time the crypto benchmark with an encryption executor of this many processes')
+
+        parser.add_argument('--batch-size',
+                            type=int,
+                            dest='batch_size',
+                            default=PENDING_POINTS_LIMIT,
+                            help='Number of data points written per batch')
+
+    def handle(self, *args, **options):
+        benchmarks = options['benchmark']
+
+        if len(benchmarks) == 0: # pylint: disable=len-as-condition
+            benchmarks = sorted(BENCHMARKS.keys())
+
+        for benchmark in benchmarks:
+            if (benchmark in BENCHMARKS) is False:
+                print('Unknown benchmark: ' + benchmark)
+
+                continue
+
+            print('== ' + benchmark)
+            sys.stdout.flush()
+
+            BENCHMARKS[benchmark](options)
@@ -6,17 +6,77 @@ import base64
 import gc
 import getpass
 import os
+import sys
+import time
 import traceback
 
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
 from nacl.exceptions import CryptoError
 from nacl.public import SealedBox, PrivateKey
 
-from django.core.files.base import ContentFile
+from django.db import connections
 from django.core.management.base import BaseCommand
 
 from passive_data_kit.decorators import handle_lock
 
 from ...models import ExternalDataRequestFile
+from ...utils import is_stream_encrypted
+
+STREAM_MEMORY_ESTIMATE = 16 * 1024 * 1024
+
+DECRYPT_BOX = None
+
+def initialize_decrypt_worker(key):
+    global DECRYPT_BOX # pylint: disable=global-statement
+
+    DECRYPT_BOX = SealedBox(PrivateKey(base64.b64decode(key)))
+
+def estimated_memory(path):
+    try:
+        if path.endswith('.aes') or is_stream_encrypted(path):
+            return STREAM_MEMORY_ESTIMATE
+
+        return 3 * os.path.getsize(path) # Whole-file SealedBox: ciphertext, cleartext, and storage copy.
+    except (IOError, OSError):
+        return STREAM_MEMORY_ESTIMATE
+
+def available_memory():
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return 2 * 1024 * 1024 * 1024
+
+def decrypt_data_file(file_pk, key=None):
+    if key is not None and DECRYPT_BOX is None: # ProcessPoolExecutor initializers need Python 3.7+.
+        initialize_decrypt_worker(key)
+
+    data_file = ExternalDataRequestFile.objects.get(pk=file_pk)
+
+    original_path = data_file.data_file.path
+
+    try:
+        size = os.path.getsize(original_path)
+    except (IOError, OSError):
+        size = 0
+
+    start = time.time()
+
+    try:
+        legacy_format = (original_path.endswith('.aes') is False and is_stream_encrypted(original_path) is False)
+
+        data_file.decrypt_data_file(DECRYPT_BOX)
+
+        if legacy_format:
+            gc.collect()
+
+        return (file_pk, None, size, time.time() - start, None)
+    except CryptoError:
+        return (file_pk, 'CryptoError', size, time.time() - start, traceback.format_exc())
+    except MemoryError:
+        return (file_pk, 'MemoryError', size, time.time() - start, traceback.format_exc())
+    except IOError:
+        return (file_pk, 'IOError', size, time.time() - start, traceback.format_exc())
 
 class Command(BaseCommand):
     help = 'Decrypts content previously encrypted using server public key.'
@@ -25,7 +85,7 @@ class Command(BaseCommand):
         parser.add_argument('file_pk',
                             type=int,
                             nargs='+',
-                            help='PK of data file containing encrypted file')
+                            help='PK of data file containing encrypted file (negative values decrypt every file from that PK upward)')
 
         parser.add_argument('--key',
                             type=str,
@@ -33,57 +93,105 @@ class Command(BaseCommand):
                             required=False,
                             help='Base64-encoded private key corresponding to server\'s public key')
 
+        parser.add_argument('--jobs',
+                            type=int,
+                            dest='jobs',
+                            default=1,
+                            help='Number of files to decrypt concurrently in worker processes')
+
+        parser.add_argument('--memory-limit',
+                            type=int,
+                            dest='memory_limit',
+                            default=0,
+                            help='Memory budget (MB) shared by concurrent decryptions (defaults to half of available memory)')
+
+    def report(self, result, verbose):
+        file_pk, error, size, elapsed, details = result
+
+        if error is None:
+            throughput = (size / (1024.0 * 1024.0)) / max(elapsed, 0.001)
+
+            print('Decrypted content file for ' + str(file_pk) + ' (%.1f MB in %.1f s, %.1f MB/s).' % (size / (1024.0 * 1024.0), elapsed, throughput))
+        else:
+            print('Unable to decrypt ' + str(file_pk) + ' (' + error + '). Please investigate manually.')
+
+            if verbose:
+                print(details)
+
+        sys.stdout.flush()
+
     @handle_lock
     def handle(self, *args, **options): # pylint: disable=too-many-locals, too-many-branches, too-many-statements
         if options['key'] is None:
             options['key'] = getpass.getpass('Enter private key: ')
 
+        pending = []
+        verbose = False
+
         for file_pk in options['file_pk']:
             query = ExternalDataRequestFile.objects.filter(pk=file_pk)
 
             if file_pk < 0:
                 query = ExternalDataRequestFile.objects.filter(pk__gte=(0 - file_pk))
+            else:
+                verbose = True
 
             for data_file in query.exclude(processed=None, skipped=None).order_by('pk'):
-                box = SealedBox(PrivateKey(base64.b64decode(options['key'])))
+                pending.append((data_file.pk, estimated_memory(data_file.data_file.path)))
+
+        memory_limit = options['memory_limit'] * 1024 * 1024
+
+        if memory_limit <= 0:
+            memory_limit = available_memory() // 2
+
+        results = []
+
+        start = time.time()
+
+        if options['jobs'] <= 1:
+            initialize_decrypt_worker(options['key'])
+
+            for file_pk, memory_estimate in pending: # pylint: disable=unused-variable
+                print('Decrypting content file for ' + str(file_pk) + '...')
+
+                result = decrypt_data_file(file_pk)
+
+                self.report(result, verbose)
+
+                results.append(result)
+        else:
+            connections.close_all() # Worker processes must open their own database connections.
 
-                original_path = data_file.data_file.path
+            with ProcessPoolExecutor(max_workers=options['jobs']) as executor:
+                running = {}
+                reserved = 0
 
-                try:
-                    with open(original_path, 'rb') as original_file:
-                        print('Decrypting content file for ' + str(data_file.pk) + '...')
+                while pending or running:
+                    # Always start at least one file, even if it alone exceeds the budget.
 
-                        try:
-                            cleartext = box.decrypt(original_file.read())
+                    while pending and len(running) < options['jobs'] and (not running or reserved + pending[0][1] <= memory_limit):
+                        file_pk, memory_estimate = pending.pop(0)
 
-                            filename = os.path.basename(data_file.data_file.path).replace('.encrypted', '')
+                        print('Decrypting content file for ' + str(file_pk) + '...')
 
-                            decrypted_file = ContentFile(cleartext)
+                        running[executor.submit(decrypt_data_file, file_pk, options['key'])] = memory_estimate
+                        reserved += memory_estimate
 
-                            data_file.data_file.save(filename, decrypted_file)
+                    done = wait(list(running.keys()), return_when=FIRST_COMPLETED)[0]
 
-                            os.remove(original_path)
+                    for future in done:
+                        reserved -= running.pop(future)
 
-                            data_file.processed = None
-                            data_file.skipped = None
+                        result = future.result()
 
-                            data_file.save()
+                        self.report(result, verbose)
 
-                            print('Decrypted content file for ' + str(data_file.pk) + '.')
-                        except CryptoError:
-                            print('Unable to decrypt ' + str(data_file.pk) + ' (CryptoError). Please investigate manually.')
+                        results.append(result)
 
-                            if file_pk > 0:
-                                traceback.print_exc()
-                        except MemoryError:
-                            print('Unable to decrypt ' + str(data_file.pk) + ' (MemoryError). Please investigate manually.')
+        elapsed = time.time() - start
 
-                            if file_pk > 0:
-                                traceback.print_exc()
-                except IOError:
-                    print('Unable to decrypt ' + str(data_file.pk) + ' (IOError). Please investigate manually.')
+        decrypted = [result for result in results if result[1] is None]
 
-                    if options['file_pk'] > 0:
-                        traceback.print_exc()
+        total_bytes = sum(result[2] for result in decrypted)
 
-                gc.collect()
+        print('Decrypted %d of %d files (%.1f MB) in %.1f s (%.1f MB/s overall).' % (len(decrypted), len(results), total_bytes / (1024.0 * 1024.0), elapsed, (total_bytes / (1024.0 * 1024.0)) / max(elapsed, 0.001)))
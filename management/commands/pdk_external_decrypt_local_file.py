@@ -4,6 +4,7 @@ from __future__ import print_function
 
 import base64
 import getpass
+import os
 import traceback
 
 from nacl.exceptions import CryptoError
@@ -13,6 +14,8 @@ from django.core.management.base import BaseCommand
 
 from passive_data_kit.decorators import handle_lock
 
+from ...utils import decrypt_stream, is_stream_encrypted, STREAM_EXTENSION
+
 class Command(BaseCommand):
     help = 'Decrypts content previously encrypted using server public key.'
 
@@ -36,26 +39,42 @@ class Command(BaseCommand):
 
         original_path = options['file']
 
+        if original_path.endswith('.aes'):
+            print('Unable to decrypt ' + str(original_path) + ': AES files require the symmetric key (openssl enc -d -aes-256-cbc -in <file> -out <output> -k <key>).')
+
+            return
+
         try:
-            with open(original_path, 'rb') as original_file:
-                print('Decrypting ' + str(original_path) + '...')
+            print('Decrypting ' + str(original_path) + '...')
+
+            try:
+                if is_stream_encrypted(original_path):
+                    filename = original_path.replace(STREAM_EXTENSION, '')
+
+                    try:
+                        with open(original_path, 'rb') as original_file:
+                            with open(filename, 'wb') as file_obj:
+                                decrypt_stream(original_file, file_obj, box)
+                    except CryptoError:
+                        os.remove(filename)
 
-                try:
-                    cleartext = box.decrypt(original_file.read())
+                        raise
+                else:
+                    with open(original_path, 'rb') as original_file:
+                        cleartext = box.decrypt(original_file.read())
 
                     filename = original_path.replace('.encrypted', '')
 
                     with open(filename, 'wb') as file_obj:
                         file_obj.write(cleartext)
 
-                    print('Decrypted ' + str(original_path) + ' to ' + filename + '.')
-                except CryptoError:
-                    print('Unable to decrypt ' + str(original_path) + ' (CryptoError). Please investigate manually.')
+                print('Decrypted ' + str(original_path) + ' to ' + filename + '.')
+            except CryptoError:
+                print('Unable to decrypt ' + str(original_path) + ' (CryptoError). Please investigate manually.')
 
-                    if options['file_pk'] > 0:
-                        traceback.print_exc()
-                except MemoryError:
-                    print('Unable to decrypt ' + str(original_path) + ' (MemoryError). Please investigate manually.')
+                traceback.print_exc()
+            except MemoryError:
+                print('Unable to decrypt ' + str(original_path) + ' (MemoryError). Please investigate manually.')
         except IOError:
             traceback.print_exc()
             print('Unable to decrypt ' + str(original_path) + ' (IOError). Please investigate manually.')
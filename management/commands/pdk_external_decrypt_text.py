@@ -13,6 +13,9 @@ from django.core.management.base import BaseCommand
 
 from passive_data_kit.decorators import handle_lock
 
+from ...crypto import ENVELOPE_PREFIX
+from ...utils import decrypt_content
+
 class Command(BaseCommand):
     help = 'Decrypts content previously encrypted using server public key.'
 
@@ -32,7 +35,13 @@ class Command(BaseCommand):
                             type=str,
                             dest='text',
                             required=False,
-                            help='Base64-encoded encrypted text')
+                            help='Base64-encoded encrypted text (or an "envelope:<key_id>:..." field)')
+
+        parser.add_argument('--sealed-key',
+                            type=str,
+                            dest='sealed_key',
+                            required=False,
+                            help='Sealed data key for envelope-encrypted text, if the key is not available in the database')
 
     @handle_lock
     def handle(self, *args, **options): # pylint: disable=too-many-locals, too-many-branches, too-many-statements
@@ -55,6 +64,14 @@ class Command(BaseCommand):
         else:
             box = SealedBox(PrivateKey(base64.b64decode(options['key'])))
 
-            cleartext = box.decrypt(base64.b64decode(options['text']))
+            sealed_keys = {}
+
+            if options['sealed_key'] is not None:
+                if options['text'].startswith(ENVELOPE_PREFIX):
+                    sealed_keys[options['text'][len(ENVELOPE_PREFIX):].split(':', 1)[0]] = options['sealed_key']
+                else:
+                    print('Ignoring --sealed-key: the text is not envelope-encrypted.')
+
+            cleartext = decrypt_content(options['text'], box, sealed_keys=sealed_keys)
 
             print(cleartext)
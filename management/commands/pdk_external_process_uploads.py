@@ -2,20 +2,22 @@
 
 from __future__ import print_function
 
-import base64
-import os
-import sys
+import multiprocessing
 
-from nacl.public import SealedBox, PublicKey
-
-from django.conf import settings
-from django.core.files.base import ContentFile
-from django.core.management import call_command
+from django.db import connections
 from django.core.management.base import BaseCommand
-from django.utils import timezone
 
 from passive_data_kit.decorators import handle_lock
-from ...models import ExternalDataRequestFile
+from ...models import process_next_data_file, upload_worker_identifier
+
+def drain_upload_queue(skip_encryption=False):
+    try:
+        worker_identifier = upload_worker_identifier()
+
+        while process_next_data_file(worker_identifier, skip_encryption=skip_encryption) is not None:
+            pass
+    finally:
+        connections.close_all()
 
 class Command(BaseCommand):
     help = 'Process uploaded data files into Passive Data Kit.'
@@ -27,37 +29,26 @@ class Command(BaseCommand):
                             default=False,
                             help='Skips default encryption for uploaded files')
 
+        parser.add_argument('--workers',
+                            type=int,
+                            dest='workers',
+                            default=0,
+                            help='Number of worker processes claiming and processing pending files until none remain (default processes a single file)')
+
     @handle_lock
     def handle(self, *args, **options): # pylint: disable=too-many-locals, too-many-branches, too-many-statements
-        for data_file in ExternalDataRequestFile.objects.filter(processed=None, skipped=None).order_by('pk')[:1]:
-            print('Processing ' + str(data_file.data_file.path) + ' (' + str(data_file.pk) + ')...')
-            sys.stdout.flush()
-
-            if data_file.process() is False:
-                print('Unable to process ' + str(data_file.data_file.path) + ' (' + str(data_file.pk) + ').')
-                sys.stdout.flush()
-
-                data_file.skipped = timezone.now()
-                data_file.save()
-
-
-            if options['skip_encryption'] is False:
-                original_path = data_file.data_file.path
-
-                box = SealedBox(PublicKey(base64.b64decode(settings.PDK_EXTERNAL_CONTENT_PUBLIC_KEY)))
-
-                size = os.path.getsize(data_file.data_file.path)
-
-                if size < 1024 * 1024 * 1024:
-                    with open(data_file.data_file.path, 'rb') as original_file:
-                        encrypted_str = box.encrypt(original_file.read())
+        if options['workers'] > 0:
+            connections.close_all() # Workers must open their own database connections.
 
-                        filename = os.path.basename(data_file.data_file.path) + '.encrypted'
+            workers = []
 
-                        encrypted_file = ContentFile(encrypted_str)
+            for index in range(0, options['workers']): # pylint: disable=unused-variable
+                worker = multiprocessing.Process(target=drain_upload_queue, kwargs={'skip_encryption': options['skip_encryption']})
+                worker.start()
 
-                        data_file.data_file.save(filename, encrypted_file)
+                workers.append(worker)
 
-                    os.remove(original_path)
-                else:
-                    call_command('pdk_external_aes_encrypt_data_file', str(data_file.pk))
+            for worker in workers:
+                worker.join()
+        else:
+            process_next_data_file(upload_worker_identifier(), skip_encryption=options['skip_encryption'])
@@ -0,0 +1,149 @@
+# pylint: disable=no-member,line-too-long
+
+from __future__ import print_function
+
+import os
+import select
+import signal
+import sys
+import time
+import traceback
+
+from django.db import connection
+from django.core.management.base import BaseCommand
+
+from ...models import process_next_data_file, upload_worker_identifier, UPLOAD_NOTIFY_CHANNEL
+
+class Command(BaseCommand):
+    help = 'Long-running worker that processes uploaded data files as they arrive.'
+
+    shutdown_requested = False
+    listening = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skip-encryption',
+                            action='store_true',
+                            dest='skip_encryption',
+                            default=False,
+                            help='Skips default encryption for uploaded files')
+
+        parser.add_argument('--poll-interval',
+                            type=int,
+                            dest='poll_interval',
+                            default=60,
+                            help='Seconds to wait for an upload notification before checking for pending files again')
+
+        parser.add_argument('--max-files',
+                            type=int,
+                            dest='max_files',
+                            default=0,
+                            help='Exit after processing this many files, so a supervisor can start a fresh process (0 for no limit)')
+
+        parser.add_argument('--max-bytes',
+                            type=int,
+                            dest='max_bytes',
+                            default=0,
+                            help='Exit after processing this many bytes of uploaded files (0 for no limit)')
+
+    def request_shutdown(self, signum, frame): # pylint: disable=unused-argument
+        print('Received signal ' + str(signum) + '. Shutting down after the current file...')
+        sys.stdout.flush()
+
+        self.shutdown_requested = True
+
+    def listen(self):
+        if connection.vendor != 'postgresql':
+            return False
+
+        with connection.cursor() as cursor:
+            cursor.execute('LISTEN ' + UPLOAD_NOTIFY_CHANNEL)
+
+        return True
+
+    def wait_for_upload(self, timeout):
+        deadline = time.time() + timeout
+
+        while self.shutdown_requested is False and time.time() < deadline:
+            remaining = min(1.0, deadline - time.time())
+
+            pg_connection = connection.connection
+
+            if self.listening is False or pg_connection is None:
+                time.sleep(max(remaining, 0))
+
+                continue
+
+            readable = select.select([pg_connection], [], [], max(remaining, 0))[0]
+
+            if readable:
+                if hasattr(pg_connection, 'poll'): # psycopg2
+                    pg_connection.poll()
+
+                    del pg_connection.notifies[:]
+                else:
+                    with connection.cursor() as cursor:
+                        cursor.execute('SELECT 1')
+
+                return
+
+    def handle(self, *args, **options): # pylint: disable=too-many-locals, too-many-branches, too-many-statements
+        signal.signal(signal.SIGTERM, self.request_shutdown)
+        signal.signal(signal.SIGINT, self.request_shutdown)
+
+        worker_identifier = upload_worker_identifier()
+
+        self.listening = self.listen()
+
+        files_processed = 0
+        bytes_processed = 0
+
+        print('Upload worker ' + worker_identifier + ' started (listening: ' + str(self.listening) + ').')
+        sys.stdout.flush()
+
+        while self.shutdown_requested is False:
+            try:
+                if self.listening is False:
+                    self.listening = self.listen()
+
+                data_file = process_next_data_file(worker_identifier, skip_encryption=options['skip_encryption'])
+            except Exception: # pylint: disable=broad-except
+                # A failed file stays claimed until its retry delay passes (see defer_claim).
+
+                traceback.print_exc()
+                sys.stdout.flush()
+
+                connection.close_if_unusable_or_obsolete()
+
+                if connection.connection is None: # LISTEN again once a new connection opens.
+                    self.listening = False
+
+                self.wait_for_upload(options['poll_interval'])
+
+                continue
+
+            if data_file is None:
+                self.wait_for_upload(options['poll_interval'])
+
+                continue
+
+            files_processed += 1
+
+            try:
+                bytes_processed += os.path.getsize(data_file.data_file.path)
+            except OSError:
+                pass
+
+            if 0 < options['max_files'] <= files_processed:
+                print('Processed ' + str(files_processed) + ' files. Recycling worker...')
+
+                break
+
+            if 0 < options['max_bytes'] <= bytes_processed:
+                print('Processed ' + str(bytes_processed) + ' bytes. Recycling worker...')
+
+                break
+
+        connection.close()
+
+        print('Upload worker ' + worker_identifier + ' stopped after ' + str(files_processed) + ' files (' + str(bytes_processed) + ' bytes).')
+        sys.stdout.flush()
@@ -0,0 +1,24 @@
+# pylint: skip-file
+# Generated by Django 4.2.21 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passive_data_kit_external_data', '0015_externaldatasource_upload_extension'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='externaldatarequestfile',
+            name='claimed_by',
+            field=models.CharField(blank=True, max_length=1024, null=True),
+        ),
+        migrations.AddField(
+            model_name='externaldatarequestfile',
+            name='claim_expires',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# pylint: skip-file
+# Generated by Django 4.2.21 on 2026-10-18 10:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passive_data_kit_external_data', '0016_externaldatarequestfile_claims'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='externaldatarequestfile',
+            name='content_digest',
+            field=models.CharField(blank=True, db_index=True, max_length=128, null=True),
+        ),
+        migrations.AddField(
+            model_name='externaldatarequestfile',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duplicates', to='passive_data_kit_external_data.externaldatarequestfile'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# pylint: skip-file
+# Generated by Django 4.2.21 on 2026-10-18 10:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passive_data_kit_external_data', '0017_externaldatarequestfile_content_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExternalDataImportCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('member', models.CharField(max_length=4096)),
+                ('records', models.IntegerField(default=0)),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                ('completed', models.DateTimeField(blank=True, null=True)),
+                ('data_file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='passive_data_kit_external_data.externaldatarequestfile')),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# pylint: skip-file
+# Generated by Django 4.2.21 on 2026-10-18 11:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passive_data_kit_external_data', '0018_externaldataimportcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExternalDataEncryptionKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key_id', models.CharField(max_length=64, unique=True)),
+                ('sealed_key', models.TextField(max_length=1024)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('data_file', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='encryption_keys', to='passive_data_kit_external_data.externaldatarequestfile')),
+            ],
+        ),
+    ]
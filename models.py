@@ -4,9 +4,13 @@
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import datetime
 import importlib
+import inspect
 import json
+import os
 import random
+import socket
 import sys
 import traceback
 
@@ -15,11 +19,20 @@ from six import python_2_unicode_compatible
 from django.conf import settings
 from django.contrib.gis.db import models
 from django.core.checks import Warning, register # pylint: disable=redefined-builtin
+from django.core.files.base import ContentFile
 from django.core.mail import send_mail
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils import timezone
 
+from .hooks import external_api_hooks, reset_source_hooks
+from .utils import decrypt_stream, digest_chunks, encrypt_stream, is_stream_encrypted, STREAM_CHUNK_SIZE, STREAM_EXTENSION
+
 
 @register()
 def check_key_pair_settings_defined(app_configs, **kwargs): # pylint: disable=unused-argument
@@ -32,29 +45,47 @@ def check_key_pair_settings_defined(app_configs, **kwargs): # pylint: disable=un
     return errors
 
 def annotate_field(container, field_name=None, field_value=None):
-    for app in settings.INSTALLED_APPS:
-        try:
-            pdk_external_api = importlib.import_module(app + '.pdk_external_api')
+    for app, pdk_annotate_field in external_api_hooks('pdk_annotate_field'): # pylint: disable=unused-variable
+        pdk_annotate_field(container, field_name, field_value)
 
-            pdk_external_api.pdk_annotate_field(container, field_name, field_value)
-        except ImportError:
-            pass
-        except AttributeError:
-            pass
+def annotate_fields(containers, field_name=None, field_values=None):
+    '''
+    Batch annotate_field: annotates containers[i] with field_values[i]. Apps whose
+    pdk_external_api defines pdk_annotate_fields receive the whole batch, the others are
+    called once per field through pdk_annotate_field.
+    '''
+
+    batch_hooks = dict(external_api_hooks('pdk_annotate_fields'))
+
+    for app, pdk_annotate_field in external_api_hooks('pdk_annotate_field'):
+        if app in batch_hooks:
+            batch_hooks.pop(app)(containers, field_name, field_values)
+        else:
+            for container, field_value in zip(containers, field_values):
+                pdk_annotate_field(container, field_name, field_value)
 
+    for pdk_annotate_fields in batch_hooks.values():
+        pdk_annotate_fields(containers, field_name, field_values)
+
+
+def accepts_argument(function, name):
+    try:
+        parameters = inspect.signature(function).parameters
+    except AttributeError: # Python 2
+        spec = inspect.getargspec(function) # pylint: disable=deprecated-method
+
+        return name in spec.args or spec.keywords is not None
+
+    if name in parameters:
+        return True
+
+    return any(parameter.kind == inspect.Parameter.VAR_KEYWORD for parameter in parameters.values())
 
 def fetch_annotation_fields():
     fields = []
 
-    for app in settings.INSTALLED_APPS:
-        try:
-            pdk_external_api = importlib.import_module(app + '.pdk_external_api')
-
-            fields.extend(pdk_external_api.fetch_annotation_fields())
-        except ImportError:
-            pass
-        except AttributeError:
-            pass
+    for app, api_fetch_annotation_fields in external_api_hooks('fetch_annotation_fields'): # pylint: disable=unused-variable
+        fields.extend(api_fetch_annotation_fields())
 
     return fields
 
@@ -62,15 +93,8 @@ def fetch_annotation_fields():
 def fetch_annotations(properties):
     annotations = {}
 
-    for app in settings.INSTALLED_APPS:
-        try:
-            pdk_external_api = importlib.import_module(app + '.pdk_external_api')
-
-            annotations.update(pdk_external_api.fetch_annotations(properties))
-        except ImportError:
-            pass
-        except AttributeError:
-            pass
+    for app, api_fetch_annotations in external_api_hooks('fetch_annotations'): # pylint: disable=unused-variable
+        annotations.update(api_fetch_annotations(properties))
 
     return annotations
 
@@ -234,6 +258,12 @@ class ExternalDataRequestFile(models.Model):
     processed = models.DateTimeField(null=True, blank=True)
     skipped = models.DateTimeField(null=True, blank=True)
 
+    claimed_by = models.CharField(max_length=1024, null=True, blank=True)
+    claim_expires = models.DateTimeField(null=True, blank=True)
+
+    content_digest = models.CharField(max_length=128, null=True, blank=True, db_index=True)
+    duplicate_of = models.ForeignKey('self', related_name='duplicates', null=True, blank=True, on_delete=models.SET_NULL)
+
     def extension(self):
         return self.source.upload_extension
 
@@ -243,6 +273,8 @@ class ExternalDataRequestFile(models.Model):
                 return True
             elif self.data_file.path.endswith('.aes'):
                 return True
+            elif self.data_file.path.endswith(STREAM_EXTENSION):
+                return True
 
         return None
 
@@ -252,6 +284,20 @@ class ExternalDataRequestFile(models.Model):
 
             return False
 
+        if self.content_digest is None:
+            self.update_content_digest()
+
+        original = self.find_original()
+
+        if original is not None:
+            print('Duplicate of ' + str(original.pk) + ': ' + self.data_file.path)
+
+            self.duplicate_of = original
+            self.processed = timezone.now()
+            self.save()
+
+            return True
+
         file_processed = False
 
         for app in settings.INSTALLED_APPS:
@@ -259,7 +305,10 @@ class ExternalDataRequestFile(models.Model):
                 try:
                     pdk_api = importlib.import_module(app + '.pdk_api')
 
-                    file_processed = pdk_api.import_external_data(self.source.identifier, self.request.identifier, self.data_file.path)
+                    if accepts_argument(pdk_api.import_external_data, 'data_file'):
+                        file_processed = pdk_api.import_external_data(self.source.identifier, self.request.identifier, self.data_file.path, data_file=self)
+                    else: # Legacy signature, without import checkpoints.
+                        file_processed = pdk_api.import_external_data(self.source.identifier, self.request.identifier, self.data_file.path)
                 except ImportError:
                     pass
                 except AttributeError:
@@ -274,7 +323,208 @@ class ExternalDataRequestFile(models.Model):
             self.processed = timezone.now()
             self.save()
 
+            self.checkpoints.all().delete()
+
         return file_processed
 
+    def update_content_digest(self):
+        with open(self.data_file.path, 'rb') as data_file:
+            self.content_digest = digest_chunks(iter(lambda: data_file.read(STREAM_CHUNK_SIZE), b''))
+
+        self.save(update_fields=['content_digest'])
+
+    def find_original(self):
+        '''
+        Returns the earliest processed upload with identical content for the same
+        request and source, or None if this upload needs to be imported.
+        '''
+
+        if self.content_digest is None:
+            return None
+
+        originals = ExternalDataRequestFile.objects.filter(request=self.request, source=self.source, content_digest=self.content_digest, duplicate_of=None)
+
+        return originals.exclude(pk=self.pk).exclude(processed=None).order_by('pk').first()
+
+    def encrypt_data_file(self):
+        original_path = self.data_file.path
+
+        storage = self.data_file.storage
+
+        encrypted_name = storage.get_available_name(self.data_file.name + STREAM_EXTENSION)
+
+        with open(original_path, 'rb') as original_file:
+            with storage.open(encrypted_name, 'wb') as encrypted_file:
+                encrypt_stream(original_file, encrypted_file)
+
+        self.data_file.name = encrypted_name
+        self.save()
+
+        os.remove(original_path)
+
+    def decrypt_data_file(self, box):
+        original_path = self.data_file.path
+
+        if original_path.endswith('.aes'):
+            call_command('pdk_external_aes_decrypt_data_file', str(self.pk))
+
+            return
+
+        if is_stream_encrypted(original_path):
+            storage = self.data_file.storage
+
+            decrypted_name = storage.get_available_name(self.data_file.name[:-len(STREAM_EXTENSION)])
+
+            try:
+                with open(original_path, 'rb') as original_file:
+                    with storage.open(decrypted_name, 'wb') as decrypted_file:
+                        decrypt_stream(original_file, decrypted_file, box)
+            except: # pylint: disable=bare-except
+                storage.delete(decrypted_name)
+
+                raise
+
+            self.data_file.name = decrypted_name
+        else:
+            with open(original_path, 'rb') as original_file:
+                cleartext = box.decrypt(original_file.read())
+
+                filename = os.path.basename(original_path).replace('.encrypted', '')
+
+                self.data_file.save(filename, ContentFile(cleartext), save=False)
+
+        os.remove(original_path)
+
+        self.processed = None
+        self.skipped = None
+
+        self.save()
+
+    def release_claim(self):
+        self.claimed_by = None
+        self.claim_expires = None
+
+        self.save(update_fields=['claimed_by', 'claim_expires'])
+
+    def defer_claim(self):
+        '''
+        Keeps the file claimed for PDK_EXTERNAL_UPLOAD_RETRY_DELAY after a failed attempt,
+        so workers move on to other uploads before trying it again.
+        '''
+
+        self.claim_expires = timezone.now() + upload_retry_delay()
+
+        self.save(update_fields=['claim_expires'])
+
     def get_absolute_url(self):
         return reverse('pdk_download_upload', args=[self.pk])
+
+
+class ExternalDataImportCheckpoint(models.Model):
+    data_file = models.ForeignKey(ExternalDataRequestFile, related_name='checkpoints', on_delete=models.CASCADE)
+
+    member = models.CharField(max_length=4096)
+    records = models.IntegerField(default=0)
+
+    started = models.DateTimeField(auto_now_add=True)
+    completed = models.DateTimeField(null=True, blank=True)
+
+
+class ExternalDataEncryptionKey(models.Model):
+    key_id = models.CharField(max_length=64, unique=True)
+    sealed_key = models.TextField(max_length=1024)
+
+    data_file = models.ForeignKey(ExternalDataRequestFile, related_name='encryption_keys', null=True, blank=True, on_delete=models.SET_NULL)
+
+    created = models.DateTimeField(auto_now_add=True)
+
+
+UPLOAD_NOTIFY_CHANNEL = 'pdk_external_upload'
+
+@receiver(post_save, sender=ExternalDataSource)
+@receiver(post_delete, sender=ExternalDataSource)
+def refresh_source_hooks(sender, instance, **kwargs): # pylint: disable=unused-argument
+    reset_source_hooks()
+
+@receiver(post_save, sender=ExternalDataRequestFile)
+def notify_upload_workers(sender, instance, created, **kwargs): # pylint: disable=unused-argument
+    if created is False or connection.vendor != 'postgresql':
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_notify(%s, %s)', [UPLOAD_NOTIFY_CHANNEL, str(instance.pk)])
+
+
+def upload_claim_lease():
+    try:
+        return settings.PDK_EXTERNAL_UPLOAD_CLAIM_LEASE
+    except AttributeError:
+        pass
+
+    return datetime.timedelta(hours=12)
+
+
+def upload_retry_delay():
+    try:
+        return settings.PDK_EXTERNAL_UPLOAD_RETRY_DELAY
+    except AttributeError:
+        pass
+
+    return datetime.timedelta(hours=1)
+
+
+def upload_worker_identifier():
+    return '%s:%s' % (socket.gethostname(), os.getpid())
+
+
+def claim_next_data_file(worker_identifier):
+    '''
+    Claims the oldest pending upload for the worker. Rows locked by other
+    workers are skipped, and claims left behind by workers that died are
+    reclaimed once their lease (PDK_EXTERNAL_UPLOAD_CLAIM_LEASE) expires.
+    '''
+
+    now = timezone.now()
+
+    with transaction.atomic():
+        pending = ExternalDataRequestFile.objects.select_for_update(skip_locked=True).filter(processed=None, skipped=None)
+        pending = pending.filter(Q(claim_expires=None) | Q(claim_expires__lt=now))
+
+        data_file = pending.order_by('pk').first()
+
+        if data_file is not None:
+            data_file.claimed_by = worker_identifier
+            data_file.claim_expires = now + upload_claim_lease()
+
+            data_file.save(update_fields=['claimed_by', 'claim_expires'])
+
+    return data_file
+
+
+def process_next_data_file(worker_identifier, skip_encryption=False):
+    data_file = claim_next_data_file(worker_identifier)
+
+    if data_file is None:
+        return None
+
+    try:
+        print('Processing ' + str(data_file.data_file.path) + ' (' + str(data_file.pk) + ')...')
+        sys.stdout.flush()
+
+        if data_file.process() is False:
+            print('Unable to process ' + str(data_file.data_file.path) + ' (' + str(data_file.pk) + ').')
+            sys.stdout.flush()
+
+            data_file.skipped = timezone.now()
+            data_file.save()
+
+        if skip_encryption is False:
+            data_file.encrypt_data_file()
+    except: # pylint: disable=bare-except
+        data_file.defer_claim()
+
+        raise
+
+    data_file.release_claim()
+
+    return data_file
@@ -6,7 +6,6 @@ import csv
 import importlib
 import io
 import json
-import pkgutil
 import tempfile
 import traceback
 
@@ -21,8 +20,10 @@ from django.utils import timezone
 
 from passive_data_kit.models import DataSourceReference, DataPoint, DataGeneratorDefinition, DataServerApiToken, DataServerAccessRequestPending
 
-from .models import ExternalDataSource, ExternalDataRequest
-from .utils import finish_batch_inserts
+from .field_policies import field_policy_timing
+from .hooks import annotator_hooks, external_api_hooks, generator_importer_hooks, generator_metadata_hooks, memoized_hook_result
+from .models import ExternalDataRequest
+from .utils import BatchWriter, encryption_executor, envelope_encryption, hash_memo
 
 
 CUSTOM_GENERATORS = (
@@ -30,22 +31,56 @@ CUSTOM_GENERATORS = (
     'pdk-external-engagement'
 )
 
-def import_external_data(data_source, request_identifier, path):
+def import_external_data(data_source, request_identifier, path, data_file=None):
     try:
         importer = importlib.import_module('passive_data_kit_external_data.importers.' + data_source)
 
-        succeeded = importer.import_data(request_identifier, path)
+        with envelope_encryption(data_file=data_file), hash_memo() as memo, encryption_executor() as executor, field_policy_timing() as timing:
+            with BatchWriter() as batch_writer:
+                succeeded = importer.import_data(request_identifier, path, data_file=data_file, batch_writer=batch_writer)
 
-        finish_batch_inserts()
+            stats = [batch_writer.summary(), memo.summary()]
+
+            if executor is not None:
+                stats.append(executor.summary())
+
+            if timing.fields:
+                stats.append(timing.summary())
+
+        print('Import stats [' + data_source + ']: ' + '; '.join(stats))
 
         return succeeded
     except ImportError:
         traceback.print_exc()
     except AttributeError:
         pass
+    except TypeError:
+        traceback.print_exc()
 
     return False
 
+def point_annotation_values(properties, annotations):
+    '''
+    Returns the values of the annotations columns for a point: its own properties when it
+    has the summaries stored at import (see store_annotation_summaries), otherwise the
+    fetch_annotations results (points imported before summaries were stored).
+    '''
+
+    if all((key.lower() in properties) for key in annotations):
+        return properties
+
+    annotation_values = {}
+
+    for app, fetch_annotations in external_api_hooks('fetch_annotations'):
+        try:
+            annotation_values.update(fetch_annotations(properties))
+        except TypeError as exception:
+            traceback.print_exc()
+            print('Verify that ' + app + ' implements all external_data_metadata arguments!')
+            raise exception
+
+    return annotation_values
+
 def compile_report(generator, sources, data_start=None, data_end=None, date_type='created'): # pylint: disable=too-many-locals, too-many-branches, too-many-statements, too-many-return-statements
     now = arrow.get()
 
@@ -76,19 +111,12 @@ def compile_report(generator, sources, data_start=None, data_end=None, date_type
 
             annotations = []
 
-            for app in settings.INSTALLED_APPS:
+            for app, fetch_annotation_fields in external_api_hooks('fetch_annotation_fields'):
                 try:
-                    pdk_api = importlib.import_module(app + '.pdk_external_api')
-
-                    try:
-                        annotations.extend(pdk_api.fetch_annotation_fields())
-                    except TypeError as exception:
-                        print('Verify that ' + app + ' implements all external_data_metadata arguments!')
-                        raise exception
-                except ImportError:
-                    pass
-                except AttributeError:
-                    pass
+                    annotations.extend(fetch_annotation_fields())
+                except TypeError as exception:
+                    print('Verify that ' + app + ' implements all external_data_metadata arguments!')
+                    raise exception
 
             columns.extend(annotations)
 
@@ -197,22 +225,7 @@ def compile_report(generator, sources, data_start=None, data_end=None, date_type
                                 columns.append('')
                                 columns.append('')
 
-                            annotation_values = {}
-
-                            for app in settings.INSTALLED_APPS:
-                                try:
-                                    pdk_api = importlib.import_module(app + '.pdk_external_api')
-
-                                    try:
-                                        annotation_values.update(pdk_api.fetch_annotations(point.fetch_properties()))
-                                    except TypeError as exception:
-                                        traceback.print_exc()
-                                        print('Verify that ' + app + ' implements all external_data_metadata arguments!')
-                                        raise exception
-                                except ImportError:
-                                    pass
-                                except AttributeError:
-                                    pass
+                            annotation_values = point_annotation_values(point.fetch_properties(), annotations)
 
                             for key in annotations:
                                 if key.lower() in annotation_values:
@@ -341,23 +354,15 @@ def compile_report(generator, sources, data_start=None, data_end=None, date_type
     return None
 
 def external_data_metadata(point):
-    metadata = None
-
     generator_identifier = point.generator_identifier
 
-    for app in settings.INSTALLED_APPS:
-        for source in ExternalDataSource.objects.all():
-            if metadata is None:
-                try:
-                    importer = importlib.import_module(app + '.importers.' + source.identifier)
+    for app, source, metadata_hook in generator_metadata_hooks(generator_identifier): # pylint: disable=unused-variable
+        metadata = metadata_hook(generator_identifier, point)
 
-                    metadata = importer.external_data_metadata(generator_identifier, point)
-                except ImportError:
-                    pass
-                except AttributeError:
-                    pass
+        if metadata is not None:
+            return metadata
 
-    return metadata
+    return None
 
 def pdk_custom_source_header(source): # pylint: disable=unused-argument
     context = {}
@@ -416,47 +421,32 @@ def visualization(source, generator):
 
     return render_to_string('pdk_generic_viz_template.html', context)
 
-def data_type_category_for_identifier(identifier):
-    for observed in identifier['observed']: # pylint: disable=too-many-nested-blocks
-        if observed.startswith('pdk-external-'):
-            tokens = observed.split('-')
-
-            if len(tokens) > 2:
-                for app in settings.INSTALLED_APPS:
-                    try:
-                        importer = importlib.import_module(app + '.importers.' + tokens[2])
+def observed_data_type_category(observed_identifiers):
+    for observed in observed_identifiers:
+        for app, category_hook in generator_importer_hooks(observed, 'data_type_category'): # pylint: disable=unused-variable
+            try:
+                category = category_hook(observed)
 
-                        name = importer.data_type_category(observed)
-
-                        if name is not None:
-                            return name
-
-                    except ImportError:
-                        pass
-                    except AttributeError:
-                        pass
+                if category is not None:
+                    return category
+            except AttributeError:
+                pass
 
     return None
 
-def data_type_name(definition):
-    for observed in definition['passive-data-metadata.generator-id']['observed']: # pylint: disable=too-many-nested-blocks
-        if observed.startswith('pdk-external-'):
-            tokens = observed.split('-')
-
-            if len(tokens) > 2:
-                for app in settings.INSTALLED_APPS:
-                    try:
-                        importer = importlib.import_module(app + '.importers.' + tokens[2])
-
-                        name = importer.data_type_name(definition)
+def data_type_category_for_identifier(identifier):
+    return memoized_hook_result('data_type_category', tuple(identifier['observed']), lambda: observed_data_type_category(identifier['observed']))
 
-                        if name is not None:
-                            return name
+def definition_data_type_name(definition):
+    for observed in definition['passive-data-metadata.generator-id']['observed']:
+        for app, name_hook in generator_importer_hooks(observed, 'data_type_name'): # pylint: disable=unused-variable
+            try:
+                name = name_hook(definition)
 
-                    except ImportError:
-                        pass
-                    except AttributeError:
-                        pass
+                if name is not None:
+                    return name
+            except AttributeError:
+                pass
 
         if observed.startswith('pdk-external-engagement-'):
             importer = importlib.import_module('passive_data_kit_external_data.importers.engagement')
@@ -468,62 +458,31 @@ def data_type_name(definition):
 
     return None
 
-def data_type_category(definition):
-    for observed in definition['passive-data-metadata.generator-id']['observed']: # pylint: disable=too-many-nested-blocks
-        if observed.startswith('pdk-external-'):
-            tokens = observed.split('-')
-
-            if len(tokens) > 2:
-                for app in settings.INSTALLED_APPS:
-                    try:
-                        importer = importlib.import_module(app + '.importers.' + tokens[2])
+def data_type_name(definition):
+    observed = definition['passive-data-metadata.generator-id']['observed']
 
-                        category = importer.data_type_category(observed)
+    return memoized_hook_result('data_type_name', tuple(observed), lambda: definition_data_type_name(definition))
 
-                        if category is not None:
-                            return category
-                    except ImportError:
-                        pass
-                    except AttributeError:
-                        pass
+def data_type_category(definition):
+    observed = definition['passive-data-metadata.generator-id']['observed']
 
-    return None
+    return memoized_hook_result('data_type_category', tuple(observed), lambda: observed_data_type_category(observed))
 
-def update_data_type_definition(definition, override_existing=False): # pylint: disable=too-many-branches
+def update_data_type_definition(definition, override_existing=False):
     for observed in definition['passive-data-metadata.generator-id']['observed']:
-        if observed.startswith('pdk-external-'):
-            tokens = observed.split('-')
-
-            if len(tokens) > 2:
-                for app in settings.INSTALLED_APPS:
-                    try:
-                        importer = importlib.import_module(app + '.importers.' + tokens[2])
-
-                        importer.update_data_type_definition(definition, override_existing=override_existing)
-                    except ImportError:
-                        pass
-                    except AttributeError:
-                        pass
+        for app, update_hook in generator_importer_hooks(observed, 'update_data_type_definition'): # pylint: disable=unused-variable
+            try:
+                update_hook(definition, override_existing=override_existing)
+            except AttributeError:
+                pass
 
         if observed.startswith('pdk-external-engagement-'):
             importer = importlib.import_module('passive_data_kit_external_data.importers.engagement')
 
             importer.update_data_type_definition(definition, override_existing=override_existing)
 
-    for app in settings.INSTALLED_APPS:
-        try:
-            annotators = importlib.import_module(app + '.annotators')
-
-            prefix = annotators.__name__ + '.'
-
-            for importer, modname, ispkg in pkgutil.iter_modules(annotators.__path__, prefix): # pylint: disable=unused-variable
-                module = __import__(modname, fromlist='dummy')
-
-                module.update_data_type_definition(definition)
-        except ImportError:
-            pass
-        except AttributeError:
-            pass
+    for app, annotator_update in annotator_hooks('update_data_type_definition'): # pylint: disable=unused-variable
+        annotator_update(definition)
 
     # Strip out any remaining encrypted or hashed content
 
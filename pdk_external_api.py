@@ -1,67 +1,28 @@
-import importlib
-import pkgutil
-
-from django.conf import settings
+from .annotation_engine import annotate_texts
+from .hooks import annotator_hooks
 
 def pdk_annotate_field(container, field_name=None, field_value=None, context=None): # pylint: disable=unused-argument
-    for app in settings.INSTALLED_APPS:
-        try:
-            annotators = importlib.import_module(app + '.annotators')
-
-            prefix = annotators.__name__ + '.'
-
-            for importer, modname, ispkg in pkgutil.iter_modules(annotators.__path__, prefix): # pylint: disable=unused-variable
-                module = __import__(modname, fromlist='dummy')
+    container.update(annotate_texts([field_value], field_name)[0])
 
-                annotations = module.annotate(field_value, field_name)
-
-                if annotations is not None:
-                    for key in annotations.keys():
-                        container[key] = annotations[key]
-        except ImportError:
-            pass
-        except AttributeError:
-            pass
+def pdk_annotate_fields(containers, field_name=None, field_values=None):
+    for container, annotations in zip(containers, annotate_texts(field_values, field_name)):
+        container.update(annotations)
 
 def fetch_annotation_fields():
     fields = []
 
-    for app in settings.INSTALLED_APPS:
-        try:
-            annotators = importlib.import_module(app + '.annotators')
-
-            prefix = annotators.__name__ + '.'
-
-            for importer, modname, ispkg in pkgutil.iter_modules(annotators.__path__, prefix): # pylint: disable=unused-variable
-                module = __import__(modname, fromlist='dummy')
-
-                fields.extend(module.fetch_annotation_fields())
-        except ImportError:
-            pass
-        except AttributeError:
-            pass
+    for app, fetch_fields in annotator_hooks('fetch_annotation_fields'): # pylint: disable=unused-variable
+        fields.extend(fetch_fields())
 
     return fields
 
 def fetch_annotations(properties):
     annotations = {}
 
-    for app in settings.INSTALLED_APPS:
-        try:
-            annotators = importlib.import_module(app + '.annotators')
-
-            prefix = annotators.__name__ + '.'
-
-            for importer, modname, ispkg in pkgutil.iter_modules(annotators.__path__, prefix): # pylint: disable=unused-variable
-                module = __import__(modname, fromlist='dummy')
-
-                new_annotations = module.fetch_annotations(properties)
+    for app, annotator_fetch_annotations in annotator_hooks('fetch_annotations'): # pylint: disable=unused-variable
+        new_annotations = annotator_fetch_annotations(properties)
 
-                if new_annotations is not None:
-                    annotations.update(new_annotations)
-        except ImportError:
-            pass
-        except AttributeError:
-            pass
+        if new_annotations is not None:
+            annotations.update(new_annotations)
 
     return annotations
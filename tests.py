@@ -1,6 +1,950 @@
 # -*- coding: utf-8 -*-
+# pylint: disable=line-too-long, no-member
+
 from __future__ import unicode_literals
 
-# from django.test import TestCase
+import base64
+import datetime
+import io
+import json
+import shutil
+import string
+import tempfile
+import time
+import zipfile
+
+try:
+    from unittest import mock
+except ImportError: # Python 2
+    import mock
+
+from nacl.exceptions import CryptoError
+from nacl.public import PrivateKey, SealedBox
+
+from django.core.files.base import ContentFile
+from django.core.signals import request_finished
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from passive_data_kit.models import DataPoint
+
+from . import utils
+from .annotation_engine import AnnotatedText
+from .annotators import pdk_external_length_annotator, pdk_external_word_count
+from .batch_writer import copy_escape, store_annotation_summaries
+from .models import ExternalDataEncryptionKey, ExternalDataRequest, ExternalDataRequestFile, ExternalDataSource, accepts_argument, claim_next_data_file, process_next_data_file
+from .hooks import generator_metadata_hooks, hook_result_memo, memoized_hook_result, reset_source_hooks, SOURCE_HOOKS_TTL
+from .importers import facebook, instagram, snapchat, tumblr, twitter, youtube
+from .pdk_api import point_annotation_values
+from .utils import assert_max_queries, decrypt_content, decrypt_stream, encrypt_content, encrypt_many, encrypt_stream, encryption_executor, envelope_encryption, hash_content, hash_memo, import_bundle, include_data, include_data_range, is_stream_encrypted, queue_batch_insert, BatchWriter, DataWindow, INCLUDE_DATA_WINDOW_TTL, STREAM_EXTENSION
+
+PRIVATE_KEY = PrivateKey.generate()
+
+PUBLIC_KEY = base64.b64encode(bytes(PRIVATE_KEY.public_key)).decode('ascii')
+
+class StubDataPoint(object): # pylint: disable=useless-object-inheritance, too-few-public-methods
+    def __init__(self, properties='{}'):
+        self.properties = properties
+        self.generator_identifier = 'pdk-external-test'
+
+class UploadTestCase(TestCase):
+    '''
+    Creates a request and source, storing uploads in a temporary MEDIA_ROOT.
+    '''
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+
+        self.media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        self.media_settings.enable()
+
+        self.source = ExternalDataSource.objects.create(name='Test Source', identifier='test-source')
+
+        self.request = ExternalDataRequest.objects.create(identifier='test-participant', email='test@example.com', requested=timezone.now())
+        self.request.sources.add(self.source)
+
+    def tearDown(self):
+        self.media_settings.disable()
+
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def create_upload(self, content=b'test upload', name='upload.zip', **kwargs):
+        upload = ExternalDataRequestFile(request=self.request, source=self.source, uploaded=timezone.now(), **kwargs)
+        upload.data_file.save(name, ContentFile(content))
+
+        return upload
+
+class UploadClaimTestCase(UploadTestCase):
+    def test_claims_oldest_upload(self):
+        first = self.create_upload()
+        self.create_upload()
+
+        claimed = claim_next_data_file('worker-1')
+
+        self.assertEqual(claimed.pk, first.pk)
+
+        first.refresh_from_db()
+
+        self.assertEqual(first.claimed_by, 'worker-1')
+        self.assertGreater(first.claim_expires, timezone.now())
+
+    def test_skips_active_lease(self):
+        self.create_upload()
+        second = self.create_upload()
+
+        claim_next_data_file('worker-1')
+
+        self.assertEqual(claim_next_data_file('worker-2').pk, second.pk)
+        self.assertIsNone(claim_next_data_file('worker-3'))
+
+    @override_settings(PDK_EXTERNAL_UPLOAD_CLAIM_LEASE=datetime.timedelta(hours=1))
+    def test_reclaims_expired_lease(self):
+        upload = self.create_upload(claimed_by='stopped-worker', claim_expires=timezone.now() - datetime.timedelta(minutes=1))
+
+        self.assertEqual(claim_next_data_file('worker-1').pk, upload.pk)
+
+        upload.refresh_from_db()
+
+        self.assertEqual(upload.claimed_by, 'worker-1')
+        self.assertLessEqual(upload.claim_expires, timezone.now() + datetime.timedelta(hours=1))
+
+    def test_ignores_finished_uploads(self):
+        self.create_upload(processed=timezone.now())
+        self.create_upload(skipped=timezone.now())
+
+        self.assertIsNone(claim_next_data_file('worker-1'))
+
+    def test_release_claim(self):
+        upload = self.create_upload()
+
+        claim_next_data_file('worker-1').release_claim()
+
+        upload.refresh_from_db()
+
+        self.assertIsNone(upload.claimed_by)
+        self.assertIsNone(upload.claim_expires)
+
+        self.assertEqual(claim_next_data_file('worker-2').pk, upload.pk)
+
+    @override_settings(PDK_EXTERNAL_UPLOAD_RETRY_DELAY=datetime.timedelta(hours=1))
+    def test_defers_failed_upload(self):
+        upload = self.create_upload()
+
+        with mock.patch.object(ExternalDataRequestFile, 'process', side_effect=IOError('Unreadable upload')):
+            with self.assertRaises(IOError):
+                process_next_data_file('worker-1', skip_encryption=True)
+
+        upload.refresh_from_db()
+
+        self.assertEqual(upload.claimed_by, 'worker-1')
+        self.assertGreater(upload.claim_expires, timezone.now() + datetime.timedelta(minutes=59))
+
+        self.assertIsNone(claim_next_data_file('worker-2'))
+
+class UploadDuplicateTestCase(UploadTestCase):
+    def create_processed_upload(self, content):
+        upload = self.create_upload(content=content)
+        upload.update_content_digest()
+
+        upload.processed = timezone.now()
+        upload.save()
+
+        return upload
+
+    def test_skips_duplicate_upload(self):
+        original = self.create_processed_upload(b'bundle content')
+        duplicate = self.create_upload(content=b'bundle content')
+
+        self.assertTrue(duplicate.process())
+
+        duplicate.refresh_from_db()
+
+        self.assertEqual(duplicate.duplicate_of.pk, original.pk)
+        self.assertEqual(duplicate.content_digest, original.content_digest)
+        self.assertIsNotNone(duplicate.processed)
+
+    def test_ignores_pending_original(self):
+        self.create_upload(content=b'bundle content').update_content_digest()
+
+        upload = self.create_upload(content=b'bundle content')
+        upload.update_content_digest()
+
+        self.assertIsNone(upload.find_original())
+
+    def test_ignores_different_content(self):
+        self.create_processed_upload(b'bundle content')
+
+        upload = self.create_upload(content=b'other content')
+        upload.update_content_digest()
+
+        self.assertIsNone(upload.find_original())
+
+    def test_ignores_other_sources(self):
+        self.create_processed_upload(b'bundle content')
+
+        other_source = ExternalDataSource.objects.create(name='Other Source', identifier='other-source')
+
+        upload = self.create_upload(content=b'bundle content')
+        upload.source = other_source
+        upload.update_content_digest()
+
+        self.assertIsNone(upload.find_original())
+
+@override_settings(PDK_EXTERNAL_IMPORT_PROCESSES=1)
+class ImportCheckpointTestCase(UploadTestCase):
+    def setUp(self):
+        super(ImportCheckpointTestCase, self).setUp() # pylint: disable=super-with-arguments
+
+        bundle = io.BytesIO()
+
+        with zipfile.ZipFile(bundle, 'w') as bundle_file:
+            for member in ('first.json', 'second.json', 'third.json'):
+                bundle_file.writestr(member, '[]')
+
+        self.upload = self.create_upload(content=bundle.getvalue())
+
+        self.imported = []
+        self.failing = set()
+
+    def import_member(self, request_identifier, content_bundle, content_file, context): # pylint: disable=unused-argument
+        if content_file in self.failing:
+            raise ValueError('Unable to import ' + content_file)
+
+        self.imported.append(content_file)
+
+    def import_upload(self):
+        with BatchWriter() as batch_writer:
+            return import_bundle(self.request.identifier, self.upload.data_file.path, self.import_member, data_file=self.upload, batch_writer=batch_writer)
+
+    def test_records_checkpoints(self):
+        self.assertTrue(self.import_upload())
+
+        completed = self.upload.checkpoints.exclude(completed=None).values_list('member', flat=True)
+
+        self.assertEqual(sorted(completed), ['first.json', 'second.json', 'third.json'])
+
+    def test_resumes_after_failure(self):
+        self.failing.add('second.json')
+
+        self.assertFalse(self.import_upload())
+        self.assertEqual(self.imported, ['first.json'])
+
+        self.assertEqual(list(self.upload.checkpoints.exclude(completed=None).values_list('member', flat=True)), ['first.json'])
+        self.assertIsNone(self.upload.checkpoints.get(member='second.json').completed)
+
+        self.failing.clear()
+        self.imported = []
+
+        self.assertTrue(self.import_upload())
+        self.assertEqual(self.imported, ['second.json', 'third.json'])
+
+@override_settings(PDK_EXTERNAL_CONTENT_PUBLIC_KEY=PUBLIC_KEY, PDK_EXTERNAL_CONTENT_DISABLE_HASHING=False, PDK_EXTERNAL_CONTENT_DISABLE_ENCRYPTION=False, PDK_EXTERNAL_IMPORT_PROCESSES=1)
+class ImportQueriesTestCase(UploadTestCase):
+    def test_batches_bundle_inserts(self):
+        messages = []
+
+        for index in range(100):
+            messages.append({
+                'To': 'friend-' + str(index),
+                'Media Type': 'TEXT',
+                'Created': '2021-01-01 12:%02d:00 UTC' % (index % 60),
+            })
+
+        bundle = io.BytesIO()
+
+        with zipfile.ZipFile(bundle, 'w') as bundle_file:
+            bundle_file.writestr('json/chat_history.json', json.dumps({'Sent Chat History': messages}))
+
+        upload = self.create_upload(content=bundle.getvalue())
+
+        # 200 points (messages and engagement events): one query per record would exceed this.
+
+        with assert_max_queries(20):
+            with BatchWriter(max_rows=1000, max_bytes=0):
+                self.assertTrue(snapchat.import_data(self.request.identifier, upload.data_file.path))
+
+        self.assertEqual(DataPoint.objects.filter(generator_identifier='pdk-external-snapchat-chat-sent').count(), 100)
+        self.assertEqual(DataPoint.objects.filter(generator_identifier='pdk-external-engagement-snapchat').count(), 100)
+
+class DataWindowTestCase(SimpleTestCase):
+    def setUp(self):
+        self.window_function = mock.Mock(return_value=[(datetime.datetime(2021, 1, 1), datetime.datetime(2021, 1, 31))])
+
+    def test_filters_outside_window(self):
+        with override_settings(PASSIVE_DATA_KIT_EXTERNAL_INCLUDE_DATA_WINDOW_FUNCTION=self.window_function):
+            self.assertTrue(include_data('request', datetime.datetime(2021, 1, 15), {}))
+            self.assertFalse(include_data('request', datetime.datetime(2021, 2, 15), {}))
+
+            self.assertTrue(include_data_range('request', datetime.datetime(2020, 12, 1), datetime.datetime(2021, 1, 2)))
+            self.assertFalse(include_data_range('request', datetime.datetime(2021, 2, 1), datetime.datetime(2021, 2, 28)))
+
+        self.window_function.assert_called_once_with('request')
+
+    @mock.patch('passive_data_kit_external_data.utils.time')
+    def test_refreshes_expired_windows(self, mock_time):
+        mock_time.time.return_value = 1000.0
+
+        with override_settings(PASSIVE_DATA_KIT_EXTERNAL_INCLUDE_DATA_WINDOW_FUNCTION=self.window_function):
+            include_data('request', datetime.datetime(2021, 1, 15), {})
+            include_data('other', datetime.datetime(2021, 1, 15), {})
+
+            mock_time.time.return_value = 1000.0 + INCLUDE_DATA_WINDOW_TTL
+
+            include_data('request', datetime.datetime(2021, 1, 15), {})
+
+            self.assertEqual(self.window_function.call_count, 2)
+
+            mock_time.time.return_value = 1001.0 + INCLUDE_DATA_WINDOW_TTL
+
+            include_data('request', datetime.datetime(2021, 1, 15), {})
+
+        self.assertEqual([call[0][0] for call in self.window_function.call_args_list], ['request', 'other', 'request'])
+
+    def test_open_intervals(self):
+        window = DataWindow([(None, datetime.datetime(2021, 1, 1)), (datetime.datetime(2021, 6, 1), None)])
+
+        self.assertTrue(window.includes(datetime.datetime(2000, 1, 1)))
+        self.assertFalse(window.includes(datetime.datetime(2021, 3, 1)))
+        self.assertTrue(window.includes(datetime.datetime(2030, 1, 1)))
+
+class SourceHooksTestCase(TestCase):
+    def setUp(self):
+        reset_source_hooks()
+
+    def tearDown(self):
+        reset_source_hooks()
+
+    @mock.patch('passive_data_kit_external_data.hooks.time')
+    def test_finds_new_sources(self, mock_time):
+        mock_time.time.return_value = 1000.0
+
+        self.assertEqual(generator_metadata_hooks('pdk-external-snapchat-chat-sent'), [])
+
+        # bulk_create sends no post_save, as when another process adds the source.
+
+        ExternalDataSource.objects.bulk_create([ExternalDataSource(name='Snapchat', identifier='snapchat')])
+
+        mock_time.time.return_value = 1001.0
+
+        self.assertEqual(generator_metadata_hooks('pdk-external-snapchat-chat-sent'), [])
+
+        mock_time.time.return_value = 1001.0 + SOURCE_HOOKS_TTL
+
+        self.assertEqual([hook[1] for hook in generator_metadata_hooks('pdk-external-snapchat-chat-sent')], ['snapchat'])
+
+    def test_resets_on_source_change(self):
+        self.assertEqual(generator_metadata_hooks('pdk-external-snapchat-chat-sent'), [])
+
+        ExternalDataSource.objects.create(name='Snapchat', identifier='snapchat')
+
+        self.assertEqual([hook[1] for hook in generator_metadata_hooks('pdk-external-snapchat-chat-sent')], ['snapchat'])
+
+class AcceptsArgumentTestCase(SimpleTestCase):
+    def test_named_argument(self):
+        def import_external_data(source_identifier, identifier, path, data_file=None): # pylint: disable=unused-argument
+            pass
+
+        self.assertTrue(accepts_argument(import_external_data, 'data_file'))
+
+    def test_keyword_arguments(self):
+        def import_external_data(source_identifier, identifier, path, **kwargs): # pylint: disable=unused-argument
+            pass
+
+        self.assertTrue(accepts_argument(import_external_data, 'data_file'))
+
+    def test_missing_argument(self):
+        def import_external_data(source_identifier, identifier, path): # pylint: disable=unused-argument
+            pass
+
+        self.assertFalse(accepts_argument(import_external_data, 'data_file'))
+
+@mock.patch('passive_data_kit_external_data.batch_writer.insert_data_points')
+class BatchWriterTestCase(SimpleTestCase):
+    def test_writes_full_batches(self, insert_data_points):
+        with BatchWriter(max_rows=2, max_bytes=0) as batch_writer:
+            for index in range(5): # pylint: disable=unused-variable
+                queue_batch_insert(StubDataPoint())
+
+            self.assertEqual([len(call[0][0]) for call in insert_data_points.call_args_list], [2, 2])
+
+        self.assertEqual([len(call[0][0]) for call in insert_data_points.call_args_list], [2, 2, 1])
+        self.assertEqual(batch_writer.records, 5)
+
+    def test_writes_at_byte_limit(self, insert_data_points):
+        with BatchWriter(max_rows=100, max_bytes=10):
+            queue_batch_insert(StubDataPoint('123456'))
+
+            insert_data_points.assert_not_called()
+
+            queue_batch_insert(StubDataPoint('123456'))
+
+            self.assertEqual(insert_data_points.call_count, 1)
+
+    @mock.patch('passive_data_kit_external_data.batch_writer.data_point_size')
+    def test_skips_sizing_by_default(self, data_point_size, insert_data_points):
+        with BatchWriter(max_rows=2):
+            for index in range(3): # pylint: disable=unused-variable
+                queue_batch_insert(StubDataPoint())
+
+        data_point_size.assert_not_called()
+
+        self.assertEqual(insert_data_points.call_count, 2)
+
+    def test_raises_write_errors(self, insert_data_points):
+        insert_data_points.side_effect = ValueError('Unable to write batch')
+
+        with self.assertRaises(ValueError):
+            with BatchWriter(max_rows=2, max_bytes=0):
+                queue_batch_insert(StubDataPoint())
+                queue_batch_insert(StubDataPoint())
+
+        self.assertEqual(insert_data_points.call_count, 1)
+
+    def test_discards_after_error(self, insert_data_points):
+        with self.assertRaises(ValueError):
+            with BatchWriter(max_rows=100, max_bytes=0) as batch_writer:
+                queue_batch_insert(StubDataPoint())
+
+                raise ValueError('Import failed')
+
+        insert_data_points.assert_not_called()
+
+        self.assertEqual(batch_writer.pending, [])
+
+    def test_raises_async_errors(self, insert_data_points):
+        insert_data_points.side_effect = ValueError('Unable to write batch')
+
+        with self.assertRaises(ValueError):
+            with BatchWriter(max_rows=1, max_bytes=0, asynchronous=True) as batch_writer:
+                queue_batch_insert(StubDataPoint())
+
+                with self.assertRaises(ValueError):
+                    batch_writer.drain()
+
+                for index in range(3): # pylint: disable=unused-variable
+                    try:
+                        queue_batch_insert(StubDataPoint())
+                    except ValueError:
+                        pass
+
+        self.assertEqual(insert_data_points.call_count, 1)
+        self.assertIsNone(batch_writer.writer_thread)
+
+    def test_writes_async_batches(self, insert_data_points):
+        with BatchWriter(max_rows=2, max_bytes=0, asynchronous=True, queue_size=1):
+            for index in range(5): # pylint: disable=unused-variable
+                queue_batch_insert(StubDataPoint())
+
+        self.assertEqual([len(call[0][0]) for call in insert_data_points.call_args_list], [2, 2, 1])
+
+    @override_settings(PDK_EXTERNAL_BATCH_TARGET_SECONDS=1.0, PDK_EXTERNAL_BATCH_ROWS_BOUNDS=(2, 8))
+    def test_adjusts_batch_rows(self, insert_data_points):
+        insert_data_points.side_effect = lambda data_points, method=None: time.sleep(0.01)
+
+        with BatchWriter(max_rows=4, max_bytes=0, asynchronous=True) as batch_writer:
+            for index in range(8): # pylint: disable=unused-variable
+                queue_batch_insert(StubDataPoint())
+
+        self.assertEqual(batch_writer.stats['batches'], insert_data_points.call_count)
+        self.assertEqual(batch_writer.stats['rows'], 8)
+        self.assertEqual(batch_writer.max_rows, 8) # Fast writes grow batches to the upper bound.
+        self.assertEqual(batch_writer.stats['final_max_rows'], 8)
+
+    def test_collects_points(self, insert_data_points):
+        with BatchWriter(max_rows=1, collect=True) as batch_writer:
+            queue_batch_insert(StubDataPoint())
+            queue_batch_insert(StubDataPoint())
+
+            self.assertEqual(len(batch_writer.take()), 2)
+
+        insert_data_points.assert_not_called()
+
+    @mock.patch('passive_data_kit_external_data.batch_writer.store_annotation_summaries')
+    def test_skips_worker_summaries(self, store_summaries, insert_data_points): # pylint: disable=unused-argument
+        data_point = StubDataPoint()
+
+        with BatchWriter(collect=True) as worker_writer:
+            queue_batch_insert(data_point)
+
+        with BatchWriter(max_rows=100, max_bytes=0) as batch_writer:
+            for point in worker_writer.take():
+                batch_writer.queue(point, summarize=False)
+
+        store_summaries.assert_called_once_with(data_point)
+
+def annotated(content, field_name):
+    annotations = pdk_external_length_annotator.annotate(content, field_name)
+    annotations.update(pdk_external_word_count.annotate(content, field_name))
+
+    return annotations
+
+class AnnotationSummaryTestCase(SimpleTestCase):
+    def nested_properties(self):
+        properties = {
+            'messages': [annotated('Hello there, world!', 'content'), annotated('A much longer message with several more words', 'content')],
+            'title': annotated('Short', 'title'),
+            'pdk_length_url': 500, # URL lengths are not summarized.
+        }
+
+        properties['messages'][0]['pdk_encrypted_content'] = 'encryption-disabled:Hello there, world!'
+
+        return properties
+
+    def test_reads_legacy_summaries(self):
+        properties = self.nested_properties()
+
+        self.assertEqual(point_annotation_values(properties, ['pdk_length', 'pdk_word_count']), {'pdk_length': 45, 'pdk_word_count': 8})
+
+    def test_stores_fetched_summaries(self):
+        properties = self.nested_properties()
+
+        expected = point_annotation_values(self.nested_properties(), ['pdk_length', 'pdk_word_count'])
+
+        store_annotation_summaries(StubDataPoint(properties))
+
+        self.assertEqual((properties['pdk_length'], properties['pdk_word_count']), (expected['pdk_length'], expected['pdk_word_count']))
+
+        with mock.patch('passive_data_kit_external_data.pdk_api.external_api_hooks') as external_api_hooks:
+            values = point_annotation_values(properties, ['pdk_length', 'pdk_word_count'])
+
+        external_api_hooks.assert_not_called()
+
+        self.assertEqual((values['pdk_length'], values['pdk_word_count']), (45, 8))
+
+    def test_skips_engagement_events(self):
+        data_point = StubDataPoint(self.nested_properties())
+        data_point.generator_identifier = 'pdk-external-engagement-test'
+
+        store_annotation_summaries(data_point)
+
+        self.assertFalse('pdk_length' in data_point.properties)
+
+def legacy_word_count(content):
+    # The word count annotator before the annotation engine.
+
+    content_nopunc = ''.join(ch for ch in content if ch not in set(string.punctuation))
+
+    while '  ' in content_nopunc:
+        content_nopunc = content_nopunc.replace('  ', ' ')
+
+    return len(content_nopunc.strip().split(' '))
+
+class AnnotatedTextTestCase(SimpleTestCase):
+    WORD_COUNTS = (
+        ('', 1), # Empty content counts as one word.
+        ('   ', 1),
+        ('?!...', 1),
+        (' - , - ', 1),
+        ('hello', 1),
+        ('  hello    world  ', 2),
+        ('hello - world', 2),
+        ("don't stop", 2),
+        ('one\ntwo', 1), # Only spaces separate words.
+        ('one \n two', 3),
+        ('\n\n', 1),
+        ('\tindented line\n', 2),
+        ('ünïcödé wörds', 2),
+    )
+
+    def word_count(self, content):
+        return pdk_external_word_count.annotate(content, 'content')['pdk_word_count_content']
+
+    def test_counts_edge_cases(self):
+        for content, count in self.WORD_COUNTS:
+            self.assertEqual(self.word_count(content), count, repr(content))
+
+    def test_matches_legacy_counts(self):
+        for content, count in self.WORD_COUNTS: # pylint: disable=unused-variable
+            self.assertEqual(self.word_count(content), legacy_word_count(content), repr(content))
+
+    def test_shares_words(self):
+        text = AnnotatedText('Hello, there world!')
+
+        self.assertIs(text.words, text.words)
+        self.assertEqual(text.words, ['Hello', 'there', 'world'])
+
+class CopyInsertTestCase(TestCase):
+    def test_escapes_copy_values(self):
+        self.assertEqual(copy_escape('tab\there\nnew\\line\r'), 'tab\\there\\nnew\\\\line\\r')
+
+    def test_inserts_with_copy(self):
+        created = timezone.now()
+
+        contents = ['plain', 'tab\tand\nnewline', 'back\\slash', 'unicode ✓ \U0001f389']
+
+        data_points = [DataPoint.objects.create_data_point('pdk-external-copy-test', 'copy-test', {'content': content}, user_agent='Passive Data Kit External Test', created=created, skip_save=True, skip_extract_secondary_identifier=True) for content in contents]
+
+        utils.insert_data_points(data_points, method='copy')
+
+        stored = DataPoint.objects.filter(generator_identifier='pdk-external-copy-test').order_by('pk')
+
+        self.assertEqual([point.fetch_properties()['content'] for point in stored], contents)
+
+@override_settings(PDK_EXTERNAL_CONTENT_PUBLIC_KEY=PUBLIC_KEY, PDK_EXTERNAL_CONTENT_DISABLE_HASHING=False)
+class HashMemoTestCase(SimpleTestCase):
+    def test_matches_unmemoized_hashes(self):
+        expected = [hash_content(value) for value in ('first', 'second', 'first')]
+
+        with hash_memo() as memo:
+            self.assertEqual([hash_content(value) for value in ('first', 'second', 'first')], expected)
+
+        self.assertEqual((memo.hits, memo.misses), (1, 2))
+
+    def test_evicts_least_recent(self):
+        with hash_memo(size=2) as memo:
+            hash_content('first')
+            hash_content('second')
+            hash_content('first')
+            hash_content('third')
+
+            self.assertEqual(list(memo.entries.keys()), ['first', 'third'])
+
+        self.assertEqual(len(memo.entries), 0)
+
+@override_settings(PDK_EXTERNAL_HOOK_RESULT_MEMO_SIZE=2)
+class HookResultMemoTestCase(SimpleTestCase):
+    def setUp(self):
+        request_finished.send(sender=self.__class__)
+
+    def test_evicts_least_recent(self):
+        compute = mock.Mock(side_effect=lambda: compute.call_count)
+
+        for key in ('first', 'second', 'first', 'third', 'first', 'second'):
+            memoized_hook_result('data_type_name', key, compute)
+
+        self.assertEqual(compute.call_count, 4)
+        self.assertEqual(list(hook_result_memo().results.keys()), [('data_type_name', 'first'), ('data_type_name', 'second')])
+
+    def test_resets_after_request(self):
+        compute = mock.Mock(return_value='Name')
+
+        memoized_hook_result('data_type_name', 'first', compute)
+        memoized_hook_result('data_type_name', 'first', compute)
+
+        request_finished.send(sender=self.__class__)
+
+        self.assertEqual(memoized_hook_result('data_type_name', 'first', compute), 'Name')
+        self.assertEqual(compute.call_count, 2)
+
+def annotate_lengths(containers, field_name=None, field_values=None):
+    for container, field_value in zip(containers, field_values):
+        container['pdk_length_' + field_name] = len(field_value)
+
+@override_settings(PDK_EXTERNAL_CONTENT_PUBLIC_KEY=PUBLIC_KEY, PDK_EXTERNAL_CONTENT_DISABLE_HASHING=False, PDK_EXTERNAL_CONTENT_DISABLE_ENCRYPTION=True)
+class FieldPolicyTestCase(SimpleTestCase):
+    '''
+    Checks that importers converted to field policies queue the same properties (and
+    annotate the same containers) as their former hand-coded versions.
+    '''
+
+    def import_points(self, importer, function, *args):
+        with mock.patch.object(importer, 'DataPoint') as data_point, mock.patch.object(importer, 'queue_batch_insert'), mock.patch.object(importer, 'create_engagement_event') as create_engagement_event, mock.patch.object(importer, 'include_data', return_value=True):
+            with mock.patch('passive_data_kit_external_data.field_policies.annotate_fields', side_effect=annotate_lengths):
+                getattr(importer, function)('test-request', *args)
+
+        points = [(call[0][0], call[0][2]) for call in data_point.objects.create_data_point.call_args_list]
+        events = [call[1] for call in create_engagement_event.call_args_list]
+
+        return points, events
+
+    def test_snapchat_chat_history(self):
+        chat_history = {
+            'Received Chat History': [{'From': 'alice', 'Media Type': 'TEXT', 'Created': '2021-01-01 12:00:00 UTC'}],
+        }
+
+        points, events = self.import_points(snapchat, 'process_chat_history', json.dumps(chat_history))
+
+        self.assertEqual(points, [('pdk-external-snapchat-chat-received', {
+            'pdk_hashed_from': hash_content('alice'),
+            'pdk_encrypted_from': 'encryption-disabled:alice',
+            'pdk_length_from': 5,
+            'media_type': 'TEXT',
+            'created': '2021-01-01 12:00:00 UTC',
+        })])
+
+        self.assertEqual(events[0]['incoming_engagement'], 1.0)
+
+    def test_facebook_viewed_entries(self):
+        viewed = {
+            'viewed_things': [{
+                'name': 'Facebook Watch Videos and Shows',
+                'children': [{
+                    'name': 'Time Viewed',
+                    'entries': [{'timestamp': 1500000000, 'data': {'uri': 'https://example.com/show', 'name': 'A Show', 'watch_position_seconds': 42}}],
+                }],
+            }],
+        }
+
+        points, events = self.import_points(facebook, 'process_viewed', json.dumps(viewed))
+
+        # Fields are encrypted inside "data", but the name is annotated on the entry.
+
+        self.assertEqual(points, [('pdk-external-facebook-watch', {
+            'timestamp': 1500000000,
+            'data': {
+                'pdk_encrypted_uri': 'encryption-disabled:https://example.com/show',
+                'pdk_hashed_uri': hash_content('https://example.com/show'),
+                'pdk_encrypted_name': 'encryption-disabled:A Show',
+                'pdk_hashed_name': hash_content('A Show'),
+                'watch_position_seconds': 42,
+            },
+            'pdk_length_name': 6,
+        })])
+
+        self.assertEqual((events[0]['engagement_type'], events[0]['duration']), ('video', 42))
+
+    def test_facebook_search_history(self):
+        searches = {
+            'searches': [{'timestamp': 1500000000, 'attachments': [{'data': [{'text': 'cats'}, {'text': 'dogs'}]}]}],
+        }
+
+        points, events = self.import_points(facebook, 'process_search_history', json.dumps(searches))
+
+        self.assertEqual(points, [
+            ('pdk-external-facebook-search', {'pdk_encrypted_query': 'encryption-disabled:cats', 'pdk_length_query': 4}),
+            ('pdk-external-facebook-search', {'pdk_encrypted_query': 'encryption-disabled:dogs', 'pdk_length_query': 4}),
+        ])
+
+        self.assertEqual(len(events), 2)
+
+    def test_tumblr_ads_served(self):
+        ads_served = [{'serve_time': '2021-01-01T12:00:00', 'placement_id': 'placement', 'viewed': True, 'interacted': False}]
+
+        points, events = self.import_points(tumblr, 'process_gemini_analytics', ads_served) # pylint: disable=unused-variable
+
+        self.assertEqual(points, [('pdk-external-tumblr-ads-served', {
+            'pdk_hashed_placement_id': hash_content('placement'),
+            'pdk_encrypted_placement_id': 'encryption-disabled:placement',
+            'serve_time': '2021-01-01T12:00:00',
+            'viewed': True,
+            'interacted': False,
+        })])
+
+    def test_twitter_direct_messages(self):
+        conversations = [{
+            'dmConversation': {
+                'conversationId': '100-200',
+                'messages': [
+                    {'messageCreate': {'recipientId': '200', 'senderId': '100', 'text': 'hello', 'id': '1', 'createdAt': '2021-01-01T12:00:00.000Z', 'mediaUrls': []}},
+                    {'reactionCreate': {'senderId': '200', 'eventId': '1', 'reactionKey': 'like', 'createdAt': '2021-01-01T12:01:00.000Z'}},
+                ],
+            },
+        }]
+
+        points, events = self.import_points(twitter, 'process_direct_messages', 'window.YTD.direct_messages.part0 = ' + json.dumps(conversations))
+
+        self.assertEqual(points, [('pdk-external-twitter-direct-message', {
+            'pdk_hashed_recipientId': hash_content('200'),
+            'pdk_encrypted_recipientId': 'encryption-disabled:200',
+            'pdk_hashed_senderId': hash_content('100'),
+            'pdk_encrypted_senderId': 'encryption-disabled:100',
+            'pdk_encrypted_text': 'encryption-disabled:hello',
+            'pdk_length_text': 5,
+            'id': '1',
+            'conversationId': '100-200',
+            'createdAt': '2021-01-01T12:00:00.000Z',
+        }), ('pdk-external-twitter-direct-message-reaction', {
+            'pdk_hashed_senderId': hash_content('200'),
+            'pdk_encrypted_senderId': 'encryption-disabled:200',
+            'eventId': '1',
+            'reactionKey': 'like',
+            'createdAt': '2021-01-01T12:01:00.000Z',
+        })])
+
+        self.assertEqual([event.get('outgoing_engagement') for event in events], [1.0, None])
+
+    def test_youtube_likes(self):
+        likes = [{'snippet': {'publishedAt': '2021-01-01T12:00:00Z', 'title': 'A Video'}, 'contentDetails': {'videoId': 'video'}}]
+
+        points, events = self.import_points(youtube, 'process_likes', json.dumps(likes)) # pylint: disable=unused-variable
+
+        self.assertEqual(points, [('pdk-external-youtube-like', {
+            'pdk_encrypted_title': 'encryption-disabled:A Video',
+            'pdk_length_title': 7,
+            'pdk_encrypted_snippet': 'encryption-disabled:' + json.dumps(likes[0]['snippet'], indent=2),
+            'pdk_encrypted_contentDetails': 'encryption-disabled:' + json.dumps(likes[0]['contentDetails'], indent=2),
+        })])
+
+    def test_instagram_comments(self):
+        comments = {
+            'comments_media_comments': [{'title': 'alice', 'string_list_data': [{'value': 'Nice photo', 'timestamp': 1500000000}, {'value': 'Again', 'timestamp': 1500000001}]}],
+        }
+
+        points, events = self.import_points(instagram, 'process_post_comments', json.dumps(comments))
+
+        # Every item is protected, not only the first (which dates the comment).
+
+        self.assertEqual(points, [('pdk-external-instagram-comment-posted', {
+            'encrypted_title': 'encryption-disabled:alice',
+            'string_list_data': [
+                {'encrypted_value': 'encryption-disabled:Nice photo', 'pdk_length_value': 10, 'timestamp': 1500000000},
+                {'encrypted_value': 'encryption-disabled:Again', 'pdk_length_value': 5, 'timestamp': 1500000001},
+            ],
+        })])
+
+        self.assertEqual(events[0]['engagement_type'], 'comment')
+
+    def test_instagram_comment_likes(self):
+        likes = {
+            'likes_comment_likes': [
+                {'title': 'alice', 'string_list_data': [{'href': 'https://www.instagram.com/p/1/', 'timestamp': 1500000000}, {'href': 'https://www.instagram.com/p/2/', 'timestamp': 1500000001}]},
+                {'title': 'bob', 'string_map_data': {'href': 'https://www.instagram.com/p/3/', 'timestamp': 1500000002}},
+            ],
+        }
+
+        points, events = self.import_points(instagram, 'process_liked_comments', json.dumps(likes))
+
+        self.assertEqual(points, [
+            ('pdk-external-instagram-comment-like', {
+                'encrypted_title': 'encryption-disabled:alice',
+                'string_list_data': [
+                    {'encrypted_href': 'encryption-disabled:https://www.instagram.com/p/1/', 'timestamp': 1500000000},
+                    {'encrypted_href': 'encryption-disabled:https://www.instagram.com/p/2/', 'timestamp': 1500000001},
+                ],
+            }),
+            ('pdk-external-instagram-comment-like', {
+                'encrypted_title': 'encryption-disabled:bob',
+                'string_map_data': {'encrypted_href': 'encryption-disabled:https://www.instagram.com/p/3/', 'timestamp': 1500000002},
+            }),
+        ])
+
+        self.assertEqual([event['outgoing_engagement'] for event in events], [0.5, 0.5])
+
+@override_settings(PDK_EXTERNAL_CONTENT_PUBLIC_KEY=PUBLIC_KEY, PDK_EXTERNAL_CONTENT_DISABLE_ENCRYPTION=False)
+class EncryptionExecutorTestCase(SimpleTestCase):
+    def test_resolves_placeholders(self):
+        with encryption_executor(processes=2, chunk_size=2) as executor:
+            points = [StubDataPoint({'field': encrypt_content(b'first'), 'items': [encrypt_content(b'second')]}), StubDataPoint({'field': encrypt_content(b'third')})]
+
+            executor.resolve_data_points(points)
+
+            self.assertEqual(executor.ciphertexts, {})
+
+        box = SealedBox(PRIVATE_KEY)
+
+        self.assertEqual(box.decrypt(base64.b64decode(points[0].properties['field'])), b'first')
+        self.assertEqual(box.decrypt(base64.b64decode(points[0].properties['items'][0])), b'second')
+        self.assertEqual(box.decrypt(base64.b64decode(points[1].properties['field'])), b'third')
+
+    def test_drops_discarded_points(self):
+        with encryption_executor(processes=2, chunk_size=2) as executor:
+            discarded = StubDataPoint({'field': encrypt_content(b'first')})
+            kept = StubDataPoint({'field': encrypt_content(b'second'), 'other': encrypt_content(b'third')})
+
+            executor.discard_data_points([discarded])
+            executor.resolve_data_points([kept])
+
+            self.assertEqual(executor.ciphertexts, {})
+            self.assertEqual(executor.discarded, set())
+
+    def test_ignores_lookalike_values(self):
+        with encryption_executor(processes=2) as executor:
+            point = StubDataPoint({'field': 'pdk-pending-encryption:0'})
+
+            executor.resolve_data_points([point])
+
+        self.assertEqual(point.properties['field'], 'pdk-pending-encryption:0')
+
+@override_settings(PDK_EXTERNAL_CONTENT_PUBLIC_KEY=PUBLIC_KEY)
+class SecretStreamTestCase(SimpleTestCase):
+    def encrypt(self, cleartext, chunk_size=16):
+        encrypted = io.BytesIO()
+
+        encrypt_stream(io.BytesIO(cleartext), encrypted, chunk_size=chunk_size)
+
+        return encrypted.getvalue()
+
+    def decrypt(self, ciphertext):
+        decrypted = io.BytesIO()
+
+        decrypt_stream(io.BytesIO(ciphertext), decrypted, SealedBox(PRIVATE_KEY))
+
+        return decrypted.getvalue()
+
+    def test_round_trip(self):
+        for cleartext in (b'', b'short', b'x' * 16, b'y' * 100):
+            self.assertEqual(self.decrypt(self.encrypt(cleartext)), cleartext)
+
+    def test_detects_missing_chunk(self):
+        ciphertext = self.encrypt(b'z' * 100)
+
+        # The last chunk holds the 4 remaining bytes and its 17-byte authentication tag.
+
+        with self.assertRaises(CryptoError):
+            self.decrypt(ciphertext[:-21])
+
+    def test_detects_truncated_chunk(self):
+        with self.assertRaises(CryptoError):
+            self.decrypt(self.encrypt(b'z' * 100)[:-5])
+
+    def test_detects_trailing_content(self):
+        with self.assertRaises(CryptoError):
+            self.decrypt(self.encrypt(b'z' * 100) + b'extra')
+
+    def test_rejects_other_formats(self):
+        with self.assertRaises(CryptoError):
+            self.decrypt(SealedBox(PRIVATE_KEY.public_key).encrypt(b'sealed box'))
+
+@override_settings(PDK_EXTERNAL_CONTENT_PUBLIC_KEY=PUBLIC_KEY)
+@override_settings(PDK_EXTERNAL_CONTENT_PUBLIC_KEY=PUBLIC_KEY, PDK_EXTERNAL_CONTENT_DISABLE_ENCRYPTION=False, PDK_EXTERNAL_CONTENT_ENVELOPE_ENCRYPTION=True)
+class EnvelopeEncryptionTestCase(TestCase):
+    def encrypt_fields(self):
+        with envelope_encryption():
+            ciphertexts = [encrypt_content('first'.encode('utf-8'))] + encrypt_many(['second'.encode('utf-8'), 'ünïcödé'.encode('utf-8')])
+
+        key_id = ExternalDataEncryptionKey.objects.get().key_id # Stored sealed when the block starts.
+
+        for ciphertext in ciphertexts:
+            self.assertTrue(ciphertext.startswith('envelope:' + key_id + ':'))
+
+        return key_id, ciphertexts
+
+    def test_decrypts_with_stored_keys(self):
+        key_id, ciphertexts = self.encrypt_fields() # pylint: disable=unused-variable
+
+        private_box = SealedBox(PRIVATE_KEY)
+
+        self.assertEqual([decrypt_content(ciphertext, private_box).decode('utf-8') for ciphertext in ciphertexts], ['first', 'second', 'ünïcödé'])
+
+        # Outside the block, fields are sealed to the public key again.
+
+        self.assertEqual(decrypt_content(encrypt_content(b'plain'), private_box), b'plain')
+
+    def test_decrypts_with_sealed_keys(self):
+        key_id, ciphertexts = self.encrypt_fields()
+
+        sealed_keys = {key_id: ExternalDataEncryptionKey.objects.get(key_id=key_id).sealed_key}
+
+        ExternalDataEncryptionKey.objects.all().delete()
+
+        private_box = SealedBox(PRIVATE_KEY)
+
+        self.assertEqual([decrypt_content(ciphertext, private_box, sealed_keys=sealed_keys).decode('utf-8') for ciphertext in ciphertexts], ['first', 'second', 'ünïcödé'])
+
+        with self.assertRaises(ExternalDataEncryptionKey.DoesNotExist):
+            decrypt_content(ciphertexts[0], private_box)
+
+    def test_rejects_other_private_key(self):
+        key_id, ciphertexts = self.encrypt_fields() # pylint: disable=unused-variable
+
+        with self.assertRaises(CryptoError):
+            decrypt_content(ciphertexts[0], SealedBox(PrivateKey.generate()))
+
+class UploadEncryptionTestCase(UploadTestCase):
+    def test_encrypt_and_decrypt_upload(self):
+        upload = self.create_upload(content=b'bundle content' * 1000)
+
+        original_name = upload.data_file.name
+
+        upload.encrypt_data_file()
+
+        self.assertTrue(upload.data_file.name.endswith(STREAM_EXTENSION))
+        self.assertTrue(is_stream_encrypted(upload.data_file.path))
+        self.assertTrue(upload.encrypted())
+
+        upload.decrypt_data_file(SealedBox(PRIVATE_KEY))
+
+        self.assertEqual(upload.data_file.name, original_name)
 
-# Create your tests here.
+        with open(upload.data_file.path, 'rb') as decrypted_file:
+            self.assertEqual(decrypted_file.read(), b'bundle content' * 1000)
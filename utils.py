@@ -1,47 +1,33 @@
 #pylint: disable=line-too-long
 
-import base64
-import hashlib
+from __future__ import print_function
 
-from nacl.public import SealedBox, PublicKey
-from nacl.secret import SecretBox
+import contextlib
+import multiprocessing
+import sys
+import time
+import traceback
+import zipfile
 
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
 from passive_data_kit.models import DataPoint
 
-PENDING_POINTS_LIMIT = 1000
+from .batch_writer import active_batch_writer, finish_batch_inserts, insert_data_points, queue_batch_insert, BatchWriter, PENDING_POINTS_LIMIT # pylint: disable=unused-import
+from .crypto import decrypt_content, decrypt_stream, digest_chunks, encrypt_content, encrypt_many, encrypt_stream, envelope_encryption, hash_content, hash_many, is_stream_encrypted, secret_decrypt_content, secret_encrypt_content, STREAM_CHUNK_SIZE, STREAM_EXTENSION # pylint: disable=unused-import
+from .crypto import envelope_key, hash_memo, ENVELOPE_KEYS, HASH_MEMOS
+from .encryption_executor import encryption_executor # pylint: disable=unused-import
+from .workers import initialize_worker
 
-PENDING_POINTS = []
+IMPORT_WORKER = {}
 
-def hash_content(cleartext):
-    if settings.PDK_EXTERNAL_CONTENT_DISABLE_HASHING is not False:
-        return 'hashing-disabled:%s' % cleartext.decode('utf-8')
+INCLUDE_DATA = {}
 
-    sha512 = hashlib.sha512()
-
-    sha512.update(settings.PDK_EXTERNAL_CONTENT_PUBLIC_KEY.encode('utf-8'))
-    sha512.update(cleartext.encode('utf-8'))
-
-    return sha512.hexdigest()
-
-def encrypt_content(cleartext):
-    if settings.PDK_EXTERNAL_CONTENT_DISABLE_ENCRYPTION is not False:
-        return 'encryption-disabled:%s' % cleartext.decode('utf-8')
-
-    box = SealedBox(PublicKey(base64.b64decode(settings.PDK_EXTERNAL_CONTENT_PUBLIC_KEY)))
-
-    return base64.b64encode(box.encrypt(cleartext)).decode('ascii')
-
-def secret_encrypt_content(cleartext):
-    box = SecretBox(base64.b64decode(settings.PDK_EXTERNAL_CONTENT_SYMETRIC_KEY))
-
-    return base64.b64encode(box.encrypt(cleartext))
-
-def secret_decrypt_content(cleartext):
-    box = SecretBox(base64.b64decode(settings.PDK_EXTERNAL_CONTENT_SYMETRIC_KEY))
-
-    return box.decrypt(base64.b64decode(cleartext))
+INCLUDE_DATA_WINDOW_TTL = 60
 
 def create_engagement_event(source, identifier, start, outgoing_engagement=None, incoming_engagement=None, engagement_type='unknown', duration=0): # pylint: disable=too-many-arguments, too-many-positional-arguments
     metadata = {
@@ -68,22 +54,235 @@ def create_engagement_event(source, identifier, start, outgoing_engagement=None,
 
     queue_batch_insert(point)
 
-def queue_batch_insert(data_point, force_insert=False):
-    if force_insert is True or len(PENDING_POINTS) >= PENDING_POINTS_LIMIT:
-        DataPoint.objects.bulk_create(PENDING_POINTS)
-
-        del PENDING_POINTS[:]
+def import_processes():
+    if hasattr(multiprocessing, 'get_context') is False: # Python 2 cannot spawn workers.
+        return 1
 
-    if data_point is not None:
-        PENDING_POINTS.append(data_point)
-
-def finish_batch_inserts():
-    queue_batch_insert(None, force_insert=True)
-
-def include_data(identifier, created_date, data_point):
     try:
-        return settings.PASSIVE_DATA_KIT_EXTERNAL_INCLUDE_DATA_FUNCTION(identifier, created_date, data_point)
+        return settings.PDK_EXTERNAL_IMPORT_PROCESSES
     except AttributeError:
         pass
 
+    return 1
+
+def import_bundle_member(task):
+    import_member, request_identifier, path, content_file, envelope = task
+
+    if IMPORT_WORKER.get('path', None) != path:
+        if IMPORT_WORKER.get('bundle', None) is not None:
+            IMPORT_WORKER['bundle'].close()
+
+        IMPORT_WORKER['path'] = path
+        IMPORT_WORKER['bundle'] = zipfile.ZipFile(path) # pylint: disable=consider-using-with
+        IMPORT_WORKER['context'] = {}
+
+    error = None
+
+    with hash_memo() as memo, BatchWriter(collect=True) as batch_writer:
+        try:
+            if envelope is None:
+                import_member(request_identifier, IMPORT_WORKER['bundle'], content_file, IMPORT_WORKER['context'])
+            else:
+                with envelope_key(*envelope):
+                    import_member(request_identifier, IMPORT_WORKER['bundle'], content_file, IMPORT_WORKER['context'])
+        except: # pylint: disable=bare-except
+            error = traceback.format_exc()
+
+        return (batch_writer.take(), error, (memo.hits, memo.misses))
+
+@contextlib.contextmanager
+def checkpoint_member(batch_writer, data_file, member):
+    '''
+    Imports a bundle member as a unit of batch_writer, recording a completed
+    ExternalDataImportCheckpoint for data_file in the same transaction. If the member
+    fails, its points are discarded and the checkpoint stays incomplete.
+    '''
+
+    if data_file is None:
+        yield
+
+        return
+
+    checkpoint = data_file.checkpoints.get_or_create(member=member)[0]
+
+    records = batch_writer.records
+
+    def record_checkpoint():
+        checkpoint.records = batch_writer.records - records
+        checkpoint.completed = timezone.now()
+        checkpoint.save()
+
+    with batch_writer.unit(on_commit=record_checkpoint):
+        yield
+
+def import_bundle(request_identifier, path, import_member, data_file=None, batch_writer=None): # pylint: disable=too-many-branches, too-many-arguments, too-many-positional-arguments, too-many-locals
+    '''
+    Calls import_member(request_identifier, content_bundle, content_file, context) for
+    each member of the zip bundle at path, stopping at the first member that raises.
+
+    When PDK_EXTERNAL_IMPORT_PROCESSES is greater than one, members are parsed in that
+    many worker processes. Workers queue nothing to the database themselves: they return
+    their points (already summarized, see store_annotation_summaries), which are queued
+    here in bundle order, so the outcome matches a serial import.
+
+    When data_file is provided, each member is checkpointed (see checkpoint_member) and
+    members completed by an earlier attempt are skipped.
+    '''
+
+    processes = import_processes()
+
+    if batch_writer is None:
+        batch_writer = active_batch_writer()
+
+    completed_members = set()
+
+    if data_file is not None:
+        completed_members.update(data_file.checkpoints.exclude(completed=None).values_list('member', flat=True))
+
+        if completed_members:
+            print('Resuming import of ' + path + ' after ' + str(len(completed_members)) + ' completed members...')
+
+    with zipfile.ZipFile(path) as content_bundle:
+        content_files = [content_file for content_file in content_bundle.namelist() if (content_file in completed_members) is False]
+
+        if processes <= 1 or len(content_files) < 2:
+            context = {}
+
+            for content_file in content_files:
+                try:
+                    with checkpoint_member(batch_writer, data_file, content_file):
+                        import_member(request_identifier, content_bundle, content_file, context)
+                except: # pylint: disable=bare-except
+                    traceback.print_exc()
+                    return False
+
+            return True
+
+    # Spawned (not forked) workers, so no database connection is shared with this process.
+
+    with multiprocessing.get_context('spawn').Pool(min(processes, len(content_files)), initializer=initialize_worker) as pool: # Exiting terminates the workers.
+        envelope = getattr(ENVELOPE_KEYS, 'envelope', None)
+
+        if envelope is not None:
+            envelope = (envelope[0], bytes(envelope[1])) # Workers rebuild the SecretBox from the raw key.
+
+        tasks = ((import_member, request_identifier, path, content_file, envelope) for content_file in content_files)
+
+        memo = getattr(HASH_MEMOS, 'memo', None)
+
+        for content_file, (points, error, hash_stats) in zip(content_files, pool.imap(import_bundle_member, tasks)):
+            if memo is not None:
+                memo.hits += hash_stats[0]
+                memo.misses += hash_stats[1]
+
+            if error is not None:
+                if data_file is None:
+                    for point in points:
+                        batch_writer.queue(point, summarize=False)
+
+                print(error, end='')
+                sys.stdout.flush()
+
+                return False
+
+            with checkpoint_member(batch_writer, data_file, content_file):
+                for point in points:
+                    batch_writer.queue(point, summarize=False)
+
     return True
+
+@contextlib.contextmanager
+def assert_max_queries(max_queries, using='default'):
+    '''
+    Raises AssertionError if the block runs more than max_queries queries on the using
+    connection. Queries run by an asynchronous BatchWriter thread are not counted.
+    '''
+
+    with CaptureQueriesContext(connections[using]) as context:
+        yield context
+
+    if len(context.captured_queries) > max_queries:
+        raise AssertionError('%d queries executed, expected at most %d.' % (len(context.captured_queries), max_queries))
+
+class DataWindow(object): # pylint: disable=useless-object-inheritance
+    '''
+    Set of (start, end) creation date intervals to import for a request identifier, as
+    returned by PASSIVE_DATA_KIT_EXTERNAL_INCLUDE_DATA_WINDOW_FUNCTION. Either end of an
+    interval may be None to leave it open.
+    '''
+
+    def __init__(self, intervals):
+        self.intervals = list(intervals)
+
+    def includes(self, created_date):
+        return self.overlaps(created_date, created_date)
+
+    def overlaps(self, start, end):
+        for interval_start, interval_end in self.intervals:
+            if (interval_start is None or end >= interval_start) and (interval_end is None or start <= interval_end):
+                return True
+
+        return False
+
+def include_data_function():
+    if ('function' in INCLUDE_DATA) is False:
+        INCLUDE_DATA['function'] = getattr(settings, 'PASSIVE_DATA_KIT_EXTERNAL_INCLUDE_DATA_FUNCTION', None)
+        INCLUDE_DATA['window_function'] = getattr(settings, 'PASSIVE_DATA_KIT_EXTERNAL_INCLUDE_DATA_WINDOW_FUNCTION', None)
+        INCLUDE_DATA['windows'] = {}
+
+    return INCLUDE_DATA['function']
+
+def reset_include_data(**kwargs): # pylint: disable=unused-argument
+    INCLUDE_DATA.clear()
+
+setting_changed.connect(reset_include_data)
+
+def include_data_window(identifier):
+    '''
+    Returns the DataWindow for identifier, or None if every date may be included. Windows
+    are cached for INCLUDE_DATA_WINDOW_TTL seconds, so they are looked up once per import
+    rather than once per record.
+    '''
+
+    include_data_function()
+
+    if INCLUDE_DATA['window_function'] is None:
+        return None
+
+    window, expires = INCLUDE_DATA['windows'].get(identifier, (None, 0))
+
+    if expires < time.time():
+        intervals = INCLUDE_DATA['window_function'](identifier)
+
+        window = None if intervals is None else DataWindow(intervals)
+
+        INCLUDE_DATA['windows'][identifier] = (window, time.time() + INCLUDE_DATA_WINDOW_TTL)
+
+    return window
+
+def include_data_range(identifier, start, end):
+    '''
+    Returns False if no creation date between start and end can be included for
+    identifier, so importers can skip a whole member (or thread) without parsing its
+    records.
+    '''
+
+    window = include_data_window(identifier)
+
+    if window is None:
+        return True
+
+    return window.overlaps(start, end)
+
+def include_data(identifier, created_date, data_point):
+    window = include_data_window(identifier)
+
+    if window is not None and window.includes(created_date) is False:
+        return False
+
+    function = include_data_function()
+
+    if function is None:
+        return True
+
+    return function(identifier, created_date, data_point)
@@ -21,7 +21,7 @@ from django.utils import timezone
 from passive_data_kit.models import DataSource
 
 from .models import ExternalDataSource, ExternalDataRequest, ExternalDataRequestFile
-from .utils import secret_encrypt_content, secret_decrypt_content
+from .utils import digest_chunks, secret_encrypt_content, secret_decrypt_content
 
 def pdk_external_generate_identifier(request): # pylint: disable=invalid-name, unused-argument
     identifier = None
@@ -283,6 +283,7 @@ def pdk_external_upload_data(request, token):
                     for file_item in request.FILES.getlist(source.identifier):
                         request_file = ExternalDataRequestFile(request=data_request, source=source, uploaded=timezone.now())
                         request_file.data_file = file_item
+                        request_file.content_digest = digest_chunks(file_item.chunks())
 
                         request_file.save()
 
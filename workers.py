@@ -0,0 +1,25 @@
+'''
+Entry points for spawned worker processes. A spawned worker unpickles its initializer
+before Django is set up, so this module must not import models (or utils) at import time.
+Bundle import tasks run utils.import_bundle_member after initialize_worker has set Django
+up; encryption tasks run encrypt_fields here, without Django.
+'''
+
+import base64
+
+from nacl.public import SealedBox, PublicKey
+
+import django
+
+ENCRYPTION_WORKER = {}
+
+def initialize_worker():
+    django.setup()
+
+def initialize_encryption_worker(public_key):
+    ENCRYPTION_WORKER['box'] = SealedBox(PublicKey(base64.b64decode(public_key)))
+
+def encrypt_fields(cleartexts):
+    box = ENCRYPTION_WORKER['box']
+
+    return [base64.b64encode(box.encrypt(cleartext)).decode('ascii') for cleartext in cleartexts]